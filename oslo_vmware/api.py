@@ -21,16 +21,23 @@ automatic session re-establishment and retry of API invocations
 in case of connection problems or server API call overload.
 """
 
+import functools
 import logging
+import weakref
 
-from oslo_concurrency import lockutils
+from eventlet import event
+from eventlet import greenthread
 import six
 
 from oslo.utils import excutils
+from oslo.utils import timeutils
 from oslo_vmware._i18n import _, _LE, _LI, _LW
 from oslo_vmware.common import loopingcall
 from oslo_vmware import exceptions
+from oslo_vmware import inventory_cache
 from oslo_vmware import pbm
+from oslo_vmware import retry
+from oslo_vmware import task_waiter
 from oslo_vmware import vim
 from oslo_vmware import vim_util
 
@@ -38,13 +45,25 @@ from oslo_vmware import vim_util
 LOG = logging.getLogger(__name__)
 
 
+# Long-polling methods whose latency does not reflect the server health.
+LONG_POLL_METHODS = ('WaitForUpdates', 'WaitForUpdatesEx',
+                     'wait_for_updates_ex')
+# Methods not bounded by the concurrency limiter, since the long polls
+# would hold a call slot for up to their wait time, and cancelling them
+# must not wait for a slot.
+UNLIMITED_METHODS = LONG_POLL_METHODS + ('CancelWaitForUpdates',
+                                         'cancel_wait_for_updates')
+# Interval in seconds after which a failed session pool member is leased
+# again to probe whether it recovered.
+SESSION_POOL_PROBE_INTERVAL = 30
+
+
 def _trunc_id(session_id):
     """Returns truncated session id which is suitable for logging."""
     if session_id is not None:
         return session_id[-5:]
 
 
-# TODO(vbala) Move this class to excutils.py.
 class RetryDecorator(object):
     """Decorator for retrying a function upon suggested exceptions.
 
@@ -53,6 +72,9 @@ class RetryDecorator(object):
     reached. If the max retry count is set to -1, then the decorated function
     is invoked indefinitely until an exception is thrown, and the caught
     exception is not in the list of suggested exceptions.
+
+    The retry state is kept per call; the retry count and sleep time
+    attributes report the last call of the decorated function.
     """
 
     def __init__(self, max_retry_count=-1, inc_sleep_time=10,
@@ -74,56 +96,169 @@ class RetryDecorator(object):
         :param exceptions: suggested exceptions for which the function must be
                            retried
         """
-        self._max_retry_count = max_retry_count
-        self._inc_sleep_time = inc_sleep_time
-        self._max_sleep_time = max_sleep_time
-        self._exceptions = exceptions
+        self._policy = retry.RetryPolicy(
+            max_retry_count=max_retry_count,
+            retryable=exceptions,
+            backoff=retry.LinearBackoff(inc_sleep_time, max_sleep_time))
         self._retry_count = 0
         self._sleep_time = 0
 
     def __call__(self, f):
 
-        def _func(*args, **kwargs):
-            func_name = f.__name__
-            result = None
-            try:
-                if self._retry_count:
-                    LOG.debug("Invoking %(func_name)s; retry count is "
-                              "%(retry_count)d.",
-                              {'func_name': func_name,
-                               'retry_count': self._retry_count})
-                result = f(*args, **kwargs)
-            except self._exceptions:
-                with excutils.save_and_reraise_exception() as ctxt:
-                    LOG.warn(_LW("Exception which is in the suggested list of "
-                                 "exceptions occurred while invoking function:"
-                                 " %s."),
-                             func_name,
-                             exc_info=True)
-                    if (self._max_retry_count != -1 and
-                            self._retry_count >= self._max_retry_count):
-                        LOG.error(_LE("Cannot retry upon suggested exception "
-                                      "since retry count (%(retry_count)d) "
-                                      "reached max retry count "
-                                      "(%(max_retry_count)d)."),
-                                  {'retry_count': self._retry_count,
-                                   'max_retry_count': self._max_retry_count})
-                    else:
-                        ctxt.reraise = False
-                        self._retry_count += 1
-                        self._sleep_time += self._inc_sleep_time
-                        return self._sleep_time
-            raise loopingcall.LoopingCallDone(result)
-
         def func(*args, **kwargs):
-            loop = loopingcall.DynamicLoopingCall(_func, *args, **kwargs)
-            evt = loop.start(periodic_interval_max=self._max_sleep_time)
-            LOG.debug("Waiting for function %s to return.", f.__name__)
-            return evt.wait()
+            state = retry.RetryState()
+            try:
+                return self._policy.call_with_state(state, f, *args,
+                                                    **kwargs)
+            finally:
+                self._retry_count = state.retries
+                self._sleep_time = state.last_delay
 
         return func
 
 
+class SessionLivenessTracker(object):
+    """Tracks the liveness of a session using its successful API calls.
+
+    A session which was used successfully within the validity window is
+    considered active without asking the server.
+    """
+
+    def __init__(self, validity_window):
+        """Initializes the tracker.
+
+        :param validity_window: time in seconds a successful API call proves
+                                the session to be active; 0 disables the
+                                tracking
+        """
+        self._validity_window = validity_window
+        self._last_success = None
+
+    def record_success(self):
+        """Records a successful API call made using the session."""
+        self._last_success = timeutils.utcnow_ts()
+
+    def invalidate(self):
+        """Forgets the successful API calls, for e.g., on session expiry."""
+        self._last_success = None
+
+    def idle_time(self):
+        """Returns the seconds elapsed since the last successful API call.
+
+        :returns: idle time in seconds or None if there is no successful
+                  call since the last invalidation
+        """
+        if self._last_success is None:
+            return None
+        return timeutils.utcnow_ts() - self._last_success
+
+    def is_active(self):
+        """Returns whether the session is known to be active."""
+        idle_time = self.idle_time()
+        return idle_time is not None and idle_time < self._validity_window
+
+
+class SessionPool(object):
+    """Pool of authenticated sessions with the same server.
+
+    Each member is a VMwareAPISession with its own SOAP client, transport
+    and cookie jar; therefore calls leased to different members proceed in
+    parallel, and a member whose session breaks is re-created without
+    affecting the others.
+
+    A greenthread keeps using the member it leased last as long as the
+    member is healthy, since some server side state such as the token of a
+    partial RetrievePropertiesEx result is bound to the session which
+    created it. Other greenthreads lease the healthy member with the least
+    number of calls in flight. A failed member is leased for a single call
+    every probe_interval seconds, and rejoins the rotation once a call
+    leased to it succeeds.
+    """
+
+    def __init__(self, members, probe_interval=SESSION_POOL_PROBE_INTERVAL):
+        """Initializes the pool with the given member sessions.
+
+        :param members: list of VMwareAPISession objects
+        :param probe_interval: interval in seconds after which a failed
+                               member is leased again
+        """
+        if not members:
+            raise ValueError(_("Session pool must have at least one member"))
+        self._members = members
+        self._probe_interval = probe_interval
+        self._in_flight = dict((id(member), 0) for member in members)
+        self._failures = dict((id(member), 0) for member in members)
+        # Time of the last failure or probe of each failed member.
+        self._probed_at = {}
+        self._affinity = weakref.WeakKeyDictionary()
+
+    @property
+    def members(self):
+        return list(self._members)
+
+    def _is_healthy(self, member):
+        return self._failures[id(member)] == 0
+
+    def _get_probe(self):
+        now = timeutils.utcnow_ts()
+        for member in self._members:
+            key = id(member)
+            if (not self._is_healthy(member) and
+                    now - self._probed_at[key] >= self._probe_interval):
+                self._probed_at[key] = now
+                return member
+
+    def _choose(self):
+        current = greenthread.getcurrent()
+        member = self._affinity.get(current)
+        if member is not None and self._is_healthy(member):
+            return member
+        member = self._get_probe()
+        if member is not None:
+            LOG.debug("Probing failed session pool member: %s.",
+                      _trunc_id(member._session_id))
+            return member
+        member = min(self._members,
+                     key=lambda m: (self._failures[id(m)],
+                                    self._in_flight[id(m)]))
+        self._affinity[current] = member
+        return member
+
+    def invoke(self, call):
+        """Invokes the given callable with a leased member.
+
+        :param call: callable which accepts the leased member session
+        :returns: return value of param call
+        """
+        member = self._choose()
+        key = id(member)
+        self._in_flight[key] += 1
+        try:
+            result = call(member)
+        except (exceptions.VimConnectionException,
+                exceptions.VimSessionOverLoadException):
+            self._failures[key] += 1
+            self._probed_at[key] = timeutils.utcnow_ts()
+            self._affinity.pop(greenthread.getcurrent(), None)
+            LOG.debug("Session pool member: %(session)s failed "
+                      "%(count)d time(s) in a row.",
+                      {'session': _trunc_id(member._session_id),
+                       'count': self._failures[key]})
+            raise
+        finally:
+            self._in_flight[key] -= 1
+        self._failures[key] = 0
+        self._probed_at.pop(key, None)
+        return result
+
+    def get_stats(self):
+        """Returns the in-flight call and consecutive failure counts."""
+        return [{'session': _trunc_id(member._session_id),
+                 'in_flight': self._in_flight[id(member)],
+                 'failures': self._failures[id(member)]}
+                for member in self._members]
+
+
 class VMwareAPISession(object):
     """Setup a session with the server and handles all calls made to it.
 
@@ -138,7 +273,11 @@ class VMwareAPISession(object):
     def __init__(self, host, server_username, server_password,
                  api_retry_count, task_poll_interval, scheme='https',
                  create_session=True, wsdl_loc=None, pbm_wsdl_loc=None,
-                 port=443, cacert=None, insecure=True):
+                 port=443, cacert=None, insecure=True,
+                 use_task_waiter=False, pool_size=1,
+                 use_soap_fast_path=False, session_validity_window=0,
+                 keep_alive_interval=0, retry_policy=None,
+                 circuit_breaker=None, concurrency_limiter=None):
         """Initializes the API session with given parameters.
 
         :param host: ESX/VC server IP address or host name
@@ -158,6 +297,37 @@ class VMwareAPISession(object):
                        TLS (https) server certificate.
         :param insecure: Verify HTTPS connections using system certificates,
                          used only if cacert is not specified
+        :param use_task_waiter: whether to wait for tasks using property
+                                collector updates instead of polling each
+                                task every task_poll_interval seconds
+        :param pool_size: number of sessions established with the server;
+                          if greater than 1, API calls are spread over a
+                          pool of independently authenticated sessions
+        :param use_soap_fast_path: whether to invoke the most frequently used
+                                   VIM methods using pre-compiled SOAP
+                                   envelopes instead of suds marshalling
+        :param session_validity_window: time in seconds a successful API
+                                        call proves the session to be active,
+                                        which saves the SessionIsActive calls
+                                        upon empty responses; 0 disables it
+        :param keep_alive_interval: idle time in seconds after which a
+                                    background greenthread checks the
+                                    session, re-creating it if expired; 0
+                                    disables the keep-alive
+        :param retry_policy: retry.RetryPolicy used for the API calls; by
+                             default, calls failing due to session overload
+                             or connection problems are retried up to
+                             api_retry_count times with an exponential,
+                             jittered backoff; a retry.RetryBudget can be
+                             set in a custom policy
+        :param circuit_breaker: circuit_breaker.CircuitBreaker through which
+                                each API call attempt is made; it should be
+                                shared by the sessions with the same server
+                                endpoint. None disables it.
+        :param concurrency_limiter: circuit_breaker.ConcurrencyLimiter which
+                                    bounds the number of API calls in
+                                    progress, shedding the excess calls;
+                                    None disables it
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException
         """
@@ -176,6 +346,42 @@ class VMwareAPISession(object):
         self._pbm = None
         self._cacert = cacert
         self._insecure = insecure
+        self._use_soap_fast_path = use_soap_fast_path
+        self._liveness = SessionLivenessTracker(session_validity_window)
+        self._keep_alive_interval = keep_alive_interval
+        self._keep_alive_loop = None
+        self._login_flight = None
+        if retry_policy is None:
+            retry_policy = retry.RetryPolicy(
+                max_retry_count=api_retry_count,
+                retryable=(exceptions.VimSessionOverLoadException,
+                           exceptions.VimConnectionException),
+                backoff=retry.ExponentialBackoff())
+        self._retry_policy = retry_policy
+        self._circuit_breaker = circuit_breaker
+        self._concurrency_limiter = concurrency_limiter
+        self._pool = None
+        if pool_size > 1:
+            members = [self]
+            for i in range(pool_size - 1):
+                members.append(VMwareAPISession(
+                    host, server_username, server_password, api_retry_count,
+                    task_poll_interval, scheme=scheme,
+                    create_session=create_session, wsdl_loc=wsdl_loc,
+                    pbm_wsdl_loc=pbm_wsdl_loc, port=port, cacert=cacert,
+                    insecure=insecure,
+                    use_soap_fast_path=use_soap_fast_path,
+                    session_validity_window=session_validity_window,
+                    keep_alive_interval=keep_alive_interval,
+                    retry_policy=retry_policy,
+                    circuit_breaker=circuit_breaker,
+                    concurrency_limiter=concurrency_limiter))
+            self._pool = SessionPool(members)
+        self._task_waiter = None
+        if use_task_waiter:
+            self._task_waiter = task_waiter.TaskWaiter(
+                self._get_collector_session())
+        self._inventory_cache = None
         if create_session:
             self._create_session()
 
@@ -183,6 +389,29 @@ class VMwareAPISession(object):
         self._pbm_wsdl_loc = pbm_wsdl_loc
         self._pbm = None
         LOG.info(_LI('PBM WSDL updated to %s'), pbm_wsdl_loc)
+        for member in self._other_pool_members():
+            member.pbm_wsdl_loc_set(pbm_wsdl_loc)
+
+    def _get_collector_session(self):
+        """Returns the session used by the property collector users.
+
+        A property collector is bound to the session which created it;
+        therefore its users stick to a single session of the pool.
+        """
+        return self._pool.members[-1] if self._pool else self
+
+    @property
+    def inventory_cache(self):
+        """Inventory cache kept up to date by property collector updates."""
+        if self._inventory_cache is None:
+            self._inventory_cache = inventory_cache.InventoryCache(
+                self._get_collector_session())
+        return self._inventory_cache
+
+    def _other_pool_members(self):
+        if self._pool is None:
+            return []
+        return [member for member in self._pool.members if member is not self]
 
     @property
     def vim(self):
@@ -192,7 +421,8 @@ class VMwareAPISession(object):
                                 port=self._port,
                                 wsdl_url=self._vim_wsdl_loc,
                                 cacert=self._cacert,
-                                insecure=self._insecure)
+                                insecure=self._insecure,
+                                use_fast_path=self._use_soap_fast_path)
         return self._vim
 
     @property
@@ -212,12 +442,34 @@ class VMwareAPISession(object):
         return self._pbm
 
     @RetryDecorator(exceptions=(exceptions.VimConnectionException,))
-    @lockutils.synchronized('oslo_vmware_api_lock')
     def _create_session(self):
-        """Establish session with the server."""
-        # Another thread might have created the session while the current one
-        # was waiting for the lock.
-        if self._session_id and self.is_current_session_active():
+        """Establish session with the server.
+
+        Concurrent callers share a single flight: the first caller checks
+        the session and logs in if needed, while the others wait for the
+        outcome of its attempt. Sessions do not block each other.
+        """
+        flight = self._login_flight
+        if flight is not None:
+            LOG.debug("Waiting for the session being established by another "
+                      "caller.")
+            return flight.wait()
+
+        flight = event.Event()
+        self._login_flight = flight
+        try:
+            self._login()
+        except Exception as excep:
+            self._login_flight = None
+            flight.send_exception(excep)
+            raise
+        self._login_flight = None
+        flight.send()
+
+    def _login(self):
+        # The session might have been re-created by the flight which the
+        # caller missed.
+        if self._session_id and self._is_session_known_active():
             LOG.debug("Current session: %s is active.",
                       _trunc_id(self._session_id))
             return
@@ -235,9 +487,11 @@ class VMwareAPISession(object):
         # object. We can't use the username used for login since the Login
         # method ignores the case.
         self._session_username = session.userName
+        self._liveness.record_success()
         LOG.info(_LI("Successfully established new session; session ID is "
                      "%s."),
                  _trunc_id(self._session_id))
+        self._start_keep_alive()
 
         # Set PBM client cookie.
         if self._pbm is not None:
@@ -249,9 +503,11 @@ class VMwareAPISession(object):
             LOG.info(_LI("Logging out and terminating the current session "
                          "with ID = %s."),
                      _trunc_id(self._session_id))
+            self._stop_keep_alive()
             try:
                 self.vim.Logout(self.vim.service_content.sessionManager)
                 self._session_id = None
+                self._liveness.invalidate()
             except Exception:
                 LOG.exception(_LE("Error occurred while logging out and "
                                   "terminating the current session with "
@@ -259,12 +515,17 @@ class VMwareAPISession(object):
                               _trunc_id(self._session_id))
         else:
             LOG.debug("No session exists to log out.")
+        for member in self._other_pool_members():
+            member.logout()
 
     def invoke_api(self, module, method, *args, **kwargs):
         """Wrapper method for invoking APIs.
 
         The API call is retried in the event of exceptions due to session
-        overload or connection problems.
+        overload or connection problems. If the session has a session pool,
+        the call is made using a session leased from the pool; references to
+        this session's vim and pbm objects in the arguments are replaced by
+        the corresponding objects of the leased session.
 
         :param module: module corresponding to the VIM API call
         :param method: method in the module which corresponds to the
@@ -273,16 +534,43 @@ class VMwareAPISession(object):
         :param kwargs: keyword arguments to the method
         :returns: response from the API call
         :raises: VimException, VimFaultException, VimAttributeException,
-                 VimSessionOverLoadException, VimConnectionException
+                 VimSessionOverLoadException, VimConnectionException,
+                 VimCircuitOpenException, VimCallRejectedException
         """
+        if self._pool is None:
+            return self._invoke_api(module, method, *args, **kwargs)
+
+        def call(member):
+            if member is self:
+                return self._invoke_api(module, method, *args, **kwargs)
+            return member._invoke_api(self._bind(member, module), method,
+                                      *[self._bind(member, arg)
+                                        for arg in args],
+                                      **dict((key, self._bind(member, value))
+                                             for key, value in
+                                             six.iteritems(kwargs)))
+
+        return self._pool.invoke(call)
+
+    def _bind(self, member, obj):
+        """Maps this session's service objects to those of param member."""
+        if obj is None:
+            return obj
+        if obj is self._vim:
+            return member.vim
+        if obj is self._pbm:
+            return member.pbm
+        return obj
+
+    def _invoke_api(self, module, method, *args, **kwargs):
+        """Invokes the API using this session, without the session pool."""
 
-        @RetryDecorator(max_retry_count=self._api_retry_count,
-                        exceptions=(exceptions.VimSessionOverLoadException,
-                                    exceptions.VimConnectionException))
         def _invoke_api(module, method, *args, **kwargs):
             try:
                 api_method = getattr(module, method)
-                return api_method(*args, **kwargs)
+                result = api_method(*args, **kwargs)
+                self._liveness.record_success()
+                return result
             except exceptions.VimFaultException as excep:
                 # If this is due to an inactive session, we should re-create
                 # the session and retry.
@@ -293,8 +581,11 @@ class VMwareAPISession(object):
                     # return the VMs in an ESX server which has no VMs in it.
                     # Also, the server responds with an empty response in the
                     # case of an inactive session. Therefore, we need a way to
-                    # differentiate between these two cases.
-                    if self.is_current_session_active():
+                    # differentiate between these two cases. A server fault
+                    # is a NotAuthenticated fault sent by the server.
+                    if excep.server_fault:
+                        self._liveness.invalidate()
+                    if self._is_session_known_active():
                         LOG.debug("Returning empty response for "
                                   "%(module)s.%(method)s invocation.",
                                   {'module': module,
@@ -338,7 +629,24 @@ class VMwareAPISession(object):
                                  exc_info=True)
                         self._create_session()
 
-        return _invoke_api(module, method, *args, **kwargs)
+        def _attempt(module, method, *args, **kwargs):
+            if self._circuit_breaker is None:
+                return _invoke_api(module, method, *args, **kwargs)
+            if method in LONG_POLL_METHODS:
+                call = self._circuit_breaker.call_untimed
+            else:
+                call = self._circuit_breaker.call
+            return call(_invoke_api, module, method, *args, **kwargs)
+
+        if (self._concurrency_limiter is None or
+                method in UNLIMITED_METHODS):
+            return self._retry_policy.call(_attempt, module, method, *args,
+                                           **kwargs)
+        # The limiter is acquired per attempt, hence no call slot is held
+        # during the backoff between the attempts.
+        return self._retry_policy.call(self._concurrency_limiter.call,
+                                       _attempt, module, method, *args,
+                                       **kwargs)
 
     def is_current_session_active(self):
         """Check if current session is active.
@@ -360,20 +668,100 @@ class VMwareAPISession(object):
                      _trunc_id(self._session_id),
                      exc_info=True)
 
+        if is_active:
+            self._liveness.record_success()
+        else:
+            self._liveness.invalidate()
         return is_active
 
+    def _is_session_known_active(self):
+        """Check if current session is active, trusting recent API calls.
+
+        :returns: True if the session is active; False otherwise
+        """
+        if self._liveness.is_active():
+            LOG.debug("Current session: %s was used successfully within the "
+                      "validity window.",
+                      _trunc_id(self._session_id))
+            return True
+        return self.is_current_session_active()
+
+    def _start_keep_alive(self):
+        if not self._keep_alive_interval or self._keep_alive_loop:
+            return
+        self._keep_alive_loop = loopingcall.FixedIntervalLoopingCall(
+            self._keep_alive)
+        self._keep_alive_loop.start(self._keep_alive_interval,
+                                    initial_delay=self._keep_alive_interval)
+
+    def _stop_keep_alive(self):
+        if self._keep_alive_loop is not None:
+            self._keep_alive_loop.stop()
+            self._keep_alive_loop = None
+
+    def _keep_alive(self):
+        """Checks the session if it has been idle for keep_alive_interval."""
+        idle_time = self._liveness.idle_time()
+        if idle_time is not None and idle_time < self._keep_alive_interval:
+            return
+        if self.is_current_session_active():
+            return
+        LOG.warn(_LW("Current session: %s is inactive; re-creating the "
+                     "session in the background."),
+                 _trunc_id(self._session_id))
+        try:
+            self._create_session()
+        except exceptions.VimException:
+            LOG.warn(_LW("Error occurred while re-creating the session in "
+                         "the background."),
+                     exc_info=True)
+
+    def iter_objects(self, type_, max_objects, properties_to_collect=None,
+                     all_properties=False):
+        """Iterate over all managed objects of the given type.
+
+        The first page of the result is retrieved by this call; the
+        subsequent pages are retrieved only when the objects of the current
+        page have been consumed. Each page is retrieved using invoke_api,
+        hence the retrievals are retried upon session or connection related
+        errors. If the iteration is stopped early, the retrieval is
+        cancelled once the returned iterator is closed or garbage collected.
+
+        :param type_: type of the managed object
+        :param max_objects: maximum number of objects that should be returned
+                            in a single call
+        :param properties_to_collect: names of the managed object properties
+                                      to be collected
+        :param all_properties: whether all properties of the managed object
+                               need to be collected
+        :returns: vim_util.RetrieveResultIterator over the ObjectContent data
+                  objects of the managed objects of the given type
+        :raises: VimException, VimFaultException, VimAttributeException,
+                 VimSessionOverLoadException, VimConnectionException
+        """
+        retrieve_result = self.invoke_api(
+            vim_util, 'get_objects', self.vim, type_, max_objects,
+            properties_to_collect=properties_to_collect,
+            all_properties=all_properties)
+        return vim_util.iter_retrieve_result(
+            self.vim, retrieve_result,
+            invoke=functools.partial(self.invoke_api, vim_util))
+
     def wait_for_task(self, task):
         """Waits for the given task to complete and returns the result.
 
-        The task is polled until it is done. The method returns the task
-        information upon successful completion. In case of any error,
-        appropriate exception is raised.
+        The task is polled until it is done, or if the session uses a task
+        waiter, the task state changes are received from the property
+        collector. The method returns the task information upon successful
+        completion. In case of any error, appropriate exception is raised.
 
         :param task: managed object reference of the task
         :returns: task info upon successful completion of the task
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException
         """
+        if self._task_waiter is not None:
+            return self._task_waiter.wait(task)
         loop = loopingcall.FixedIntervalLoopingCall(self._poll_task, task)
         evt = loop.start(self._task_poll_interval)
         LOG.debug("Waiting for the task: %s to complete.", task)
@@ -410,11 +798,7 @@ class VMwareAPISession(object):
                 LOG.debug("Task: %s status is success.", task)
                 raise loopingcall.LoopingCallDone(task_info)
             else:
-                error_msg = six.text_type(task_info.error.localizedMessage)
-                error = task_info.error
-                name = error.fault.__class__.__name__
-                task_ex = exceptions.get_fault_class(name)(error_msg)
-                raise task_ex
+                raise exceptions.translate_fault(task_info.error)
 
     def wait_for_lease_ready(self, lease):
         """Waits for the given lease to be ready.
@@ -0,0 +1,277 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Circuit breaker and concurrency limiter for the calls made to a server.
+
+A CircuitBreaker keeps the outcome and latency of the most recent calls
+made to a server. While the server is healthy the circuit is closed and
+calls go through. If the failure rate or the latency percentile of the
+recent calls exceeds its threshold, the circuit opens and calls fail fast
+with VimCircuitOpenException instead of adding load to the server. After
+reset_timeout seconds the circuit is half-open: a limited number of trial
+calls go through, and the circuit closes if they succeed or opens again if
+one of them fails.
+
+A ConcurrencyLimiter bounds the number of calls in progress; calls beyond
+the limit wait for a free slot up to a timeout and are rejected with
+VimCallRejectedException if the wait queue is full or the timeout expires.
+"""
+
+import collections
+import logging
+import time
+
+from eventlet import semaphore
+
+from oslo_vmware._i18n import _, _LI, _LW
+from oslo_vmware import exceptions
+
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Exceptions which indicate that the server is unhealthy; other exceptions,
+# such as a VimFaultException for a missing file, are outcomes of a healthy
+# server.
+FAILURE_EXCEPTIONS = (exceptions.VimSessionOverLoadException,
+                      exceptions.VimConnectionException)
+
+
+class CircuitBreaker(object):
+    """Fails calls fast while the server is unhealthy.
+
+    A circuit breaker instance can be shared by all the sessions with the
+    same server so that they observe its health together.
+
+    Example:
+        breaker = CircuitBreaker('vc1.example.com:443')
+        result = breaker.call(func, *args, **kwargs)
+    """
+
+    def __init__(self, name, window_size=50, min_calls=10,
+                 failure_rate_threshold=0.5, latency_threshold=None,
+                 latency_percentile=90, reset_timeout=30,
+                 half_open_max_calls=1):
+        """Initializes the circuit breaker.
+
+        :param name: name of the server endpoint used in the log messages
+        :param window_size: number of recent calls whose outcome is kept
+        :param min_calls: minimum number of calls in the window before the
+                          circuit can open
+        :param failure_rate_threshold: ratio of failed calls in the window
+                                       at which the circuit opens
+        :param latency_threshold: latency in seconds at which the circuit
+                                  opens if reached by latency_percentile of
+                                  the calls in the window; None disables it
+        :param latency_percentile: percentile compared with latency_threshold
+        :param reset_timeout: time in seconds after which an open circuit
+                              lets trial calls through
+        :param half_open_max_calls: number of concurrent trial calls allowed
+                                    while the circuit is half-open
+        """
+        self._name = name
+        self._window = collections.deque(maxlen=window_size)
+        self._min_calls = min_calls
+        self._failure_rate_threshold = failure_rate_threshold
+        self._latency_threshold = latency_threshold
+        self._latency_percentile = latency_percentile
+        self._reset_timeout = reset_timeout
+        self._half_open_max_calls = half_open_max_calls
+        self._state = CLOSED
+        self._opened_at = None
+        self._trial_calls = 0
+
+    @property
+    def state(self):
+        """Current state of the circuit: CLOSED, OPEN or HALF_OPEN."""
+        if (self._state == OPEN and
+                time.time() - self._opened_at >= self._reset_timeout):
+            self._state = HALF_OPEN
+            self._trial_calls = 0
+        return self._state
+
+    def call(self, func, *args, **kwargs):
+        """Calls the given function if the circuit allows it.
+
+        :param func: function to call
+        :param args: arguments of the function
+        :param kwargs: keyword arguments of the function
+        :returns: return value of the function
+        :raises: VimCircuitOpenException if the circuit is open
+        """
+        return self._call(True, func, args, kwargs)
+
+    def call_untimed(self, func, *args, **kwargs):
+        """Same as call(), without recording the latency of the call.
+
+        Used for long-polls such as WaitForUpdatesEx, whose latency does not
+        reflect the health of the server.
+        """
+        return self._call(False, func, args, kwargs)
+
+    def _call(self, track_latency, func, args, kwargs):
+        trial = self._acquire()
+        start_time = time.time()
+        try:
+            result = func(*args, **kwargs)
+        except FAILURE_EXCEPTIONS:
+            self._record(False, None, trial)
+            raise
+        except Exception:
+            self._record(True, None, trial)
+            raise
+        latency = time.time() - start_time if track_latency else None
+        self._record(True, latency, trial)
+        return result
+
+    def get_stats(self):
+        """Returns the state and the failure rate of the recent calls."""
+        return {'state': self.state,
+                'calls': len(self._window),
+                'failure_rate': self._failure_rate(),
+                'latency': self._latency()}
+
+    def _acquire(self):
+        state = self.state
+        if state == CLOSED:
+            return False
+        if (state == HALF_OPEN and
+                self._trial_calls < self._half_open_max_calls):
+            self._trial_calls += 1
+            return True
+        raise exceptions.VimCircuitOpenException(
+            _("Calls to %s are suspended since the server is unhealthy.") %
+            self._name)
+
+    def _record(self, success, latency, trial):
+        if trial:
+            self._trial_calls = max(self._trial_calls - 1, 0)
+            if self._state != HALF_OPEN:
+                return
+            if success:
+                LOG.info(_LI("Closing the circuit of %s."), self._name)
+                self._state = CLOSED
+                self._window.clear()
+            else:
+                self._open()
+            return
+        if self._state != CLOSED:
+            # Outcome of a call made before the circuit opened.
+            return
+        self._window.append((success, latency))
+        if len(self._window) < self._min_calls:
+            return
+        if self._failure_rate() >= self._failure_rate_threshold:
+            self._open()
+        elif self._latency_threshold is not None:
+            latency = self._latency()
+            if latency is not None and latency >= self._latency_threshold:
+                self._open()
+
+    def _open(self):
+        LOG.warn(_LW("Opening the circuit of %(name)s for %(timeout)s "
+                     "seconds; failure rate: %(rate).02f, latency: "
+                     "%(latency)s."),
+                 {'name': self._name,
+                  'timeout': self._reset_timeout,
+                  'rate': self._failure_rate(),
+                  'latency': self._latency()})
+        self._state = OPEN
+        self._opened_at = time.time()
+
+    def _failure_rate(self):
+        if not self._window:
+            return 0.0
+        failures = len([1 for success, latency in self._window
+                        if not success])
+        return float(failures) / len(self._window)
+
+    def _latency(self):
+        latencies = sorted(latency for success, latency in self._window
+                           if latency is not None)
+        if not latencies:
+            return None
+        index = int(round(self._latency_percentile / 100.0 *
+                          (len(latencies) - 1)))
+        return latencies[index]
+
+
+class ConcurrencyLimiter(object):
+    """Bounds the number of calls in progress, shedding the excess calls.
+
+    Example:
+        limiter = ConcurrencyLimiter(20, max_waiting=10, wait_timeout=5)
+        result = limiter.call(func, *args, **kwargs)
+    """
+
+    def __init__(self, max_concurrent, max_waiting=0, wait_timeout=None):
+        """Initializes the limiter.
+
+        :param max_concurrent: maximum number of calls in progress
+        :param max_waiting: maximum number of calls waiting for a free slot;
+                            calls beyond it are rejected immediately
+        :param wait_timeout: maximum time in seconds a call waits for a free
+                             slot; None means no limit
+        """
+        self._max_concurrent = max_concurrent
+        self._max_waiting = max_waiting
+        self._wait_timeout = wait_timeout
+        self._semaphore = semaphore.Semaphore(max_concurrent)
+        self._in_progress = 0
+        self._waiting = 0
+        self._rejected = 0
+
+    def call(self, func, *args, **kwargs):
+        """Calls the given function once a slot is free.
+
+        :param func: function to call
+        :param args: arguments of the function
+        :param kwargs: keyword arguments of the function
+        :returns: return value of the function
+        :raises: VimCallRejectedException if the call is shed
+        """
+        if not self._semaphore.acquire(blocking=False):
+            if self._waiting >= self._max_waiting:
+                self._reject()
+            self._waiting += 1
+            try:
+                acquired = self._semaphore.acquire(
+                    timeout=self._wait_timeout)
+            finally:
+                self._waiting -= 1
+            if not acquired:
+                self._reject()
+        self._in_progress += 1
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self._in_progress -= 1
+            self._semaphore.release()
+
+    def get_stats(self):
+        """Returns the in-progress, waiting and rejected call counts."""
+        return {'in_progress': self._in_progress,
+                'waiting': self._waiting,
+                'rejected': self._rejected}
+
+    def _reject(self):
+        self._rejected += 1
+        raise exceptions.VimCallRejectedException(
+            _("Call rejected since %d calls are in progress.") %
+            self._max_concurrent)
@@ -79,6 +79,16 @@ class VimConnectionException(VimException):
     pass
 
 
+class VimCircuitOpenException(VimException):
+    """Thrown when calls are rejected since the server is unhealthy."""
+    pass
+
+
+class VimCallRejectedException(VimException):
+    """Thrown when a call is shed since too many calls are in progress."""
+    pass
+
+
 class VimAttributeException(VimException):
     """Thrown when a particular attribute cannot be found."""
     pass
@@ -87,7 +97,8 @@ class VimAttributeException(VimException):
 class VimFaultException(VimException):
     """Exception thrown when there are faults during VIM API calls."""
 
-    def __init__(self, fault_list, message, cause=None, details=None):
+    def __init__(self, fault_list, message, cause=None, details=None,
+                 server_fault=False):
         super(VimFaultException, self).__init__(message, cause)
         if not isinstance(fault_list, list):
             raise ValueError(_("fault_list must be a list"))
@@ -95,6 +106,9 @@ class VimFaultException(VimException):
             raise ValueError(_("details must be a dict"))
         self.fault_list = fault_list
         self.details = details
+        # Whether the fault was sent by the server rather than set by a
+        # check of the response.
+        self.server_fault = server_fault
 
     if six.PY2:
         __unicode__ = lambda self: self.description
@@ -120,6 +134,11 @@ class ImageTransferException(VimException):
     pass
 
 
+class ImageChecksumMismatchException(ImageTransferException):
+    """Thrown when the digest of the transferred data is not the expected."""
+    pass
+
+
 class VMwareDriverException(Exception):
     """Base VMware Driver Exception
 
@@ -251,6 +270,18 @@ def get_fault_class(name):
     return fault_class
 
 
+def translate_fault(localized_method_fault):
+    """Produce the exception registered for the given fault.
+
+    :param localized_method_fault: LocalizedMethodFault data object such as
+                                   the error reported in a task info
+    :returns: instance of the exception class registered for the fault
+    """
+    error_msg = six.text_type(localized_method_fault.localizedMessage)
+    name = localized_method_fault.fault.__class__.__name__
+    return get_fault_class(name)(error_msg)
+
+
 def register_fault_class(name, exception):
     fault_class = _fault_classes_registry.get(name)
     if not issubclass(exception, VMwareDriverException):
@@ -0,0 +1,379 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Pool of persistent HTTP connections to the datastore and NFC endpoints.
+
+Connections returned by an HTTPConnectionPool are regular HTTP(S)
+connections whose close() method returns the connection to the pool
+instead of closing the socket if the response to its last request was
+read to the end and the server did not ask to close the connection. The
+next request to the same host then reuses the connection, avoiding the
+TCP and TLS handshakes. New HTTPS connections to a host resume the TLS
+session of the previous connection to the host when possible.
+
+Idle connections are closed once they have been idle for idle_timeout
+seconds or if the server closed them, and at most max_per_host idle
+connections are kept per host.
+"""
+
+import collections
+import logging
+import select
+import ssl
+import time
+
+from eventlet import patcher
+import six.moves.http_client as httplib
+
+from oslo_vmware._i18n import _
+
+
+LOG = logging.getLogger(__name__)
+
+DEFAULT_MAX_PER_HOST = 4
+DEFAULT_IDLE_TIMEOUT = 30
+
+_threading = patcher.original('threading')
+
+# SSL contexts and HTTPSConnection(context=...) are available from Python
+# 2.7.9 and 3.4; TLS session resumption needs Python 3.6.
+_HAS_SSL_CONTEXT = hasattr(ssl, 'create_default_context')
+_HAS_TLS_SESSION = hasattr(ssl, 'SSLSession')
+
+
+class _PooledHTTPResponse(httplib.HTTPResponse):
+    """HTTP response which releases its connection when closed."""
+
+    discarded = False
+    connection = None
+
+    _reading = False
+    _closed_in_read = False
+
+    def read(self, amt=None):
+        return self._read_body(httplib.HTTPResponse.read, amt)
+
+    if hasattr(httplib.HTTPResponse, 'readinto'):
+        def readinto(self, b):
+            return self._read_body(httplib.HTTPResponse.readinto, b)
+
+    def close(self):
+        if self._reading:
+            # On Python 2, read() closes the response once it reaches the
+            # end of the body; the connection is released when it returns.
+            self._closed_in_read = True
+        elif not self._is_complete():
+            # The body was not read to the end, so the connection is left
+            # in the middle of the response.
+            self.discarded = True
+        httplib.HTTPResponse.close(self)
+        if not self._reading:
+            self._release()
+
+    def _read_body(self, read, *args):
+        reading = self._reading
+        self._reading = True
+        try:
+            return read(self, *args)
+        except Exception:
+            # The state of the connection is unknown after a failed read.
+            self.discarded = True
+            raise
+        finally:
+            self._reading = reading
+            if not reading and self._closed_in_read:
+                self._closed_in_read = False
+                if not self._is_complete():
+                    # The server closed the connection before sending the
+                    # whole body.
+                    self.discarded = True
+                self._release()
+
+    def _is_complete(self):
+        if self.chunked:
+            # The file of the response is released once the last chunk and
+            # the trailer have been read; a truncated body fails the read.
+            return self.fp is None
+        return self.length == 0
+
+    def _release(self):
+        if self.connection is not None:
+            self.connection._response_closed(self)
+
+
+class _PooledConnectionMixin(object):
+    """Returns the connection to its pool when it is closed."""
+
+    response_class = _PooledHTTPResponse
+
+    _pool = None
+    _pool_key = None
+    _response = None
+
+    def putrequest(self, *args, **kwargs):
+        self._response = None
+        return httplib.HTTPConnection.putrequest(self, *args, **kwargs)
+
+    def getresponse(self):
+        response = httplib.HTTPConnection.getresponse(self)
+        response.connection = self
+        self._response = response
+        return response
+
+    def close(self):
+        """Returns the connection to the pool if it can be reused."""
+        if self._is_reusable():
+            self._response = None
+            self._pool._put(self)
+        else:
+            self._response = None
+            self._close_socket()
+
+    def _close_socket(self):
+        httplib.HTTPConnection.close(self)
+
+    def _response_closed(self, response):
+        if response is self._response:
+            self.close()
+
+    def _is_reusable(self):
+        response = self._response
+        return (self._pool is not None and
+                self.sock is not None and
+                response is not None and
+                response.isclosed() and
+                not response.discarded and
+                not response.will_close)
+
+
+class _HTTPConnection(_PooledConnectionMixin, httplib.HTTPConnection):
+    pass
+
+
+class _HTTPSConnection(_PooledConnectionMixin, httplib.HTTPSConnection):
+
+    def connect(self):
+        httplib.HTTPConnection.connect(self)
+        kwargs = {}
+        if self._pool is not None and _HAS_TLS_SESSION:
+            session = self._pool._get_tls_session(self._pool_key)
+            if session is not None:
+                kwargs['session'] = session
+        self.sock = self._context.wrap_socket(self.sock,
+                                              server_hostname=self.host,
+                                              **kwargs)
+        if self._pool is not None:
+            self._pool._record_handshake(self._pool_key, self.sock)
+
+
+class _LegacyHTTPSConnection(_PooledConnectionMixin, httplib.HTTPSConnection):
+    """HTTPS connection for Pythons without SSL contexts.
+
+    The server certificate is not verified and TLS sessions are not
+    resumed, as with a plain httplib.HTTPSConnection.
+    """
+
+
+class HTTPConnectionPool(object):
+    """Per-host pool of keep-alive HTTP connections.
+
+    Example:
+        pool = HTTPConnectionPool()
+        conn = pool.get('https', 'esx1.example.com:443')
+        conn.request('GET', path)
+        response = conn.getresponse()
+        data = response.read()
+        conn.close()
+    """
+
+    def __init__(self, max_per_host=DEFAULT_MAX_PER_HOST,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        """Initializes the pool.
+
+        :param max_per_host: maximum number of idle connections kept per
+                             host; connections released beyond it are
+                             closed
+        :param idle_timeout: time in seconds after which an idle connection
+                             is closed
+        """
+        self._max_per_host = max_per_host
+        self._idle_timeout = idle_timeout
+        # Idle connections and the time they were released, per host.
+        self._idle = collections.defaultdict(collections.deque)
+        self._tls_sessions = {}
+        self._ssl_contexts = {}
+        self._lock = _threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        self._resumed = 0
+
+    def get(self, scheme, netloc, cacerts=False):
+        """Returns a connection to the given host.
+
+        An idle connection to the host is reused if there is one; otherwise
+        a new connection is created, which connects when its first request
+        is sent. Closing the connection returns it to the pool.
+
+        :param scheme: protocol-- http or https
+        :param netloc: host name or IP address and optional port of the
+                       server
+        :param cacerts: CA bundle file or whether to verify the server
+                        certificate; used for https on Pythons with SSL
+                        contexts, the certificate is never verified on
+                        older ones
+        :returns: HTTP(S) connection
+        :raises: ValueError
+        """
+        if scheme not in ('http', 'https'):
+            excep_msg = _("Invalid scheme: %s.") % scheme
+            LOG.error(excep_msg)
+            raise ValueError(excep_msg)
+        if not cacerts:
+            cacerts = False
+        key = (scheme, netloc, cacerts)
+        while True:
+            with self._lock:
+                self._evict_expired(key)
+                idle = self._idle.get(key)
+                if not idle:
+                    self._misses += 1
+                    break
+                conn, idle_since = idle.pop()
+            # Checked without holding the lock since select() may switch to
+            # another greenthread.
+            if self._is_dropped(conn):
+                with self._lock:
+                    self._evictions += 1
+                conn._close_socket()
+                continue
+            with self._lock:
+                self._hits += 1
+            LOG.debug("Reusing HTTP connection to %s.", netloc)
+            return conn
+
+        if scheme == 'http':
+            conn = _HTTPConnection(netloc)
+        elif not _HAS_SSL_CONTEXT:
+            conn = _LegacyHTTPSConnection(netloc)
+        else:
+            conn = _HTTPSConnection(netloc,
+                                    context=self._get_context(cacerts))
+        conn._pool = self
+        conn._pool_key = key
+        return conn
+
+    def evict_idle(self):
+        """Closes the connections idle for longer than the idle timeout."""
+        with self._lock:
+            for key in list(self._idle):
+                self._evict_expired(key)
+
+    def clear(self):
+        """Closes all the idle connections."""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn, idle_since in idle:
+                    conn._close_socket()
+            self._idle.clear()
+            self._tls_sessions.clear()
+
+    def get_stats(self):
+        """Returns the connection reuse counters of the pool."""
+        with self._lock:
+            return {'hits': self._hits,
+                    'misses': self._misses,
+                    'evictions': self._evictions,
+                    'resumed_sessions': self._resumed,
+                    'idle': sum(len(idle) for idle in self._idle.values())}
+
+    def _put(self, conn):
+        key = conn._pool_key
+        self._save_tls_session(key, conn.sock)
+        with self._lock:
+            self._evict_expired(key)
+            idle = self._idle[key]
+            if len(idle) >= self._max_per_host:
+                self._evictions += 1
+                conn._close_socket()
+                return
+            idle.append((conn, time.time()))
+
+    def _evict_expired(self, key):
+        idle = self._idle.get(key)
+        if not idle:
+            return
+        now = time.time()
+        # The least recently released connections are on the left.
+        while idle and now - idle[0][1] >= self._idle_timeout:
+            conn, idle_since = idle.popleft()
+            self._evictions += 1
+            conn._close_socket()
+        if not idle:
+            del self._idle[key]
+
+    def _is_dropped(self, conn):
+        if conn.sock is None:
+            return True
+        try:
+            # An idle connection is readable only if the server closed it
+            # or sent unexpected data.
+            return bool(select.select([conn.sock], [], [], 0)[0])
+        except (select.error, ValueError):
+            return True
+
+    def _get_context(self, cacerts):
+        context = self._ssl_contexts.get(cacerts)
+        if context is None:
+            if cacerts is False:
+                context = ssl.create_default_context()
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+            elif cacerts is True:
+                context = ssl.create_default_context()
+            else:
+                context = ssl.create_default_context(cafile=cacerts)
+            self._ssl_contexts[cacerts] = context
+        return context
+
+    def _get_tls_session(self, key):
+        return self._tls_sessions.get(key)
+
+    def _record_handshake(self, key, sock):
+        if getattr(sock, 'session_reused', False):
+            self._resumed += 1
+        self._save_tls_session(key, sock)
+
+    def _save_tls_session(self, key, sock):
+        if not _HAS_TLS_SESSION:
+            return
+        # With TLS 1.3 the session tickets are received after the
+        # handshake, so the session is saved again when the connection is
+        # released.
+        session = getattr(sock, 'session', None)
+        if session is not None:
+            self._tls_sessions[key] = session
+
+
+_default_pool = None
+
+
+def get_default_pool():
+    """Returns the connection pool shared by the handles and datastores."""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = HTTPConnectionPool()
+    return _default_pool
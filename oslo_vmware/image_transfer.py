@@ -17,43 +17,301 @@
 Functions and classes for image transfer between ESX/VC & image service.
 """
 
+import collections
 import errno
+import functools
+import hashlib
+import io
+import json
 import logging
+import os
+import tempfile
+import time
 
 from eventlet import event
+from eventlet import greenpool
 from eventlet import greenthread
+from eventlet import patcher
 from eventlet import queue
 from eventlet import timeout
+from eventlet import tpool
+import six
+from six.moves import builtins
+from six.moves import http_client as httplib
 
 from oslo_vmware._i18n import _
 from oslo_vmware import constants
 from oslo_vmware import exceptions
 from oslo_vmware.objects import datastore as ds_obj
+from oslo_vmware import retry
 from oslo_vmware import rw_handles
-from oslo_vmware import vim_util
 
 
 LOG = logging.getLogger(__name__)
 
+# The native thread primitives, even if the threading module is monkey
+# patched.
+_threading = patcher.original('threading')
+_time = patcher.original('time')
+
 IMAGE_SERVICE_POLL_INTERVAL = 5
-FILE_READ_WRITE_TASK_SLEEP_TIME = 0.01
+# Delay in seconds before the first retry of an image status poll; the
+# delay doubles after every poll up to IMAGE_SERVICE_POLL_INTERVAL.
+IMAGE_STATUS_INITIAL_DELAY = 0.05
 BLOCKING_QUEUE_SIZE = 10
+# Default capacity in bytes of the ring buffer of the transfers using one.
+RING_BUFFER_SIZE = BLOCKING_QUEUE_SIZE * rw_handles.READ_CHUNKSIZE
+# Limits of the chunk size in adaptive chunking mode.
+MAX_ADAPTIVE_CHUNK_SIZE = 4 * 1024 * 1024
+ADAPTIVE_CHUNK_WINDOW = 16
+ADAPTIVE_CHUNK_MIN_GAIN = 1.1
+# Size of the segments of a resumable upload; the segments are the extents
+# of a split flat VMDK, which must be multiples of the sector size and at
+# most 2 GB.
+SEGMENT_SIZE = 1024 * 1024 * 1024
+MAX_SEGMENT_SIZE = 2 * 1024 * 1024 * 1024
+SECTOR_SIZE = 512
+SEGMENT_RETRY_COUNT = 3
+# Period in seconds over which TransferScheduler measures the throughput.
+THROUGHPUT_WINDOW = 10
+
+SPLIT_FLAT_DESCRIPTOR_TEMPLATE = """# Disk DescriptorFile
+version=1
+CID=fffffffe
+parentCID=ffffffff
+createType="twoGbMaxExtentFlat"
+
+# Extent description
+%(extents)s
+
+# The Disk Data Base
+#DDB
+
+ddb.adapterType = "%(adapter_type)s"
+ddb.virtualHWVersion = "4"
+"""
+
+
+class BufferPool(object):
+    """Pool of reusable fixed size buffers.
+
+    Buffers are allocated on demand up to the maximum number of buffers;
+    once all the buffers are in use, get() blocks until one is returned.
+    If the buffer size is changed, the buffers of the previous size are
+    dropped as they are returned.
+    """
+
+    def __init__(self, buffer_size, max_buffers=None):
+        """Initializes the pool with the given parameters.
+
+        :param buffer_size: size of each buffer in bytes
+        :param max_buffers: maximum number of buffers; unlimited if None
+        """
+        self._buffer_size = buffer_size
+        self._max_buffers = max_buffers
+        self._allocated = 0
+        self._free = queue.LightQueue()
+
+    def get(self, buffer_size=None):
+        """Get a buffer from the pool, blocking if none is available.
+
+        :param buffer_size: size of the buffer; defaults to the current
+                            buffer size of the pool
+        """
+        if buffer_size is not None and buffer_size != self._buffer_size:
+            self._buffer_size = buffer_size
+            while not self._free.empty():
+                self._free.get()
+                self._allocated -= 1
+        while True:
+            if self._free.empty() and (self._max_buffers is None or
+                                       self._allocated < self._max_buffers):
+                self._allocated += 1
+                return bytearray(self._buffer_size)
+            buf = self._free.get()
+            if len(buf) == self._buffer_size:
+                return buf
+            self._allocated -= 1
+
+    def put(self, buf):
+        """Return a buffer obtained using get() to the pool."""
+        if len(buf) == self._buffer_size:
+            self._free.put(buf)
+        else:
+            self._allocated -= 1
+
+
+class AdaptiveChunkSizer(object):
+    """Grows the chunk size while the measured throughput keeps improving.
+
+    The throughput is measured over windows of ADAPTIVE_CHUNK_WINDOW
+    chunks. The chunk size is doubled after each window whose throughput
+    is at least ADAPTIVE_CHUNK_MIN_GAIN times that of the previous window,
+    up to the maximum chunk size; once a window shows no such gain, the
+    previous chunk size is restored and kept for the rest of the transfer.
+    """
+
+    def __init__(self, chunk_size, max_chunk_size=MAX_ADAPTIVE_CHUNK_SIZE):
+        """Initializes the sizer with the given parameters.
+
+        :param chunk_size: initial chunk size in bytes
+        :param max_chunk_size: maximum chunk size in bytes
+        """
+        self.chunk_size = chunk_size
+        self._max_chunk_size = max_chunk_size
+        self._settled = chunk_size >= max_chunk_size
+        self._last_throughput = None
+        self._window_start = None
+        self._window_bytes = 0
+        self._window_chunks = 0
+
+    def record(self, length):
+        """Record the transfer of a chunk of the given length."""
+        if self._settled:
+            return
+        now = time.time()
+        if self._window_start is None:
+            self._window_start = now
+            return
+        self._window_bytes += length
+        self._window_chunks += 1
+        if self._window_chunks < ADAPTIVE_CHUNK_WINDOW:
+            return
+        elapsed = max(now - self._window_start, 1e-6)
+        throughput = self._window_bytes / elapsed
+        if (self._last_throughput is None or
+                throughput >= self._last_throughput * ADAPTIVE_CHUNK_MIN_GAIN):
+            self._last_throughput = throughput
+            self.chunk_size = min(self.chunk_size * 2, self._max_chunk_size)
+            self._settled = self.chunk_size >= self._max_chunk_size
+        else:
+            self.chunk_size //= 2
+            self._settled = True
+        if self._settled:
+            LOG.debug("Using chunk size: %d for the transfer.",
+                      self.chunk_size)
+        self._window_start = now
+        self._window_bytes = 0
+        self._window_chunks = 0
 
 
 class BlockingQueue(queue.LightQueue):
-    """Producer-Consumer queue to share data between reader/writer threads."""
+    """Producer-Consumer queue to share data between reader/writer threads.
+
+    Besides bytes, the queue carries buffers from a pool owned by the
+    queue: the producer fills a buffer obtained using get_buffer() and
+    queues it using write_buffer(), and a consumer which can handle memory
+    views gets the buffer contents without a copy using read_view(). The
+    pool holds enough buffers for a full queue, the buffer being filled and
+    the buffer being consumed, so it is never exhausted before the queue is
+    full.
+
+    The queue also holds the chunk size the producer uses, which is either
+    fixed or adapted to the measured throughput, and its depth can be
+    limited in bytes instead of items.
+
+    If a DigestTask is given, the data written into the queue is also fed
+    to it; a pooled buffer returns to the pool once both the consumer and
+    the digest task are done with it.
+    """
 
-    def __init__(self, max_size, max_transfer_size):
+    def __init__(self, max_size, max_transfer_size, chunk_size=None,
+                 max_bytes=None, adaptive=False, digest_task=None):
         """Initializes the queue with the given parameters.
 
         :param max_size: maximum queue size; if max_size is less than zero or
-                         None, the queue size is infinite.
+                         None, the queue size is infinite. Ignored if
+                         max_bytes is set.
         :param max_transfer_size: maximum amount of data that can be
                                   _transferred using this queue
+        :param chunk_size: size of the chunks read by the producer; defaults
+                           to rw_handles.READ_CHUNKSIZE
+        :param max_bytes: maximum amount of data in the queue in bytes
+        :param adaptive: whether to grow the chunk size while the measured
+                         throughput keeps improving
+        :param digest_task: DigestTask computing the digests of the data
         """
+        if max_bytes:
+            max_size = None
         queue.LightQueue.__init__(self, max_size)
         self._max_transfer_size = max_transfer_size
         self._transferred = 0
+        chunk_size = chunk_size or rw_handles.READ_CHUNKSIZE
+        self._chunk_sizer = None
+        if adaptive:
+            self._chunk_sizer = AdaptiveChunkSizer(
+                chunk_size, max(chunk_size, MAX_ADAPTIVE_CHUNK_SIZE))
+        self._chunk_size = chunk_size
+        self._max_bytes = max_bytes
+        self._queued_bytes = 0
+        self._space_waiters = []
+        max_buffers = None
+        if max_size is not None and max_size >= 0:
+            max_buffers = max_size + 2
+        self._buffer_pool = BufferPool(chunk_size, max_buffers)
+        # Buffer whose contents were last returned by read_view().
+        self._view_buffer = None
+        self._digest_task = digest_task
+        # Number of users of the buffers fed to the digest task.
+        self._buffer_refs = {}
+
+    @property
+    def chunk_size(self):
+        """Size of the chunks to be written into the queue."""
+        if self._chunk_sizer is not None:
+            return self._chunk_sizer.chunk_size
+        return self._chunk_size
+
+    def _put_item(self, data_item, length):
+        if self._max_bytes:
+            # Wait until the data fits; a chunk larger than max_bytes is
+            # queued alone.
+            while (self._queued_bytes and
+                   self._queued_bytes + length > self._max_bytes):
+                waiter = event.Event()
+                self._space_waiters.append(waiter)
+                waiter.wait()
+            self._queued_bytes += length
+        if self._chunk_sizer is not None:
+            self._chunk_sizer.record(length)
+        if self._digest_task is not None and length:
+            if isinstance(data_item, tuple):
+                buf = data_item[0]
+                self._buffer_refs[id(buf)] = 2
+                self._digest_task.feed(memoryview(buf)[:length],
+                                       functools.partial(self._put_buffer,
+                                                         buf))
+            else:
+                self._digest_task.feed(data_item)
+        self.put(data_item)
+
+    def _put_buffer(self, buf):
+        refs = self._buffer_refs.get(id(buf))
+        if refs is not None:
+            if refs > 1:
+                self._buffer_refs[id(buf)] = refs - 1
+                return
+            del self._buffer_refs[id(buf)]
+        self._buffer_pool.put(buf)
+
+    def _read_item(self):
+        if (self._max_transfer_size == 0 or
+                self._transferred < self._max_transfer_size):
+            data_item = self.get()
+            if isinstance(data_item, tuple):
+                length = data_item[1]
+            else:
+                length = len(data_item)
+            self._transferred += length
+            if self._max_bytes:
+                self._queued_bytes -= length
+                waiters, self._space_waiters = self._space_waiters, []
+                for waiter in waiters:
+                    waiter.send()
+            return data_item
+        else:
+            LOG.debug("Completed transfer of size %s.", self._transferred)
+            return b""
 
     def read(self, chunk_size):
         """Read data from the queue.
@@ -63,21 +321,58 @@ class BlockingQueue(queue.LightQueue):
         by the image reader thread is the same as the chunks asked for by the
         image writer thread.
         """
-        if (self._max_transfer_size is 0 or
-                self._transferred < self._max_transfer_size):
-            data_item = self.get()
-            self._transferred += len(data_item)
-            return data_item
-        else:
-            LOG.debug("Completed transfer of size %s.", self._transferred)
-            return ""
+        data_item = self._read_item()
+        if isinstance(data_item, tuple):
+            buf, length = data_item
+            data_item = memoryview(buf)[:length].tobytes()
+            self._put_buffer(buf)
+        return data_item
+
+    def read_view(self):
+        """Read data from the queue without copying it.
+
+        The returned data is either bytes or a memoryview of a pooled
+        buffer, which stays valid until the next read_view() call.
+        """
+        self._release_view_buffer()
+        data_item = self._read_item()
+        if isinstance(data_item, tuple):
+            buf, length = data_item
+            self._view_buffer = buf
+            data_item = memoryview(buf)[:length]
+        return data_item
+
+    def _release_view_buffer(self):
+        if self._view_buffer is not None:
+            self._put_buffer(self._view_buffer)
+            self._view_buffer = None
 
     def write(self, data):
         """Write data into the queue.
 
         :param data: data to be written
         """
-        self.put(data)
+        self._put_item(data, len(data))
+
+    def get_buffer(self):
+        """Get an empty buffer to be filled and queued using write_buffer().
+
+        The buffer size is the current chunk size. This method blocks until
+        a buffer is available.
+        """
+        return self._buffer_pool.get(self.chunk_size)
+
+    def write_buffer(self, buf, length):
+        """Queue the first length bytes of a buffer from get_buffer().
+
+        :param buf: buffer obtained using get_buffer()
+        :param length: number of bytes of data in the buffer
+        """
+        self._put_item((buf, length), length)
+
+    def release_buffer(self, buf):
+        """Return an unused buffer obtained using get_buffer()."""
+        self._buffer_pool.put(buf)
 
     # Below methods are provided in order to enable treating the queue
     # as a file handle.
@@ -94,17 +389,531 @@ class BlockingQueue(queue.LightQueue):
         return self._transferred
 
     def close(self):
-        pass
+        self._release_view_buffer()
 
     def __str__(self):
         return "blocking queue"
 
 
+class ByteRingBuffer(object):
+    """Byte-bounded ring buffer to share data between reader/writer threads.
+
+    Unlike BlockingQueue, which holds the chunks as they are written, the
+    ring buffer copies the data into a fixed buffer, so that the memory
+    used by a transfer does not depend on the chunk size of the source.
+    Small chunks are coalesced and the consumer reads chunks of the chunk
+    size, and chunks larger than the buffer are split.
+
+    The producer blocks once the buffer is filled up to the high watermark
+    and resumes once it is drained down to the low watermark, so that it
+    is not woken up for every chunk the consumer reads. The consumer waits
+    for a full chunk unless the producer is blocked or the data ends.
+
+    The buffer supports the interfaces of BlockingQueue used by
+    FileReadWriteTask: the producer can read into the free space of the
+    buffer using get_buffer() and write_buffer(), and the consumer can
+    write out the data without a copy using read_view(). The data fed to
+    a DigestTask stays in the buffer until it is hashed.
+    """
+
+    def __init__(self, capacity, max_transfer_size, chunk_size=None,
+                 low_watermark=None, high_watermark=None, adaptive=False,
+                 digest_task=None):
+        """Initializes the ring buffer with the given parameters.
+
+        :param capacity: size of the buffer in bytes
+        :param max_transfer_size: maximum amount of data that can be
+                                  transferred using this buffer; 0 if the
+                                  end of the data is signalled by writing
+                                  empty data
+        :param chunk_size: size of the chunks read by the consumer and the
+                           producer; defaults to rw_handles.READ_CHUNKSIZE
+        :param low_watermark: fill level in bytes at which a blocked
+                              producer resumes; defaults to half the high
+                              watermark
+        :param high_watermark: fill level in bytes at which the producer
+                               blocks; defaults to the capacity
+        :param adaptive: whether to grow the chunk size while the measured
+                         throughput keeps improving
+        :param digest_task: DigestTask computing the digests of the data
+        :raises: ValueError if the watermarks are invalid
+        """
+        high_watermark = high_watermark or capacity
+        if low_watermark is None:
+            low_watermark = high_watermark // 2
+        if not 0 <= low_watermark < high_watermark <= capacity:
+            raise ValueError(_("Watermarks must satisfy 0 <= low watermark "
+                               "< high watermark <= capacity."))
+        self._capacity = capacity
+        self._buffer = memoryview(bytearray(capacity))
+        self._high_watermark = high_watermark
+        self._low_watermark = low_watermark
+        self._max_transfer_size = max_transfer_size
+        chunk_size = chunk_size or rw_handles.READ_CHUNKSIZE
+        self._chunk_size = chunk_size
+        self._chunk_sizer = None
+        if adaptive:
+            self._chunk_sizer = AdaptiveChunkSizer(
+                chunk_size, max(chunk_size, MAX_ADAPTIVE_CHUNK_SIZE))
+        self._digest_task = digest_task
+        # Total bytes written, read and hashed.
+        self._written = 0
+        self._consumed = 0
+        self._hashed = 0
+        self._view_length = 0
+        self._eof = False
+        self._producer_waiter = None
+        self._consumer_waiter = None
+        self._max_fill = 0
+        self._producer_waits = 0
+        self._consumer_waits = 0
+
+    @property
+    def chunk_size(self):
+        """Size of the chunks to be written into the buffer."""
+        if self._chunk_sizer is not None:
+            return self._chunk_sizer.chunk_size
+        return self._chunk_size
+
+    def _fill(self):
+        released = self._consumed
+        if self._digest_task is not None:
+            released = min(released, self._hashed)
+        return self._written - released
+
+    def _wake_producer(self):
+        if (self._producer_waiter is not None and
+                self._fill() <= self._low_watermark):
+            waiter, self._producer_waiter = self._producer_waiter, None
+            waiter.send()
+
+    def _wake_consumer(self):
+        if self._consumer_waiter is not None:
+            waiter, self._consumer_waiter = self._consumer_waiter, None
+            waiter.send()
+
+    def _wait_for_space(self):
+        """Wait until data can be written; returns the writable length."""
+        if self._fill() >= self._high_watermark:
+            self._producer_waits += 1
+            # Let the consumer take the data it is waiting to coalesce.
+            self._wake_consumer()
+            while self._fill() > self._low_watermark:
+                self._producer_waiter = event.Event()
+                self._producer_waiter.wait()
+        start = self._written % self._capacity
+        return min(self._high_watermark - self._fill(),
+                   self._capacity - start)
+
+    def _commit(self, length):
+        start = self._written % self._capacity
+        self._written += length
+        self._max_fill = max(self._max_fill, self._fill())
+        if self._chunk_sizer is not None:
+            self._chunk_sizer.record(length)
+        if self._digest_task is not None:
+            self._digest_task.feed(self._buffer[start:start + length],
+                                   functools.partial(self._release_hashed,
+                                                     length))
+        self._wake_consumer()
+
+    def _release_hashed(self, length):
+        self._hashed += length
+        self._wake_producer()
+
+    def _release(self, length):
+        self._consumed += length
+        self._wake_producer()
+
+    def write(self, data):
+        """Write data into the buffer, blocking while it is full.
+
+        :param data: data to be written; empty data marks its end
+        """
+        if not data:
+            self._eof = True
+            self._wake_consumer()
+            return
+        data = memoryview(data)
+        offset = 0
+        while offset < len(data):
+            length = min(len(data) - offset, self._wait_for_space())
+            start = self._written % self._capacity
+            self._buffer[start:start + length] = data[offset:offset + length]
+            offset += length
+            self._commit(length)
+
+    def get_buffer(self):
+        """Get the free space to be filled and queued using write_buffer().
+
+        The returned memory view is at most the chunk size. This method
+        blocks while the buffer is full.
+        """
+        length = min(self._wait_for_space(), self.chunk_size)
+        start = self._written % self._capacity
+        return self._buffer[start:start + length]
+
+    def write_buffer(self, buf, length):
+        """Queue the first length bytes of the space from get_buffer()."""
+        self._commit(length)
+
+    def release_buffer(self, buf):
+        """Return unused space obtained using get_buffer()."""
+        pass
+
+    def _wait_for_data(self, size):
+        """Wait for data to be read; returns the readable length."""
+        if (self._max_transfer_size and
+                self._consumed >= self._max_transfer_size):
+            LOG.debug("Completed transfer of size %s.", self._consumed)
+            return 0
+        size = min(size, self._high_watermark)
+        while True:
+            available = self._written - self._consumed
+            if (available >= size or self._eof or
+                    (available and self._producer_waiter is not None) or
+                    (self._max_transfer_size and self._consumed +
+                     available >= self._max_transfer_size)):
+                return min(available, size)
+            self._consumer_waits += 1
+            self._consumer_waiter = event.Event()
+            self._consumer_waiter.wait()
+
+    def read(self, chunk_size=None):
+        """Read up to chunk_size bytes of data from the buffer.
+
+        This method blocks until a chunk of data is available.
+        """
+        self._release_view()
+        length = self._wait_for_data(chunk_size or self.chunk_size)
+        start = self._consumed % self._capacity
+        first = min(length, self._capacity - start)
+        data = self._buffer[start:start + first].tobytes()
+        if first < length:
+            data += self._buffer[:length - first].tobytes()
+        self._release(length)
+        return data
+
+    def read_view(self):
+        """Read data from the buffer without copying it.
+
+        The returned memory view stays valid until the next read call.
+        """
+        self._release_view()
+        length = self._wait_for_data(self.chunk_size)
+        start = self._consumed % self._capacity
+        length = min(length, self._capacity - start)
+        self._view_length = length
+        return self._buffer[start:start + length]
+
+    def _release_view(self):
+        if self._view_length:
+            length, self._view_length = self._view_length, 0
+            self._release(length)
+
+    def get_stats(self):
+        """Get the fill level metrics of the buffer.
+
+        :returns: dictionary with the capacity, the current and maximum
+                  fill levels in bytes and the number of times the producer
+                  and the consumer waited
+        """
+        return {'capacity': self._capacity,
+                'fill': self._fill(),
+                'max_fill': self._max_fill,
+                'producer_waits': self._producer_waits,
+                'consumer_waits': self._consumer_waits}
+
+    def seek(self, offset, whence=0):
+        """Set the file's current position at the offset.
+
+        This method throws IOError since seek cannot be supported for a pipe.
+        """
+        raise IOError(errno.ESPIPE, "Illegal seek")
+
+    def tell(self):
+        """Get the current file position."""
+        return self._consumed
+
+    def close(self):
+        self._release_view()
+
+    def __str__(self):
+        return "ring buffer"
+
+
+class NativeBlockingQueue(object):
+    """Thread-safe bounded queue between tasks running in native threads.
+
+    It has the file-like interface of BlockingQueue, but its read() and
+    write() calls block the calling native thread instead of yielding to
+    other greenthreads, so it must not be used from a greenthread. The
+    digests of the data are computed by the producer thread as it writes
+    into the queue.
+    """
+
+    def __init__(self, max_size, max_transfer_size, chunk_size=None,
+                 digest_task=None):
+        """Initializes the queue with the given parameters.
+
+        :param max_size: maximum number of chunks in the queue
+        :param max_transfer_size: maximum amount of data that can be
+                                  transferred using this queue
+        :param chunk_size: size of the chunks read by the producer; defaults
+                           to rw_handles.READ_CHUNKSIZE
+        :param digest_task: DigestTask computing the digests of the data;
+                            it is updated without being started
+        """
+        self._max_size = max_size
+        self._max_transfer_size = max_transfer_size
+        self._transferred = 0
+        self._chunk_size = chunk_size or rw_handles.READ_CHUNKSIZE
+        self._digest_task = digest_task
+        self._items = collections.deque()
+        self._cond = _threading.Condition()
+        self._aborted = False
+
+    @property
+    def chunk_size(self):
+        """Size of the chunks to be written into the queue."""
+        return self._chunk_size
+
+    def _check_aborted(self):
+        if self._aborted:
+            raise IOError(errno.EPIPE, "Transfer aborted")
+
+    def read(self, chunk_size):
+        """Read a chunk of data from the queue, blocking until available.
+
+        The input chunk size is ignored, as in BlockingQueue.read().
+        """
+        with self._cond:
+            if (self._max_transfer_size and
+                    self._transferred >= self._max_transfer_size):
+                LOG.debug("Completed transfer of size %s.", self._transferred)
+                return b""
+            while not self._items:
+                self._check_aborted()
+                self._cond.wait()
+            data = self._items.popleft()
+            self._transferred += len(data)
+            self._cond.notify_all()
+            return data
+
+    def write(self, data):
+        """Write data into the queue, blocking while the queue is full.
+
+        :param data: data to be written
+        """
+        if self._digest_task is not None and data:
+            self._digest_task.update(data)
+        with self._cond:
+            while len(self._items) >= self._max_size:
+                self._check_aborted()
+                self._cond.wait()
+            self._check_aborted()
+            self._items.append(data)
+            self._cond.notify_all()
+
+    def abort(self):
+        """Fail the blocked and the subsequent reads and writes."""
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+    def seek(self, offset, whence=0):
+        """Set the file's current position at the offset.
+
+        This method throws IOError since seek cannot be supported for a pipe.
+        """
+        raise IOError(errno.ESPIPE, "Illegal seek")
+
+    def tell(self):
+        """Get the current file position."""
+        return self._transferred
+
+    def close(self):
+        pass
+
+    def __str__(self):
+        return "native blocking queue"
+
+
+class _ImageStatusWait(object):
+    """State of a wait for the status of an image."""
+
+    def __init__(self, context, image_service, image_id):
+        self.context = context
+        self.image_service = image_service
+        self.image_id = image_id
+        self.start_time = time.time()
+        self.next_time = self.start_time
+        self.polls = 0
+        self.done = event.Event()
+
+
+class ImageStatusWaiter(object):
+    """Waits for images to become active, batching the status polls.
+
+    The status of each image is polled with an exponential backoff, so
+    that an image which becomes active soon after its data is uploaded is
+    noticed quickly, while an image which stays in 'queued' or 'saving'
+    state for long is polled at most every max_delay seconds. A single
+    greenthread polls the images of all the waiting writers: the polls
+    due within batch_window seconds of each other are issued together,
+    concurrently, instead of each writer waking up on its own schedule.
+
+    A waiter is meant to be shared by the writers; ImageWriter uses a
+    waiter shared by the whole process unless it is given one.
+    """
+
+    def __init__(self, initial_delay=IMAGE_STATUS_INITIAL_DELAY,
+                 max_delay=IMAGE_SERVICE_POLL_INTERVAL, multiplier=2,
+                 timeout_secs=None, batch_window=None):
+        """Initializes the waiter with the given parameters.
+
+        :param initial_delay: delay in seconds before the second poll
+        :param max_delay: maximum delay in seconds between two polls
+        :param multiplier: factor by which the delay grows after every poll
+        :param timeout_secs: time in seconds after which a wait fails; no
+                             limit if None
+        :param batch_window: polls due within this time in seconds are
+                             issued together; defaults to initial_delay
+        """
+        self._backoff = retry.ExponentialBackoff(initial_delay, multiplier,
+                                                 max_delay, jitter=False)
+        self._timeout_secs = timeout_secs
+        if batch_window is None:
+            batch_window = initial_delay
+        self._batch_window = batch_window
+        self._waits = []
+        self._poller = None
+        self._wakeup = None
+
+    def wait(self, context, image_service, image_id):
+        """Wait until the image is active.
+
+        :param context: context needed by the image service
+        :param image_service: handle to image service
+        :param image_id: ID of the image in the image service
+        :returns: the meta-data of the active image
+        :raises: ImageTransferException if the image is killed, in an
+                 unknown state or the wait times out or is cancelled;
+                 the exception raised by the image service
+        """
+        status_wait = _ImageStatusWait(context, image_service, image_id)
+        self._waits.append(status_wait)
+        if self._poller is None:
+            self._poller = greenthread.spawn(self._poll_loop)
+        elif self._wakeup is not None and not self._wakeup.ready():
+            self._wakeup.send()
+        return status_wait.done.wait()
+
+    def cancel(self, image_id):
+        """Fail the waits for the given image."""
+        for status_wait in list(self._waits):
+            if status_wait.image_id == image_id:
+                self._finish(status_wait, exceptions.ImageTransferException(
+                    _("Wait for the status of image: %s is cancelled.") %
+                    image_id))
+
+    def _finish(self, status_wait, excep=None, image_meta=None):
+        if status_wait not in self._waits:
+            # The wait was cancelled while its image was being polled.
+            return
+        self._waits.remove(status_wait)
+        if excep is not None:
+            status_wait.done.send_exception(excep)
+        else:
+            status_wait.done.send(image_meta)
+
+    def _poll_loop(self):
+        pool = greenpool.GreenPool()
+        while self._waits:
+            now = time.time()
+            next_time = min(status_wait.next_time
+                            for status_wait in self._waits)
+            if next_time > now:
+                self._wakeup = event.Event()
+                with timeout.Timeout(next_time - now, False):
+                    self._wakeup.wait()
+                self._wakeup = None
+                now = max(time.time(), next_time)
+            for status_wait in list(self._waits):
+                if status_wait.next_time <= now + self._batch_window:
+                    pool.spawn_n(self._poll, status_wait)
+            pool.waitall()
+        self._poller = None
+
+    def _poll(self, status_wait):
+        # An error must end the wait; otherwise the poll loop keeps polling
+        # the image without any delay.
+        try:
+            self._poll_status(status_wait)
+        except Exception as excep:
+            self._finish(status_wait, excep)
+
+    def _poll_status(self, status_wait):
+        image_id = status_wait.image_id
+        LOG.debug("Retrieving status of image: %s.", image_id)
+        image_meta = status_wait.image_service.show(status_wait.context,
+                                                    image_id)
+        image_status = image_meta.get('status')
+        if image_status == 'active':
+            LOG.debug("Image: %s is now active.", image_id)
+            self._finish(status_wait, image_meta=image_meta)
+        elif image_status == 'killed':
+            excep_msg = _("Image: %s is in killed state.") % image_id
+            LOG.error(excep_msg)
+            self._finish(status_wait,
+                         exceptions.ImageTransferException(excep_msg))
+        elif image_status in ['saving', 'queued']:
+            status_wait.polls += 1
+            delay = self._backoff.delay(status_wait.polls)
+            now = time.time()
+            if (self._timeout_secs is not None and
+                    now + delay - status_wait.start_time >
+                    self._timeout_secs):
+                excep_msg = (_("Image: %(image)s is still in %(state)s "
+                               "state after %(timeout)s seconds.") %
+                             {'image': image_id,
+                              'state': image_status,
+                              'timeout': self._timeout_secs})
+                LOG.error(excep_msg)
+                self._finish(status_wait,
+                             exceptions.ImageTransferException(excep_msg))
+                return
+            LOG.debug("Image: %(image)s is in %(state)s state; polling "
+                      "again in %(delay).02f seconds.",
+                      {'image': image_id,
+                       'state': image_status,
+                       'delay': delay})
+            status_wait.next_time = now + delay
+        else:
+            excep_msg = (_("Image: %(image)s is in unknown state: "
+                           "%(state)s.") %
+                         {'image': image_id,
+                          'state': image_status})
+            LOG.error(excep_msg)
+            self._finish(status_wait,
+                         exceptions.ImageTransferException(excep_msg))
+
+
+_default_status_waiter = None
+
+
+def _get_default_status_waiter():
+    global _default_status_waiter
+    if _default_status_waiter is None:
+        _default_status_waiter = ImageStatusWaiter()
+    return _default_status_waiter
+
+
 class ImageWriter(object):
     """Class to write the image to the image service from an input file."""
 
     def __init__(self, context, input_file, image_service, image_id,
-                 image_meta=None):
+                 image_meta=None, status_waiter=None):
         """Initializes the image writer instance with given parameters.
 
         :param context: write context needed by the image service
@@ -112,6 +921,11 @@ class ImageWriter(object):
         :param image_service: handle to image service
         :param image_id: ID of the image in the image service
         :param image_meta: image meta-data
+        :param status_waiter: object whose wait(context, image_service,
+                              image_id) method waits until the image is
+                              active and whose cancel(image_id) method
+                              cancels the wait; defaults to an
+                              ImageStatusWaiter shared by the writers
         """
         if not image_meta:
             image_meta = {}
@@ -121,6 +935,8 @@ class ImageWriter(object):
         self._image_service = image_service
         self._image_id = image_id
         self._image_meta = image_meta
+        self._status_waiter = (status_waiter or
+                               _get_default_status_waiter())
         self._running = False
 
     def start(self):
@@ -134,9 +950,10 @@ class ImageWriter(object):
             """Task performing the image write operation.
 
             This method performs image data transfer through an update call.
-            After the update, it waits until the image state becomes
-            'active', 'killed' or unknown. If the final state is not 'active'
-            an instance of ImageTransferException is thrown.
+            After the update, it waits using the status waiter until the
+            image state becomes 'active', 'killed' or unknown. If the final
+            state is not 'active' an instance of ImageTransferException is
+            thrown.
 
             :raises: ImageTransferException
             """
@@ -151,42 +968,16 @@ class ImageWriter(object):
                                            self._image_meta,
                                            data=self._input_file)
                 self._running = True
-                while self._running:
-                    LOG.debug("Retrieving status of image: %s.",
-                              self._image_id)
-                    image_meta = self._image_service.show(self._context,
-                                                          self._image_id)
-                    image_status = image_meta.get('status')
-                    if image_status == 'active':
-                        self.stop()
-                        LOG.debug("Image: %s is now active.",
-                                  self._image_id)
-                        self._done.send(True)
-                    elif image_status == 'killed':
-                        self.stop()
-                        excep_msg = (_("Image: %s is in killed state.") %
-                                     self._image_id)
-                        LOG.error(excep_msg)
-                        excep = exceptions.ImageTransferException(excep_msg)
-                        self._done.send_exception(excep)
-                    elif image_status in ['saving', 'queued']:
-                        LOG.debug("Image: %(image)s is in %(state)s state; "
-                                  "sleeping for %(sleep)d seconds.",
-                                  {'image': self._image_id,
-                                   'state': image_status,
-                                   'sleep': IMAGE_SERVICE_POLL_INTERVAL})
-                        greenthread.sleep(IMAGE_SERVICE_POLL_INTERVAL)
-                    else:
-                        self.stop()
-                        excep_msg = (_("Image: %(image)s is in unknown "
-                                       "state: %(state)s.") %
-                                     {'image': self._image_id,
-                                      'state': image_status})
-                        LOG.error(excep_msg)
-                        excep = exceptions.ImageTransferException(excep_msg)
-                        self._done.send_exception(excep)
+                self._status_waiter.wait(self._context,
+                                         self._image_service,
+                                         self._image_id)
+                self._running = False
+                self._done.send(True)
+            except exceptions.ImageTransferException as excep:
+                self._running = False
+                self._done.send_exception(excep)
             except Exception as excep:
-                self.stop()
+                self._running = False
                 excep_msg = (_("Error occurred while writing image: %s") %
                              self._image_id)
                 LOG.exception(excep_msg)
@@ -204,7 +995,9 @@ class ImageWriter(object):
         """Stop the image writing task."""
         LOG.debug("Stopping the writing task for image: %s.",
                   self._image_id)
-        self._running = False
+        if self._running:
+            self._running = False
+            self._status_waiter.cancel(self._image_id)
 
     def wait(self):
         """Wait for the image writer task to complete.
@@ -232,6 +1025,12 @@ class FileReadWriteTask(object):
     This class defines the task which copies the given input file to the given
     output file. The copy operation involves reading chunks of data from the
     input file and writing the same to the output file.
+
+    If the output is a BlockingQueue or a ByteRingBuffer and the input
+    file supports readinto(), the data is read directly into the buffers of
+    the queue; if the input is a BlockingQueue or a ByteRingBuffer, its
+    buffers are written to the output file without copying them. The task
+    yields to the other greenthreads after each chunk.
     """
 
     def __init__(self, input_file, output_file):
@@ -256,20 +1055,12 @@ class FileReadWriteTask(object):
             self._running = True
             while self._running:
                 try:
-                    data = self._input_file.read(rw_handles.READ_CHUNKSIZE)
-                    if not data:
+                    if not self._copy():
                         LOG.debug("File read-write task is done.")
                         self.stop()
                         self._done.send(True)
-                    self._output_file.write(data)
-
-                    # update lease progress if applicable
-                    if hasattr(self._input_file, "update_progress"):
-                        self._input_file.update_progress()
-                    if hasattr(self._output_file, "update_progress"):
-                        self._output_file.update_progress()
 
-                    greenthread.sleep(FILE_READ_WRITE_TASK_SLEEP_TIME)
+                    greenthread.sleep(0)
                 except Exception as excep:
                     self.stop()
                     excep_msg = _("Error occurred during file read-write "
@@ -285,6 +1076,43 @@ class FileReadWriteTask(object):
         greenthread.spawn(_inner)
         return self._done
 
+    def _copy(self):
+        """Copy data until the task yields to the other greenthreads.
+
+        :returns: a true value unless the end of the input is reached
+        """
+        return self._copy_chunk()
+
+    def _copy_chunk(self):
+        """Copy a chunk of data from the input file to the output file.
+
+        :returns: the number of bytes copied; 0 at the end of the input
+        """
+        if (isinstance(self._output_file, (BlockingQueue, ByteRingBuffer)) and
+                hasattr(self._input_file, 'readinto')):
+            buf = self._output_file.get_buffer()
+            try:
+                length = self._input_file.readinto(buf)
+            except Exception:
+                self._output_file.release_buffer(buf)
+                raise
+            if not length:
+                self._output_file.release_buffer(buf)
+                self._output_file.write(b'')
+                return 0
+            self._output_file.write_buffer(buf, length)
+            return length
+
+        if isinstance(self._input_file, (BlockingQueue, ByteRingBuffer)):
+            data = self._input_file.read_view()
+        elif isinstance(self._output_file,
+                        (BlockingQueue, ByteRingBuffer, NativeBlockingQueue)):
+            data = self._input_file.read(self._output_file.chunk_size)
+        else:
+            data = self._input_file.read(rw_handles.READ_CHUNKSIZE)
+        self._output_file.write(data)
+        return len(data)
+
     def stop(self):
         """Stop the read-write task."""
         LOG.debug("Stopping the file read-write task.")
@@ -306,12 +1134,690 @@ class FileReadWriteTask(object):
         return string
 
 
+# Types of the files which can be used from native threads; unlike the
+# sockets, the regular files are not greened by eventlet.
+_NATIVE_FILE_TYPES = (io.IOBase,) + ((builtins.file,) if six.PY2 else ())
+
+
+def _is_native_file(file_handle):
+    """Returns whether the file can be read or written in a native thread.
+
+    The network handles use eventlet-greened sockets, which must only be
+    used from greenthreads of the hub thread.
+    """
+    return isinstance(file_handle, _NATIVE_FILE_TYPES)
+
+
+class NativeReadWriteTask(FileReadWriteTask):
+    """FileReadWriteTask copying the data in a native thread.
+
+    The data is copied in a thread of the eventlet tpool, so that the CPU
+    time spent on the copy, such as in computing the digests, does not
+    stall the other greenthreads, and concurrent transfers can use
+    multiple cores. The input or output file of the task
+    is a NativeBlockingQueue, and the other one must be a regular file, see
+    _is_native_file().
+    """
+
+    def _copy(self):
+        try:
+            return tpool.execute(self._copy_all)
+        except Exception:
+            # Unblock the task at the other end of the queue.
+            for file_handle in (self._input_file, self._output_file):
+                if isinstance(file_handle, NativeBlockingQueue):
+                    file_handle.abort()
+            raise
+
+    def _copy_all(self):
+        while self._running:
+            if not self._copy_chunk():
+                return False
+        return True
+
+    def __str__(self):
+        string = ("Native Read-Write Task <source = %s, dest = %s>" %
+                  (self._input_file, self._output_file))
+        return string
+
+
+class DigestTask(object):
+    """Task which computes digests of the data flowing through a transfer.
+
+    The data is fed to the task as it is written into the BlockingQueue and
+    hashed in a native thread, so that hashing runs in parallel with the
+    reader and writer tasks instead of slowing them down. The data items
+    queued since the last update are hashed together to amortize the
+    handoff to the native thread. Data is fed without copying it; the
+    release callback given with it is called once it is hashed.
+    """
+
+    def __init__(self, digests, max_pending=BLOCKING_QUEUE_SIZE):
+        """Initializes the task with the given parameters.
+
+        :param digests: dictionary mapping the hashlib names of the
+                        algorithms to compute to the expected hex digests;
+                        an expected digest of None is only computed
+        :param max_pending: maximum number of data items waiting to be
+                            hashed; feed() blocks beyond it
+        :raises: ValueError if an algorithm is not supported
+        """
+        self._expected = dict(digests)
+        self._hashes = dict((name, hashlib.new(name)) for name in digests)
+        self._queue = queue.LightQueue(max_pending)
+        self._running = False
+        self._done = None
+
+    def start(self):
+        """Start the digest task.
+
+        :returns: the event indicating the status of the digest task
+        """
+        self._done = event.Event()
+        self._running = True
+
+        def _inner():
+            """Task hashing the data items until the end of the data."""
+            excep = None
+            while True:
+                items = [self._queue.get()]
+                while not self._queue.empty():
+                    items.append(self._queue.get())
+                data_items = [item for item in items if item is not None]
+                try:
+                    if self._running and excep is None:
+                        tpool.execute(self._update,
+                                      [data for data, release in data_items])
+                except Exception as err:
+                    excep = err
+                    LOG.exception(_("Error occurred while computing the "
+                                    "digests of the transferred data."))
+                finally:
+                    for data, release in data_items:
+                        if release is not None:
+                            release()
+                if None in items:
+                    break
+            if excep is not None:
+                self._done.send_exception(exceptions.ImageTransferException(
+                    _("Error occurred while computing the digests of the "
+                      "transferred data."), excep))
+            else:
+                self._done.send(self.hexdigests())
+
+        greenthread.spawn(_inner)
+        return self._done
+
+    def _update(self, data_items):
+        for data in data_items:
+            for hash_obj in self._hashes.values():
+                hash_obj.update(data)
+
+    def feed(self, data, release=None):
+        """Queue data to be hashed.
+
+        :param data: bytes or memory view of the data
+        :param release: callable called once the data is hashed
+        """
+        if not self._running:
+            if release is not None:
+                release()
+            return
+        self._queue.put((data, release))
+        if not self._running and self._release_pending():
+            # The task was stopped while the data was waiting to be queued.
+            self._queue.put_nowait(None)
+
+    def update(self, data):
+        """Hash data in the calling thread, without starting the task."""
+        self._update([data])
+
+    def hexdigests(self):
+        """Get the hex digests of the data hashed so far."""
+        return dict((name, hash_obj.hexdigest())
+                    for name, hash_obj in self._hashes.items())
+
+    def finish(self):
+        """Wait until all the data is hashed and verify the digests.
+
+        :returns: dictionary mapping the algorithm names to the hex digests
+        :raises: ImageChecksumMismatchException, ImageTransferException
+        """
+        if self._done is not None:
+            self._queue.put(None)
+            digests = self._done.wait()
+        else:
+            digests = self.hexdigests()
+        for name, expected in self._expected.items():
+            if expected is not None and expected.lower() != digests[name]:
+                excep_msg = (_("The %(name)s digest: %(digest)s of the "
+                               "transferred data does not match the "
+                               "expected digest: %(expected)s.") %
+                             {'name': name,
+                              'digest': digests[name],
+                              'expected': expected})
+                LOG.error(excep_msg)
+                raise exceptions.ImageChecksumMismatchException(excep_msg)
+        LOG.debug("Digests of the transferred data: %s.", digests)
+        return digests
+
+    def _release_pending(self):
+        """Release the queued data items without hashing them.
+
+        :returns: whether the end of the data was queued
+        """
+        end = False
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is None:
+                end = True
+            elif item[1] is not None:
+                item[1]()
+        return end
+
+    def stop(self):
+        """Stop hashing; the data fed afterwards is only released."""
+        LOG.debug("Stopping the digest task.")
+        self._running = False
+        # Make room for the end of the data so that the task always ends.
+        self._release_pending()
+        self._queue.put_nowait(None)
+
+    def __str__(self):
+        return "Digest Task <%s>" % ', '.join(sorted(self._hashes))
+
+
+class TokenBucket(object):
+    """Token bucket shaping the bandwidth of the transfers sharing it.
+
+    Tokens, one per byte, accumulate at the given rate up to the burst
+    size. A consumer takes the tokens for its data up front and sleeps
+    until the bucket is no longer in debt, so that chunks larger than the
+    burst size are allowed and the waiting consumers are served in order.
+    The bucket can be shared by greenthreads and native threads; it must be
+    created in the thread running the eventlet hub.
+    """
+
+    def __init__(self, rate, burst=None):
+        """Initializes the bucket with the given parameters.
+
+        :param rate: bandwidth in bytes per second
+        :param burst: maximum number of tokens; defaults to a second of data
+        """
+        self._rate = float(rate)
+        self._burst = burst or rate
+        self._tokens = float(self._burst)
+        self._last_time = time.time()
+        self._lock = _threading.Lock()
+        self._hub_thread = _threading.current_thread()
+
+    def consume(self, amount):
+        """Take tokens for the given amount of data, waiting if needed."""
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self._tokens +
+                               (now - self._last_time) * self._rate,
+                               self._burst)
+            self._last_time = now
+            self._tokens -= amount
+            deficit = -self._tokens
+        if deficit > 0:
+            if _threading.current_thread() is self._hub_thread:
+                greenthread.sleep(deficit / self._rate)
+            else:
+                # Native threads must not switch to the hub.
+                _time.sleep(deficit / self._rate)
+
+
+class _ThrottledReadHandle(object):
+    """Read handle calling a throttle function for the data read."""
+
+    def __init__(self, file_handle, throttle):
+        self._file_handle = file_handle
+        self._throttle = throttle
+        # Keep the pooled buffer data path if the handle supports it.
+        if hasattr(file_handle, 'readinto'):
+            self.readinto = self._readinto
+
+    def read(self, chunk_size):
+        data = self._file_handle.read(chunk_size)
+        self._throttle(len(data))
+        return data
+
+    def _readinto(self, buf):
+        length = self._file_handle.readinto(buf)
+        self._throttle(length or 0)
+        return length
+
+    def __getattr__(self, name):
+        return getattr(self._file_handle, name)
+
+    def __str__(self):
+        return str(self._file_handle)
+
+
+class TransferScheduler(object):
+    """Queues transfers and runs them within concurrency and bandwidth limits.
+
+    Transfers are started in submission order as soon as the global, the
+    per-host and the per-datastore limits allow; a transfer waiting for a
+    busy host or datastore does not hold back the transfers to other hosts
+    and datastores. The data read by all the transfers is shaped by a
+    shared TokenBucket if a bandwidth is given. The scheduler is used from
+    greenthreads, except for the throttle function passed to the transfers,
+    which may be called from native threads.
+
+    Example:
+        scheduler = TransferScheduler(max_concurrent=8, max_per_host=2,
+                                      bandwidth=200 * 1024 * 1024)
+        done = scheduler.submit('esx-1', 'ds-1',
+                                download_stream_optimized_image,
+                                context, timeout_secs, image_service,
+                                image_id, **kwargs)
+        imported_vm = done.wait()
+    """
+
+    def __init__(self, max_concurrent=None, max_per_host=None,
+                 max_per_datastore=None, bandwidth=None, burst=None):
+        """Initializes the scheduler with the given limits.
+
+        :param max_concurrent: maximum number of transfers in progress
+        :param max_per_host: maximum number of transfers in progress per
+                             host
+        :param max_per_datastore: maximum number of transfers in progress
+                                  per datastore
+        :param bandwidth: total bandwidth of the transfers in bytes per
+                          second
+        :param burst: burst size of the bandwidth in bytes; see TokenBucket
+        """
+        self._max_concurrent = max_concurrent
+        self._max_per_host = max_per_host
+        self._max_per_datastore = max_per_datastore
+        self._bucket = None
+        if bandwidth:
+            self._bucket = TokenBucket(bandwidth, burst)
+        self._pending = collections.deque()
+        self._running = 0
+        self._running_per_host = collections.defaultdict(int)
+        self._running_per_datastore = collections.defaultdict(int)
+        self._completed = 0
+        self._failed = 0
+        # Guards the counters updated by the throttle function.
+        self._lock = _threading.Lock()
+        self._transferred = 0
+        # Bytes transferred per second over the throughput window.
+        self._samples = collections.deque()
+
+    def submit(self, host, datastore, func, *args, **kwargs):
+        """Queue a transfer.
+
+        The transfer function is called with a throttle keyword argument,
+        which the transfer functions of this module pass to
+        _start_transfer().
+
+        :param host: key of the host of the transfer such as its name, or
+                     None if the transfer is not limited per host
+        :param datastore: key of the datastore of the transfer, or None if
+                          the transfer is not limited per datastore
+        :param func: transfer function such as download_flat_image
+        :param args: arguments of the transfer function
+        :param kwargs: keyword arguments of the transfer function
+        :returns: event whose wait() returns the result of the transfer or
+                  raises its exception
+        """
+        done = event.Event()
+        self._pending.append((host, datastore, func, args, kwargs, done))
+        LOG.debug("Queued transfer: %(func)s to host: %(host)s and "
+                  "datastore: %(datastore)s; %(queued)d transfers are "
+                  "queued.",
+                  {'func': getattr(func, '__name__', func),
+                   'host': host,
+                   'datastore': datastore,
+                   'queued': len(self._pending)})
+        self._dispatch()
+        return done
+
+    def _can_start(self, host, datastore):
+        if (self._max_concurrent is not None and
+                self._running >= self._max_concurrent):
+            return False
+        if (host is not None and self._max_per_host is not None and
+                self._running_per_host[host] >= self._max_per_host):
+            return False
+        return (datastore is None or self._max_per_datastore is None or
+                self._running_per_datastore[datastore] <
+                self._max_per_datastore)
+
+    def _dispatch(self):
+        for request in list(self._pending):
+            host, datastore = request[:2]
+            if self._can_start(host, datastore):
+                self._pending.remove(request)
+                self._running += 1
+                self._running_per_host[host] += 1
+                self._running_per_datastore[datastore] += 1
+                greenthread.spawn(self._run, *request)
+
+    def _run(self, host, datastore, func, args, kwargs, done):
+        kwargs = dict(kwargs, throttle=self._throttle)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as excep:
+            self._failed += 1
+            done.send_exception(excep)
+        else:
+            self._completed += 1
+            done.send(result)
+        finally:
+            self._running -= 1
+            self._running_per_host[host] -= 1
+            self._running_per_datastore[datastore] -= 1
+            self._dispatch()
+
+    def _throttle(self, length):
+        if self._bucket is not None:
+            self._bucket.consume(length)
+        second = int(time.time())
+        with self._lock:
+            self._transferred += length
+            if self._samples and self._samples[-1][0] == second:
+                self._samples[-1][1] += length
+            else:
+                self._samples.append([second, length])
+                while self._samples[0][0] <= second - THROUGHPUT_WINDOW:
+                    self._samples.popleft()
+
+    def get_stats(self):
+        """Get the queue depth and throughput of the transfers.
+
+        :returns: dictionary with the number of queued, running, completed
+                  and failed transfers, the bytes transferred and the
+                  throughput in bytes per second over the last
+                  THROUGHPUT_WINDOW seconds
+        """
+        second = int(time.time())
+        with self._lock:
+            transferred = self._transferred
+            recent = sum(length for sample_time, length in self._samples
+                         if sample_time > second - THROUGHPUT_WINDOW)
+        return {'queued': len(self._pending),
+                'running': self._running,
+                'completed': self._completed,
+                'failed': self._failed,
+                'transferred': transferred,
+                'throughput': float(recent) / THROUGHPUT_WINDOW}
+
+
+class UploadCheckpoint(object):
+    """Progress of a resumable upload persisted in a local JSON file.
+
+    The checkpoint records the segments which have been uploaded; it is
+    discarded if it was written for another upload or segment size.
+    """
+
+    def __init__(self, path, upload_id, total_size, segment_size):
+        """Loads the checkpoint from the given file if it exists.
+
+        :param path: path of the local checkpoint file
+        :param upload_id: identifier of the upload such as the image ID
+        :param total_size: size of the uploaded data in bytes
+        :param segment_size: size of the segments in bytes
+        """
+        self._path = path
+        self._state = {'upload_id': upload_id,
+                       'total_size': total_size,
+                       'segment_size': segment_size,
+                       'completed': []}
+        try:
+            with open(path) as checkpoint_file:
+                state = json.load(checkpoint_file)
+        except (IOError, OSError, ValueError):
+            return
+        if all(state.get(key) == self._state[key]
+               for key in ('upload_id', 'total_size', 'segment_size')):
+            LOG.debug("Resuming upload: %(upload)s with completed segments: "
+                      "%(completed)s.",
+                      {'upload': upload_id,
+                       'completed': state.get('completed')})
+            self._state = state
+
+    def is_completed(self, index):
+        return index in self._state['completed']
+
+    def mark_completed(self, index):
+        """Records the upload of a segment and saves the checkpoint."""
+        self._state['completed'].append(index)
+        tmp_path = self._path + '.tmp'
+        with open(tmp_path, 'w') as checkpoint_file:
+            json.dump(self._state, checkpoint_file)
+        os.rename(tmp_path, self._path)
+
+    def remove(self):
+        """Removes the checkpoint file once the upload is complete."""
+        try:
+            os.remove(self._path)
+        except OSError:
+            pass
+
+
+def _get_split_flat_paths(file_path, segment_count):
+    """Get the descriptor and extent paths of a split flat VMDK."""
+    base = file_path
+    for suffix in ('-flat.vmdk', '.vmdk'):
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+            break
+    return (base + '.vmdk',
+            ['%s-f%03d.vmdk' % (base, index + 1)
+             for index in range(segment_count)])
+
+
+def _is_retryable_upload_error(excep):
+    if isinstance(excep, (exceptions.VimConnectionException, IOError)):
+        return True
+    # Socket errors are wrapped by the write handles.
+    return (isinstance(excep, exceptions.VimException) and
+            isinstance(excep.cause, (IOError, httplib.HTTPException)))
+
+
+def _commit_upload(write_handle):
+    """Check the response to the upload using the given write handle."""
+    response = write_handle.getresponse()
+    # Read the body so that the connection can be reused for the next file.
+    response.read()
+    if response.status not in (200, 201, 204):
+        excep_msg = (_("Upload to %(handle)s failed with status: "
+                       "%(status)d.") %
+                     {'handle': write_handle, 'status': response.status})
+        if response.status >= 500:
+            raise exceptions.VimConnectionException(excep_msg)
+        raise exceptions.VimException(excep_msg)
+
+
+def _copy_data(read_handle, write, size):
+    """Copy size bytes from the read handle using the given write function."""
+    remaining = size
+    while remaining > 0:
+        data = read_handle.read(min(remaining, rw_handles.READ_CHUNKSIZE))
+        if not data:
+            excep_msg = (_("Source ended %d bytes before the expected "
+                           "size.") % remaining)
+            raise exceptions.ImageTransferException(excep_msg)
+        data = data[:remaining]
+        write(data)
+        remaining -= len(data)
+
+
+def _upload_segments(read_handle, total_size, file_path, open_file,
+                     checkpoint_path, upload_id, segment_size=SEGMENT_SIZE,
+                     adapter_type='lsiLogic'):
+    """Upload data to a datastore as a split flat VMDK, in resumable segments.
+
+    The data is uploaded in segments, each to its own extent file. A
+    segment is spooled to a local temporary file before its upload, so
+    that only the failed segment is sent again if the upload fails. The
+    uploaded segments are recorded in a checkpoint file; if the transfer
+    is started again with the same checkpoint, the data of the uploaded
+    segments is skipped in the source. Once all the segments are uploaded,
+    a descriptor stitching the extents into a single disk is uploaded.
+
+    :param read_handle: handle to read the data from
+    :param total_size: size of the data in bytes
+    :param file_path: datastore path of the flat VMDK; the descriptor and
+                      extents are named after it
+    :param open_file: callable returning a write handle for the datastore
+                      path and size passed to it; the handle must support
+                      write() and getresponse()
+    :param checkpoint_path: path of the local checkpoint file
+    :param upload_id: identifier of the upload such as the image ID
+    :param segment_size: size of the segments in bytes
+    :param adapter_type: adapter type recorded in the descriptor
+    :returns: datastore path of the descriptor
+    :raises: ImageTransferException, VimException, VimConnectionException,
+             ValueError
+    """
+    if (segment_size % SECTOR_SIZE or segment_size <= 0 or
+            segment_size > MAX_SEGMENT_SIZE):
+        raise ValueError(_("Segment size must be a multiple of %(sector)d "
+                           "bytes and at most %(max)d bytes.") %
+                         {'sector': SECTOR_SIZE, 'max': MAX_SEGMENT_SIZE})
+    segment_count = max((total_size + segment_size - 1) // segment_size, 1)
+    descriptor_path, extent_paths = _get_split_flat_paths(file_path,
+                                                          segment_count)
+    checkpoint = UploadCheckpoint(checkpoint_path, upload_id, total_size,
+                                  segment_size)
+    policy = retry.RetryPolicy(max_retry_count=SEGMENT_RETRY_COUNT,
+                               retryable=_is_retryable_upload_error,
+                               backoff=retry.ExponentialBackoff())
+
+    def upload(path, spool, size):
+        spool.seek(0)
+        write_handle = open_file(path, size)
+        try:
+            _copy_data(spool, write_handle.write, size)
+            _commit_upload(write_handle)
+        finally:
+            write_handle.close()
+
+    extents = []
+    for index, path in enumerate(extent_paths):
+        size = min(segment_size, total_size - index * segment_size)
+        extents.append('RW %d FLAT "%s" 0' %
+                       ((size + SECTOR_SIZE - 1) // SECTOR_SIZE,
+                        os.path.basename(path)))
+        if checkpoint.is_completed(index):
+            LOG.debug("Skipping uploaded segment: %s.", path)
+            _copy_data(read_handle, lambda data: None, size)
+            continue
+        spool = tempfile.TemporaryFile()
+        try:
+            _copy_data(read_handle, spool.write, size)
+            LOG.debug("Uploading segment: %(path)s of size: %(size)d.",
+                      {'path': path, 'size': size})
+            policy.call(upload, path, spool, size)
+        finally:
+            spool.close()
+        checkpoint.mark_completed(index)
+
+    descriptor = six.BytesIO((SPLIT_FLAT_DESCRIPTOR_TEMPLATE %
+                              {'extents': '\n'.join(extents),
+                               'adapter_type': adapter_type}).encode('utf-8'))
+    size = len(descriptor.getvalue())
+    policy.call(upload, descriptor_path, descriptor, size)
+    checkpoint.remove()
+    LOG.debug("Uploaded %(size)d bytes as split flat disk: %(path)s.",
+              {'size': total_size, 'path': descriptor_path})
+    return descriptor_path
+
+
+def _start_resumable_transfer(timeout_secs, read_file_handle, max_data_size,
+                              file_path, open_file, checkpoint_path,
+                              upload_id, segment_size=None):
+    """Start a resumable transfer to a datastore; see _upload_segments().
+
+    :param timeout_secs: time in seconds to wait for the transfer to complete
+    :param read_file_handle: handle to read data from
+    :param max_data_size: size of the data in bytes
+    :param file_path: datastore path of the flat VMDK
+    :param open_file: callable returning a write handle for the datastore
+                      path and size passed to it
+    :param checkpoint_path: path of the local checkpoint file
+    :param upload_id: identifier of the upload such as the image ID
+    :param segment_size: size of the segments in bytes; defaults to
+                         SEGMENT_SIZE
+    :returns: datastore path of the descriptor
+    :raises: ImageTransferException, ValueError
+    """
+    timer = timeout.Timeout(timeout_secs)
+    try:
+        return _upload_segments(read_file_handle, max_data_size, file_path,
+                                open_file, checkpoint_path, upload_id,
+                                segment_size=segment_size or SEGMENT_SIZE)
+    except (timeout.Timeout, exceptions.VimException) as excep:
+        if isinstance(excep, exceptions.ImageTransferException):
+            raise
+        excep_msg = (_("Error occurred during resumable transfer to: %s; "
+                       "it can be resumed using the checkpoint: %s.") %
+                     (file_path, checkpoint_path))
+        LOG.exception(excep_msg)
+        if isinstance(excep, timeout.Timeout):
+            raise exceptions.ImageTransferException(excep_msg)
+        raise exceptions.ImageTransferException(excep_msg, excep)
+    finally:
+        timer.cancel()
+        read_file_handle.close()
+
+
 # Functions to perform image transfer between VMware servers and image service.
 
 
+_TRANSFER_OPTIONS = ('chunk_size', 'queue_bytes', 'ring_buffer',
+                     'adaptive_chunking', 'digests', 'native_threads',
+                     'throttle')
+
+
+def _check_resumable_options(kwargs):
+    """Check that no transfer option unsupported by resumable transfers is set.
+
+    :param kwargs: keyword arguments of the transfer
+    :raises: ValueError
+    """
+    unsupported = [key for key in _TRANSFER_OPTIONS + ('verify_checksum',)
+                   if kwargs.get(key)]
+    if unsupported:
+        excep_msg = (_("Options: %s are not supported by resumable "
+                       "transfers.") % ', '.join(unsupported))
+        LOG.error(excep_msg)
+        raise ValueError(excep_msg)
+
+
+def _get_transfer_options(kwargs, checksum=None):
+    """Get the transfer tuning options given in the keyword arguments.
+
+    :param kwargs: keyword arguments of the transfer
+    :param checksum: MD5 checksum of the image in the image service, which
+                     is verified if the verify_checksum argument is True
+    """
+    options = dict((key, kwargs[key])
+                   for key in _TRANSFER_OPTIONS if key in kwargs)
+    if kwargs.get('verify_checksum'):
+        digests = dict(options.get('digests') or {})
+        digests['md5'] = checksum
+        options['digests'] = digests
+    return options
+
+
+def _get_image_checksum(context, image_service, image_id, kwargs):
+    """Get the checksum of the image if it is to be verified."""
+    if kwargs.get('verify_checksum'):
+        return image_service.show(context, image_id).get('checksum')
+
+
 def _start_transfer(context, timeout_secs, read_file_handle, max_data_size,
                     write_file_handle=None, image_service=None, image_id=None,
-                    image_meta=None):
+                    image_meta=None, chunk_size=None, queue_bytes=None,
+                    ring_buffer=False, adaptive_chunking=False, digests=None,
+                    native_threads=False, throttle=None):
     """Start the image transfer.
 
     The image reader reads the data from the image source and writes to the
@@ -338,19 +1844,82 @@ def _start_transfer(context, timeout_secs, read_file_handle, max_data_size,
     :param image_service: image service handle
     :param image_id: ID of the image in the image service
     :param image_meta: image meta-data
-    :raises: ImageTransferException, ValueError
+    :param chunk_size: size in bytes of the chunks read from the source;
+                       defaults to rw_handles.READ_CHUNKSIZE
+    :param queue_bytes: maximum amount of data in bytes buffered between
+                        the reader and the writer; by default, the
+                        BlockingQueue holds at most BLOCKING_QUEUE_SIZE
+                        chunks and the ByteRingBuffer RING_BUFFER_SIZE
+                        bytes
+    :param ring_buffer: whether to buffer the data in a ByteRingBuffer
+                        instead of a BlockingQueue; the ring buffer bounds
+                        the memory used by sources whose chunk size is not
+                        under the control of the reader, such as image
+                        iterators
+    :param adaptive_chunking: whether to grow the chunk size while the
+                              measured throughput keeps improving
+    :param digests: dictionary mapping hashlib algorithm names to the
+                    expected hex digests of the data, or None to only
+                    compute them; see DigestTask
+    :param native_threads: whether to copy the data in native threads of
+                           the eventlet tpool, bridged by a
+                           NativeBlockingQueue, instead of greenthreads;
+                           each transfer uses two threads of the pool and
+                           queue_bytes, ring_buffer and adaptive_chunking
+                           are ignored.
+                           Since greened sockets must not be used from
+                           native threads, only transfers between regular
+                           files use them; the other transfers, such as
+                           those from or to the network handles and the
+                           image service, use greenthreads.
+    :param throttle: function called with the length of each chunk read
+                     from the source, which may block to shape the
+                     bandwidth; see TransferScheduler
+    :returns: dictionary mapping the algorithm names to the hex digests of
+              the transferred data if digests is given
+    :raises: ImageTransferException, ImageChecksumMismatchException,
+             ValueError
     """
 
+    digest_task = DigestTask(digests) if digests else None
+    if native_threads and not (_is_native_file(read_file_handle) and
+                               _is_native_file(write_file_handle)):
+        LOG.debug("Using greenthreads for the transfer since the source "
+                  "or the destination is not a regular file.")
+        native_threads = False
+    source = read_file_handle
+    if throttle is not None:
+        source = _ThrottledReadHandle(read_file_handle, throttle)
+
     # Create the blocking queue
-    blocking_queue = BlockingQueue(BLOCKING_QUEUE_SIZE, max_data_size)
+    if native_threads:
+        blocking_queue = NativeBlockingQueue(BLOCKING_QUEUE_SIZE,
+                                             max_data_size,
+                                             chunk_size=chunk_size,
+                                             digest_task=digest_task)
+        task_cls = NativeReadWriteTask
+    elif ring_buffer:
+        blocking_queue = ByteRingBuffer(queue_bytes or RING_BUFFER_SIZE,
+                                        max_data_size,
+                                        chunk_size=chunk_size,
+                                        adaptive=adaptive_chunking,
+                                        digest_task=digest_task)
+        task_cls = FileReadWriteTask
+    else:
+        blocking_queue = BlockingQueue(BLOCKING_QUEUE_SIZE, max_data_size,
+                                       chunk_size=chunk_size,
+                                       max_bytes=queue_bytes,
+                                       adaptive=adaptive_chunking,
+                                       digest_task=digest_task)
+        task_cls = FileReadWriteTask
 
     # Create the image reader
-    reader = FileReadWriteTask(read_file_handle, blocking_queue)
+    reader = task_cls(source, blocking_queue)
 
     # Create the image writer
     if write_file_handle:
         # File or VMDK in VMware datastore is the image destination
-        writer = FileReadWriteTask(blocking_queue, write_file_handle)
+        writer = task_cls(blocking_queue, write_file_handle)
     elif image_service and image_id:
         # Image service image is the destination
         writer = ImageWriter(context,
@@ -368,6 +1937,8 @@ def _start_transfer(context, timeout_secs, read_file_handle, max_data_size,
               "%(writer)s",
               {'reader': reader,
                'writer': writer})
+    if digest_task and not native_threads:
+        digest_task.start()
     reader.start()
     writer.start()
     timer = timeout.Timeout(timeout_secs)
@@ -375,6 +1946,11 @@ def _start_transfer(context, timeout_secs, read_file_handle, max_data_size,
         # Wait for the reader and writer to complete
         reader.wait()
         writer.wait()
+        if ring_buffer and not native_threads:
+            LOG.debug("Ring buffer statistics of the transfer: %s.",
+                      blocking_queue.get_stats())
+        if digest_task:
+            return digest_task.finish()
     except (timeout.Timeout, exceptions.ImageTransferException) as excep:
         excep_msg = (_("Error occurred during image transfer with reader: "
                        "%(reader)s and writer: %(writer)s") %
@@ -383,6 +1959,11 @@ def _start_transfer(context, timeout_secs, read_file_handle, max_data_size,
         LOG.exception(excep_msg)
         reader.stop()
         writer.stop()
+        if native_threads:
+            # Unblock the native threads waiting on the queue.
+            blocking_queue.abort()
+        if digest_task:
+            digest_task.stop()
 
         if isinstance(excep, exceptions.ImageTransferException):
             raise
@@ -395,7 +1976,7 @@ def _start_transfer(context, timeout_secs, read_file_handle, max_data_size,
 
 
 def download_image(image, image_meta, session, datastore, rel_path,
-                   bypass=True, timeout_secs=7200):
+                   bypass=True, timeout_secs=7200, **kwargs):
     """Transfer an image to a datastore.
 
     :param image: file-like iterator
@@ -404,29 +1985,147 @@ def download_image(image, image_meta, session, datastore, rel_path,
     :param datastore: Datastore object
     :param rel_path: path where the file will be stored in the datastore
     :param bypass: if set to True, bypass vCenter to download the image
+                   to the connected host with the fewest transfers in
+                   progress
     :param timeout_secs: time in seconds to wait for the xfer to complete
+    :param kwargs: transfer tuning options chunk_size, queue_bytes,
+                   ring_buffer and adaptive_chunking, see
+                   _start_transfer(); or the options checkpoint_path and
+                   segment_size of a resumable transfer, see
+                   _start_resumable_transfer(). The data is verified
+                   against the given digests, and against the checksum in
+                   the image metadata if verify_checksum is True. The
+                   ConnectedHostResolver choosing the host can be given as
+                   host_resolver.
+    :returns: datastore path of the descriptor of the split flat VMDK
+              written by a resumable transfer, which is named after
+              rel_path; None otherwise
+    :raises: ImageTransferException, ValueError
     """
+    if kwargs.get('checkpoint_path'):
+        _check_resumable_options(kwargs)
     image_size = int(image_meta['size'])
     method = 'PUT'
+    host = None
+    if bypass:
+        host_resolver = (kwargs.get('host_resolver') or
+                         ds_obj.get_default_host_resolver())
+        host = host_resolver.choose_host(session, datastore)
+
+        def build_url(path):
+            return datastore.build_url(session._scheme, host.name, path,
+                                       constants.ESX_DATACENTER_PATH)
+
+        def get_cookie(ds_url):
+            return ds_url.get_transfer_ticket(session, method)
+    else:
+        def build_url(path):
+            return datastore.build_url(session._scheme, session._host, path)
+
+        def get_cookie(ds_url):
+            return '%s=%s' % (constants.SOAP_COOKIE_KEY,
+                              session.vim.get_http_cookie().strip("\""))
+
+    def open_file(path, size):
+        ds_url = build_url(path)
+        conn = ds_url.connect(method, size, get_cookie(ds_url),
+                              cacert=session._cacert,
+                              insecure=session._insecure)
+        conn.write = conn.send
+        return conn
+
+    read_handle = rw_handles.ImageReadHandle(image)
+    try:
+        if kwargs.get('checkpoint_path'):
+            return _start_resumable_transfer(
+                timeout_secs, read_handle, image_size, rel_path, open_file,
+                kwargs['checkpoint_path'], image_meta.get('id', rel_path),
+                segment_size=kwargs.get('segment_size'))
+
+        ds_url = build_url(rel_path)
+        conn = ds_url.connect(method, image_size, get_cookie(ds_url),
+                              cacert=session._cacert,
+                              insecure=session._insecure)
+        if not bypass:
+            conn.write = conn.send
+        _start_transfer(None, timeout_secs, read_handle, image_size,
+                        write_file_handle=conn,
+                        **_get_transfer_options(kwargs,
+                                                image_meta.get('checksum')))
+    except Exception:
+        if host is not None:
+            # The host may no longer be usable; resolve the hosts again.
+            host_resolver.invalidate(session, datastore)
+        raise
+    finally:
+        if host is not None:
+            host_resolver.release_host(host)
+
+
+def download_datastore_file(session, datastore, rel_path, file_size,
+                            file_handle, bypass=True, timeout_secs=7200,
+                            connections=1, range_size=rw_handles.RANGE_SIZE,
+                            host_resolver=None):
+    """Download a file in a datastore to a local file.
+
+    The file is read using HTTP range requests over the given number of
+    connections, and each range is written at its offset in the local file.
+    The download of a range which fails is resumed from the first byte
+    which was not received.
+
+    :param session: VMwareAPISession object
+    :param datastore: Datastore object
+    :param rel_path: path of the file in the datastore
+    :param file_size: size of the file in bytes
+    :param file_handle: seekable local file opened for writing
+    :param bypass: if set to True, bypass vCenter to download the file
+                   from the connected host with the fewest transfers in
+                   progress
+    :param timeout_secs: time in seconds to wait for the download to
+                         complete
+    :param connections: number of parallel connections used for the file
+    :param range_size: size in bytes of each range request
+    :param host_resolver: ConnectedHostResolver choosing the host; the
+                          shared resolver is used by default
+    :raises: ImageTransferException, VimException, VimConnectionException
+    """
+    host = None
     if bypass:
-        hosts = datastore.get_connected_hosts(session)
-        host = ds_obj.Datastore.choose_host(hosts)
-        host_name = session.invoke_api(vim_util, 'get_object_property',
-                                       session.vim, host, 'name')
-        ds_url = datastore.build_url(session._scheme, host_name, rel_path,
+        host_resolver = (host_resolver or
+                         ds_obj.get_default_host_resolver())
+        host = host_resolver.choose_host(session, datastore)
+        ds_url = datastore.build_url(session._scheme, host.name, rel_path,
                                      constants.ESX_DATACENTER_PATH)
-        cookie = ds_url.get_transfer_ticket(session, method)
-        conn = ds_url.connect(method, image_size, cookie)
+        # Each request needs a ticket of its own.
+        cookie = functools.partial(ds_url.get_transfer_ticket, session,
+                                   'GET')
     else:
-        ds_url = datastore.build_url(session._scheme, session._host, rel_path)
+        ds_url = datastore.build_url(session._scheme, session._host,
+                                     rel_path)
         cookie = '%s=%s' % (constants.SOAP_COOKIE_KEY,
                             session.vim.get_http_cookie().strip("\""))
-        conn = ds_url.connect(method, image_size, cookie)
-        conn.write = conn.send
 
-    read_handle = rw_handles.ImageReadHandle(image)
-    _start_transfer(None, timeout_secs, read_handle, image_size,
-                    write_file_handle=conn)
+    read_handle = rw_handles.ParallelFileReadHandle(
+        ds_url, file_size, cookie=cookie,
+        cacerts=session._cacert or not session._insecure,
+        connections=connections, range_size=range_size)
+    timer = timeout.Timeout(timeout_secs)
+    try:
+        read_handle.download_to(file_handle)
+    except timeout.Timeout as excep:
+        excep_msg = _("Timeout occurred while downloading file: %s.") % ds_url
+        LOG.exception(excep_msg)
+        raise exceptions.ImageTransferException(excep_msg, excep)
+    except Exception:
+        if host is not None:
+            # The host may no longer be usable; resolve the hosts again.
+            host_resolver.invalidate(session, datastore)
+        raise
+    finally:
+        timer.cancel()
+        read_handle.close()
+        if host is not None:
+            host_resolver.release_host(host)
 
 
 def download_flat_image(context, timeout_secs, image_service, image_id,
@@ -438,16 +2137,52 @@ def download_flat_image(context, timeout_secs, image_service, image_id,
     :param image_service: image service handle
     :param image_id: ID of the image to be downloaded
     :param kwargs: keyword arguments to configure the destination
-                   file write handle
+                   file write handle and the transfer tuning options
+                   chunk_size, queue_bytes, ring_buffer and
+                   adaptive_chunking; if
+                   checkpoint_path is given, the image is uploaded as a
+                   resumable transfer in segments of segment_size bytes.
+                   The data is verified against the given digests, and
+                   against the image checksum if verify_checksum is True;
+                   these options are not supported by resumable transfers.
+    :returns: datastore path of the descriptor of the split flat VMDK
+              written by a resumable transfer, which is named after
+              file_path; None otherwise
     :raises: VimConnectionException, ImageTransferException, ValueError
     """
     LOG.debug("Downloading image: %s from image service as a flat file.",
               image_id)
+    if kwargs.get('checkpoint_path'):
+        _check_resumable_options(kwargs)
 
     # TODO(vbala) catch specific exceptions raised by download call
     read_iter = image_service.download(context, image_id)
     read_handle = rw_handles.ImageReadHandle(read_iter)
     file_size = int(kwargs.get('image_size'))
+    if kwargs.get('checkpoint_path'):
+        def open_file(path, size):
+            return rw_handles.FileWriteHandle(kwargs.get('host'),
+                                              kwargs.get('port'),
+                                              kwargs.get('data_center_name'),
+                                              kwargs.get('datastore_name'),
+                                              kwargs.get('cookies'),
+                                              path,
+                                              size,
+                                              cacerts=kwargs.get('cacerts'))
+
+        descriptor_path = _start_resumable_transfer(
+            timeout_secs,
+            read_handle,
+            file_size,
+            kwargs.get('file_path'),
+            open_file,
+            kwargs['checkpoint_path'],
+            image_id,
+            segment_size=kwargs.get('segment_size'))
+        LOG.debug("Downloaded image: %(image)s from image service as a "
+                  "split flat file: %(path)s.",
+                  {'image': image_id, 'path': descriptor_path})
+        return descriptor_path
     write_handle = rw_handles.FileWriteHandle(kwargs.get('host'),
                                               kwargs.get('port'),
                                               kwargs.get('data_center_name'),
@@ -456,11 +2191,13 @@ def download_flat_image(context, timeout_secs, image_service, image_id,
                                               kwargs.get('file_path'),
                                               file_size,
                                               cacerts=kwargs.get('cacerts'))
+    checksum = _get_image_checksum(context, image_service, image_id, kwargs)
     _start_transfer(context,
                     timeout_secs,
                     read_handle,
                     file_size,
-                    write_file_handle=write_handle)
+                    write_file_handle=write_handle,
+                    **_get_transfer_options(kwargs, checksum))
     LOG.debug("Downloaded image: %s from image service as a flat file.",
               image_id)
 
@@ -473,7 +2210,10 @@ def download_stream_optimized_data(context, timeout_secs, read_handle,
     :param timeout_secs: time in seconds to wait for the download to complete
     :param read_handle: handle from which to read the image data
     :param kwargs: keyword arguments to configure the destination
-                   VMDK write handle
+                   VMDK write handle and the transfer tuning options
+                   chunk_size, queue_bytes and adaptive_chunking. The data
+                   is verified against the given digests, and against the
+                   MD5 checksum if verify_checksum is True.
     :returns: managed object reference of the VM created for import to VMware
               server
     :raises: VimException, VimFaultException, VimAttributeException,
@@ -492,7 +2232,8 @@ def download_stream_optimized_data(context, timeout_secs, read_handle,
                     timeout_secs,
                     read_handle,
                     file_size,
-                    write_file_handle=write_handle)
+                    write_file_handle=write_handle,
+                    **_get_transfer_options(kwargs, kwargs.get('checksum')))
     return write_handle.get_imported_vm()
 
 
@@ -505,7 +2246,10 @@ def download_stream_optimized_image(context, timeout_secs, image_service,
     :param image_service: image service handle
     :param image_id: ID of the image to be downloaded
     :param kwargs: keyword arguments to configure the destination
-                   VMDK write handle
+                   VMDK write handle and the transfer tuning options
+                   chunk_size, queue_bytes and adaptive_chunking. The data
+                   is verified against the given digests, and against the
+                   image checksum if verify_checksum is True.
     :returns: managed object reference of the VM created for import to VMware
               server
     :raises: VimException, VimFaultException, VimAttributeException,
@@ -519,6 +2263,9 @@ def download_stream_optimized_image(context, timeout_secs, image_service,
     # TODO(vbala) catch specific exceptions raised by download call
     read_iter = image_service.download(context, image_id)
     read_handle = rw_handles.ImageReadHandle(read_iter)
+    if kwargs.get('verify_checksum'):
+        kwargs['checksum'] = _get_image_checksum(context, image_service,
+                                                 image_id, kwargs)
     imported_vm = download_stream_optimized_data(context, timeout_secs,
                                                  read_handle, **kwargs)
 
@@ -536,7 +2283,9 @@ def copy_stream_optimized_disk(
     :param timeout_secs: time in seconds to wait for the copy to complete
     :param write_handle: copy destination
     :param kwargs: keyword arguments to configure the source
-                   VMDK read handle
+                   VMDK read handle and the transfer tuning options
+                   chunk_size, queue_bytes and adaptive_chunking; the data
+                   is verified against the given digests
     :raises: VimException, VimFaultException, VimAttributeException,
              VimSessionOverLoadException, VimConnectionException,
              ImageTransferException, ValueError
@@ -553,7 +2302,8 @@ def copy_stream_optimized_disk(
                                             kwargs.get('vmdk_file_path'),
                                             file_size)
     _start_transfer(context, timeout_secs, read_handle, file_size,
-                    write_file_handle=write_handle)
+                    write_file_handle=write_handle,
+                    **_get_transfer_options(kwargs))
     LOG.debug("Downloaded virtual disk: %s.", vmdk_file_path)
 
 
@@ -566,7 +2316,11 @@ def upload_image(context, timeout_secs, image_service, image_id, owner_id,
     :param image_service: image service handle
     :param image_id: upload destination image ID
     :param kwargs: keyword arguments to configure the source
-                   VMDK read handle
+                   VMDK read handle and the transfer tuning options
+                   chunk_size, queue_bytes and adaptive_chunking. If
+                   verify_checksum is True, the checksum computed by the
+                   image service is verified against the MD5 digest of the
+                   uploaded data.
     :raises: VimException, VimFaultException, VimAttributeException,
              VimSessionOverLoadException, VimConnectionException,
              ImageTransferException, ValueError
@@ -598,11 +2352,22 @@ def upload_image(context, timeout_secs, image_service, image_id, owner_id,
 
     # Passing 0 as the file size since data size to be transferred cannot be
     # predetermined.
-    _start_transfer(context,
-                    timeout_secs,
-                    read_handle,
-                    0,
-                    image_service=image_service,
-                    image_id=image_id,
-                    image_meta=image_metadata)
+    digests = _start_transfer(context,
+                              timeout_secs,
+                              read_handle,
+                              0,
+                              image_service=image_service,
+                              image_id=image_id,
+                              image_meta=image_metadata,
+                              **_get_transfer_options(kwargs))
+    checksum = _get_image_checksum(context, image_service, image_id, kwargs)
+    if checksum and checksum != digests['md5']:
+        excep_msg = (_("Checksum: %(checksum)s of image: %(image)s does not "
+                       "match the MD5 digest: %(digest)s of the uploaded "
+                       "data.") %
+                     {'checksum': checksum,
+                      'image': image_id,
+                      'digest': digests['md5']})
+        LOG.error(excep_msg)
+        raise exceptions.ImageChecksumMismatchException(excep_msg)
     LOG.debug("Uploaded image: %s.", image_id)
@@ -0,0 +1,317 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Inventory cache kept up to date by property collector updates.
+
+Each (managed object type, properties) pair read through the cache gets a
+property filter traversing the inventory from the root folder on a
+property collector owned by the cache. The initial contents of the filter
+and the subsequent changes are received by a single greenthread calling
+WaitForUpdatesEx, which applies them to an in-memory index. Reads are
+served from the index and do not call the server once the pair has been
+synchronized.
+"""
+
+import logging
+
+from eventlet import event
+from eventlet import greenthread
+
+from oslo_vmware._i18n import _LE, _LW
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+
+LOG = logging.getLogger(__name__)
+
+# Maximum time in seconds the server blocks a WaitForUpdatesEx call when
+# there are no inventory changes.
+DEFAULT_MAX_WAIT = 60
+
+REQUEST_CANCELED = 'RequestCanceled'
+
+
+class _Registration(object):
+    """Index of the objects reported by a property filter."""
+
+    def __init__(self, type_, properties):
+        self.type_ = type_
+        self.properties = properties
+        self.prop_filter = None
+        # Objects keyed by managed object reference value; the property
+        # dicts are replaced instead of being modified so that they can be
+        # handed out to the readers.
+        self.index = {}
+        # Index being rebuilt from the initial contents of the filter.
+        self.pending = {}
+        self.ready = event.Event()
+
+
+class InventoryCache(object):
+    """Caches managed object properties using WaitForUpdatesEx.
+
+    Example:
+        cache = InventoryCache(api_session)
+        hosts = cache.get_objects('HostSystem', ['name', 'runtime'])
+    """
+
+    def __init__(self, session, max_wait=DEFAULT_MAX_WAIT):
+        """Initializes the inventory cache.
+
+        :param session: VMwareAPISession object used for the API calls
+        :param max_wait: maximum time in seconds the server blocks each
+                         WaitForUpdatesEx call when there are no changes
+        """
+        self._session = session
+        self._max_wait = max_wait
+        self._collector = None
+        self._version = ''
+        self._registrations = {}
+        self._filters = {}
+        self._thread = None
+        self._waiting = False
+        self._failures = 0
+
+    @property
+    def version(self):
+        """Data version of the last update set applied to the cache."""
+        return self._version
+
+    def get_objects(self, type_, properties_to_collect):
+        """Returns the cached properties of all objects of the given type.
+
+        The first read of a (type, properties) pair waits until the initial
+        contents have been received from the server.
+
+        :param type_: type of the managed object
+        :param properties_to_collect: names of the managed object properties
+        :returns: dict of property name to value dicts keyed by the managed
+                  object reference value
+        :raises: VimException, VimFaultException, VimAttributeException,
+                 VimSessionOverLoadException, VimConnectionException
+        """
+        reg = self._get_registration(type_, properties_to_collect)
+        reg.ready.wait()
+        return dict(reg.index)
+
+    def get_object_properties(self, moref, properties_to_collect):
+        """Returns the cached properties of the given managed object.
+
+        :param moref: managed object reference
+        :param properties_to_collect: names of the managed object properties
+        :returns: dict of property name to value or None if the object does
+                  not exist
+        :raises: VimException, VimFaultException, VimAttributeException,
+                 VimSessionOverLoadException, VimConnectionException
+        """
+        reg = self._get_registration(moref._type, properties_to_collect)
+        reg.ready.wait()
+        return reg.index.get(moref.value)
+
+    def close(self):
+        """Stops the updates and destroys the property collector."""
+        collector = self._collector
+        self._registrations.clear()
+        self._filters.clear()
+        self._collector = None
+        if self._thread is not None:
+            self._cancel_wait(collector)
+        self._destroy_collector(collector)
+
+    def _destroy_collector(self, collector):
+        """Destroys the given property collector and its filters, if any."""
+        if collector is None:
+            return
+        try:
+            self._session.invoke_api(vim_util,
+                                     'destroy_property_collector',
+                                     self._session.vim,
+                                     collector)
+        except exceptions.VimException:
+            LOG.warn(_LW("Error occurred while destroying the property "
+                         "collector: %s."),
+                     collector,
+                     exc_info=True)
+
+    def _get_registration(self, type_, properties_to_collect):
+        key = (type_, tuple(sorted(properties_to_collect)))
+        reg = self._registrations.get(key)
+        if reg is None:
+            reg = _Registration(type_, list(key[1]))
+            self._registrations[key] = reg
+            try:
+                self._register(reg)
+            except Exception:
+                self._registrations.pop(key, None)
+                raise
+            if self._thread is None:
+                self._thread = greenthread.spawn(self._run)
+            else:
+                # Return the long-poll so that the initial contents of the
+                # new filter are fetched without waiting for max_wait.
+                self._cancel_wait(self._collector)
+        return reg
+
+    def _get_collector(self):
+        if self._collector is None:
+            LOG.debug("Creating property collector for inventory updates.")
+            self._collector = self._session.invoke_api(
+                vim_util, 'create_property_collector', self._session.vim)
+            self._version = ''
+        return self._collector
+
+    def _register(self, reg):
+        """Creates the property filter reporting the objects of reg."""
+        collector = self._get_collector()
+        vim = self._session.vim
+        client_factory = vim.client.factory
+        obj_spec = vim_util.get_recursive_object_spec(
+            client_factory, vim.service_content.rootFolder)
+        prop_spec = vim_util.get_property_spec(client_factory,
+                                               reg.type_,
+                                               reg.properties)
+        filter_spec = vim_util.build_property_filter_spec(client_factory,
+                                                          [prop_spec],
+                                                          [obj_spec])
+        reg.prop_filter = self._session.invoke_api(vim_util,
+                                                   'create_filter',
+                                                   vim,
+                                                   filter_spec,
+                                                   collector)
+        reg.pending = {}
+        self._filters[reg.prop_filter.value] = reg
+
+    def _cancel_wait(self, collector):
+        if not self._waiting or collector is None:
+            return
+        try:
+            self._session.invoke_api(vim_util,
+                                     'cancel_wait_for_updates',
+                                     self._session.vim,
+                                     collector)
+        except exceptions.VimException:
+            LOG.debug("Error occurred while cancelling the wait for "
+                      "inventory updates.", exc_info=True)
+
+    def _run(self):
+        """Applies inventory updates while there are registrations."""
+        try:
+            while self._registrations:
+                syncing = [reg for reg in self._registrations.values()
+                           if reg.pending is not None]
+                try:
+                    self._waiting = not syncing
+                    update_set = self._session.invoke_api(
+                        vim_util,
+                        'wait_for_updates_ex',
+                        self._session.vim,
+                        self._version,
+                        collector=self._collector,
+                        max_wait=0 if syncing else self._max_wait)
+                except exceptions.VimFaultException as excep:
+                    if REQUEST_CANCELED in excep.fault_list:
+                        continue
+                    self._recover(excep)
+                    continue
+                except exceptions.VimException as excep:
+                    self._recover(excep)
+                    continue
+                finally:
+                    self._waiting = False
+                self._failures = 0
+                truncated = False
+                if update_set:
+                    self._version = update_set.version
+                    self._process_update_set(update_set)
+                    truncated = getattr(update_set, 'truncated', False)
+                if not truncated:
+                    self._complete_sync(syncing)
+        finally:
+            self._thread = None
+
+    def _complete_sync(self, regs):
+        for reg in regs:
+            if reg.pending is None:
+                continue
+            reg.index = reg.pending
+            reg.pending = None
+            if not reg.ready.ready():
+                LOG.debug("Cached %(count)d objects of type: %(type)s.",
+                          {'count': len(reg.index), 'type': reg.type_})
+                reg.ready.send()
+
+    def _recover(self, excep):
+        """Re-creates the property collector after a WaitForUpdatesEx error.
+
+        The collector is lost if the session was re-created while handling
+        the error; otherwise it is destroyed along with its filters before
+        being re-created. The cached objects are served while the filters are
+        re-synchronized; the cache is dropped if the problem persists.
+        """
+        self._failures += 1
+        if self._failures > 1:
+            self._fail_all(excep)
+            return
+        LOG.warn(_LW("Error occurred while waiting for inventory updates; "
+                     "re-creating the property collector."),
+                 exc_info=True)
+        collector, self._collector = self._collector, None
+        self._destroy_collector(collector)
+        self._filters.clear()
+        try:
+            for reg in list(self._registrations.values()):
+                self._register(reg)
+        except exceptions.VimException as reg_excep:
+            self._fail_all(reg_excep)
+
+    def _fail_all(self, excep):
+        LOG.error(_LE("Unable to wait for inventory updates of: %s."),
+                  list(self._registrations))
+        collector, self._collector = self._collector, None
+        self._destroy_collector(collector)
+        self._failures = 0
+        regs = list(self._registrations.values())
+        self._registrations.clear()
+        self._filters.clear()
+        for reg in regs:
+            if not reg.ready.ready():
+                reg.ready.send_exception(excep)
+
+    def _process_update_set(self, update_set):
+        for filter_update in getattr(update_set, 'filterSet', None) or []:
+            reg = self._filters.get(filter_update.filter.value)
+            if reg is None:
+                continue
+            index = reg.pending if reg.pending is not None else reg.index
+            for obj_update in getattr(filter_update, 'objectSet', None) or []:
+                self._apply(index, obj_update)
+
+    @staticmethod
+    def _apply(index, obj_update):
+        value = obj_update.obj.value
+        if obj_update.kind == 'leave':
+            index.pop(value, None)
+            return
+        if obj_update.kind == 'enter':
+            props = {}
+        else:
+            props = dict(index.get(value, {}))
+        for change in getattr(obj_update, 'changeSet', None) or []:
+            if change.op in ('remove', 'indirectRemove'):
+                props.pop(change.name, None)
+            else:
+                props[change.name] = getattr(change, 'val', None)
+        index[value] = props
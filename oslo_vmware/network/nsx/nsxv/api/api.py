@@ -13,14 +13,13 @@
 #    under the License.
 
 import logging
-import time
 import xml.etree.ElementTree as et
 
 from oslo_serialization import jsonutils
 
-from oslo_vmware._i18n import _LI
 from oslo_vmware.network.nsx.nsxv.api import api_helper
 from oslo_vmware.network.nsx.nsxv.common import exceptions
+from oslo_vmware import retry
 
 
 LOG = logging.getLogger(__name__)
@@ -71,18 +70,14 @@ class NsxvApi(object):
 
     def _client_request(self, client, method, uri, params, headers,
                         encode_params):
-        retries = max(self.retries, 1)
-        delay = 0.5
-        for attempt in range(1, retries + 1):
-            if attempt != 1:
-                time.sleep(delay)
-                delay = min(2 * delay, 60)
-            try:
-                return client(method, uri, params, headers, encode_params)
-            except exceptions.ServiceConflict as e:
-                if attempt == retries:
-                    raise e
-            LOG.info(_LI('NSXv: conflict on request. Trying again.'))
+        # Requests failing due to concurrent object access are retried with
+        # a jittered exponential backoff.
+        policy = retry.RetryPolicy(
+            max_retry_count=max(self.retries, 1) - 1,
+            retryable=(exceptions.ServiceConflict,),
+            backoff=retry.ExponentialBackoff(initial_delay=0.5, max_delay=60))
+        return policy.call(client, method, uri, params, headers,
+                           encode_params)
 
     def do_request(self, method, uri, params=None, format='json', **kwargs):
         LOG.debug("NsxvApi('%(method)s', '%(uri)s', '%(body)s')", {
@@ -12,20 +12,33 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import fnmatch
 import logging
 import posixpath
 import random
+import time
 
+from eventlet import greenpool
 import six.moves.http_client as httplib
 import six.moves.urllib.parse as urlparse
 
 from oslo_vmware._i18n import _
 from oslo_vmware import constants
 from oslo_vmware import exceptions
+from oslo_vmware import http_pool
 from oslo_vmware import vim_util
 
 LOG = logging.getLogger(__name__)
 
+# Maximum number of folder searches run concurrently by iter_files().
+SEARCH_CONCURRENCY = 8
+# Maximum number of folder listings memoized by iter_files().
+SEARCH_CACHE_SIZE = 1024
+# Time in seconds for which ConnectedHostResolver caches the connected
+# hosts of a datastore.
+HOST_CACHE_TTL = 60
+
 
 class Datastore(object):
 
@@ -56,6 +69,7 @@ class Datastore(object):
         self.freespace = freespace
         self.type = type
         self.datacenter = datacenter
+        self._browser = None
 
     def build_path(self, *paths):
         """Constructs and returns a DatastorePath.
@@ -114,6 +128,92 @@ class Datastore(object):
                 hosts.append(host_mount.key)
         return hosts
 
+    def search(self, session, ds_path, match_patterns=None, details=None,
+               recursive=False, sort_folders_first=False):
+        """Searches a folder of the datastore using its datastore browser.
+
+        :param session: session
+        :param ds_path: DatastorePath of the folder to search
+        :param match_patterns: list of file name patterns; all the files
+                               and folders are returned if None
+        :param details: list of the FileQueryFlags properties to fill in
+                        the results, among 'fileType', 'fileSize',
+                        'modification' and 'fileOwner'; defaults to
+                        'fileType', 'fileSize' and 'modification'
+        :param recursive: whether to search the subfolders as well
+        :param sort_folders_first: whether to list the folders before the
+                                   files in each result
+        :return: list of HostDatastoreBrowserSearchResults, one for each
+                 folder searched
+        :raises: FileNotFoundException if the folder does not exist
+        """
+        client_factory = session.vim.client.factory
+        spec = client_factory.create('ns0:HostDatastoreBrowserSearchSpec')
+        if match_patterns:
+            spec.matchPattern = list(match_patterns)
+        if details is None:
+            details = ('fileType', 'fileSize', 'modification')
+        flags = client_factory.create('ns0:FileQueryFlags')
+        for flag in ('fileType', 'fileSize', 'modification', 'fileOwner'):
+            setattr(flags, flag, flag in details)
+        spec.details = flags
+        spec.sortFoldersFirst = sort_folders_first
+
+        if self._browser is None:
+            self._browser = session.invoke_api(vim_util,
+                                               'get_object_property',
+                                               session.vim, self.ref,
+                                               'browser')
+        method = ('SearchDatastoreSubFolders_Task' if recursive
+                  else 'SearchDatastore_Task')
+        LOG.debug("Searching datastore folder: %s.", ds_path)
+        task = session.invoke_api(session.vim, method, self._browser,
+                                  datastorePath=str(ds_path),
+                                  searchSpec=spec)
+        result = session.wait_for_task(task).result
+        if recursive:
+            return list(getattr(result, 'HostDatastoreBrowserSearchResults',
+                                []))
+        return [result]
+
+    def iter_files(self, session, ds_path, match_patterns=None,
+                   recursive=True, include_folders=False,
+                   max_concurrent=SEARCH_CONCURRENCY):
+        """Iterates over the files in a folder of the datastore.
+
+        See the iter_files() function of this module.
+
+        :return: iterator over (DatastorePath, FileInfo) pairs
+        """
+        return iter_files(session, [(self, ds_path)],
+                          match_patterns=match_patterns,
+                          recursive=recursive,
+                          include_folders=include_folders,
+                          max_concurrent=max_concurrent)
+
+    def _list_folder(self, session, ds_path, modification):
+        """Lists a folder, memoized by the folder modification time."""
+        # Managed object references are only unique within a server.
+        key = (getattr(session, '_host', None),
+               getattr(self.ref, 'value', self.ref), ds_path.rel_path,
+               modification)
+        if modification is not None:
+            files = _search_cache.get(key)
+            if files is not None:
+                LOG.debug("Using the memoized listing of folder: %s.",
+                          ds_path)
+                return files
+        results = self.search(session, ds_path)
+        files = list(getattr(results[0], 'file', []))
+        # Only the listings without subfolders are memoized: the
+        # modification time of a folder changes when its entries are
+        # added, removed or renamed, but not when the content of its
+        # subfolders changes.
+        if (modification is not None and
+                not any(_is_folder(file_info) for file_info in files)):
+            _search_cache.put(key, files)
+        return files
+
     @staticmethod
     def is_datastore_mount_usable(mount_info):
         """Check if a datastore is usable as per the given mount info.
@@ -136,6 +236,171 @@ class Datastore(object):
         return hosts[i]
 
 
+class ConnectedHost(object):
+    """Host connected to a datastore."""
+
+    def __init__(self, ref, name):
+        """Initializes the connected host.
+
+        :param ref: managed object reference of the HostSystem
+        :param name: name of the host, which is its host name or IP address
+        """
+        self.ref = ref
+        self.name = name
+
+    def __str__(self):
+        return self.name
+
+
+class ConnectedHostResolver(object):
+    """Resolves the usable hosts of datastores and spreads the transfers.
+
+    The accessibility and host mounts of a datastore, and the names and
+    connection states of its hosts are read in a single property collector
+    call. The result is cached for ttl seconds, unless invalidated, for
+    e.g., after a failed transfer using one of the hosts. A host is chosen
+    among the connected hosts which are not in maintenance mode, picking
+    the one with the fewest transfers in progress.
+
+    Example:
+        resolver = ConnectedHostResolver()
+        host = resolver.choose_host(session, ds)
+        try:
+            ds_url = ds.build_url('https', host.name, rel_path)
+            ...
+        finally:
+            resolver.release_host(host)
+    """
+
+    def __init__(self, ttl=HOST_CACHE_TTL):
+        """Initializes the resolver.
+
+        :param ttl: time in seconds for which the hosts of a datastore are
+                    cached
+        """
+        self._ttl = ttl
+        self._cache = {}
+        # Transfers in progress per host name.
+        self._active = collections.defaultdict(int)
+
+    def get_connected_hosts(self, session, ds):
+        """Returns the usable hosts of the given datastore.
+
+        :param session: session
+        :param ds: Datastore object
+        :return: list of ConnectedHost objects
+        """
+        key = self._get_key(session, ds)
+        entry = self._cache.get(key)
+        now = time.time()
+        if entry is not None and entry[0] > now:
+            return entry[1]
+        hosts = self._resolve(session, ds)
+        self._cache[key] = (now + self._ttl, hosts)
+        return hosts
+
+    def invalidate(self, session, ds):
+        """Drops the cached hosts of the given datastore."""
+        self._cache.pop(self._get_key(session, ds), None)
+
+    def choose_host(self, session, ds):
+        """Chooses the usable host of the datastore with the fewest transfers.
+
+        The transfer is counted against the host until release_host() is
+        called.
+
+        :param session: session
+        :param ds: Datastore object
+        :return: ConnectedHost object
+        :raises: VimException if no host can be used
+        """
+        hosts = self.get_connected_hosts(session, ds)
+        if not hosts:
+            raise exceptions.VimException(
+                _("No connected host can access datastore %s.") % ds.name)
+        min_active = min(self._active[host.name] for host in hosts)
+        # Ties are broken randomly to spread the concurrent transfers.
+        host = random.choice([host for host in hosts
+                              if self._active[host.name] == min_active])
+        self._active[host.name] += 1
+        return host
+
+    def release_host(self, host):
+        """Records the end of a transfer using a host from choose_host()."""
+        self._active[host.name] -= 1
+        if self._active[host.name] <= 0:
+            del self._active[host.name]
+
+    def get_stats(self):
+        """Returns the number of transfers in progress per host name."""
+        return dict(self._active)
+
+    def _get_key(self, session, ds):
+        # Managed object references are only unique within a server.
+        return (getattr(session, '_host', None),
+                getattr(ds.ref, 'value', ds.ref))
+
+    def _resolve(self, session, ds):
+        ds_ref_value = getattr(ds.ref, 'value', ds.ref)
+        props = session.invoke_api(vim_util,
+                                   'get_datastore_and_host_properties',
+                                   session.vim, ds.ref,
+                                   ['summary.accessible', 'host'],
+                                   ['name', 'runtime.connectionState',
+                                    'runtime.inMaintenanceMode'])
+        ds_props = props.get(ds_ref_value, {})
+        if not ds_props.get('summary.accessible'):
+            return []
+        host_mounts = getattr(ds_props.get('host'), 'DatastoreHostMount', [])
+        host_refs = [host_mount.key for host_mount in host_mounts
+                     if Datastore.is_datastore_mount_usable(
+                         host_mount.mountInfo)]
+        hosts = []
+        for host_ref in host_refs:
+            host_props = props.get(host_ref.value, {})
+            if (host_props.get('runtime.connectionState') == 'connected' and
+                    not host_props.get('runtime.inMaintenanceMode')):
+                hosts.append(ConnectedHost(host_ref, host_props['name']))
+        LOG.debug("Hosts connected to datastore %(ds)s: %(hosts)s.",
+                  {'ds': ds.name,
+                   'hosts': ', '.join(str(host) for host in hosts)})
+        return hosts
+
+
+_default_host_resolver = None
+
+
+def get_default_host_resolver():
+    """Returns the host resolver shared by the image transfers."""
+    global _default_host_resolver
+    if _default_host_resolver is None:
+        _default_host_resolver = ConnectedHostResolver()
+    return _default_host_resolver
+
+
+# Maximum number of datastore names interned by DatastorePath.
+DATASTORE_NAME_INTERN_SIZE = 4096
+
+_interned_names = {}
+# Query strings of the datastore URLs and the names parsed from them.
+_url_queries = {}
+_url_query_names = {}
+
+
+def _intern_datastore_name(datastore_name):
+    """Returns the interned datastore name and its path prefix.
+
+    The paths of a datastore share a single copy of its name and of the
+    "[name] " prefix of their string form.
+    """
+    entry = _interned_names.get(datastore_name)
+    if entry is None:
+        entry = (datastore_name, '[%s] ' % datastore_name)
+        if len(_interned_names) < DATASTORE_NAME_INTERN_SIZE:
+            _interned_names[datastore_name] = entry
+    return entry
+
+
 class DatastorePath(object):
 
     """Class for representing a directory or file path in a vSphere datatore.
@@ -156,23 +421,53 @@ class DatastorePath(object):
     - Path part of datastore path is relative to the root directory
       of the datastore, and is always separated from the [ds_name] part with
       a single space.
+    - DatastorePath objects are immutable and hashable; the string form,
+      parent, basename and hash are computed once when first used.
     """
 
+    __slots__ = ('_datastore_name', '_prefix', '_rel_path', '_str',
+                 '_parent', '_basename', '_hash')
+
     def __init__(self, datastore_name, *paths):
         if datastore_name is None or datastore_name == '':
             raise ValueError(_("Datastore name cannot be empty"))
-        self._datastore_name = datastore_name
-        self._rel_path = ''
+        rel_path = ''
         if paths:
             if None in paths:
                 raise ValueError(_("Path component cannot be None"))
-            self._rel_path = posixpath.join(*paths)
+            if len(paths) == 1:
+                rel_path = paths[0]
+            else:
+                rel_path = posixpath.join(*paths)
+        self._init(datastore_name, rel_path)
+
+    def _init(self, datastore_name, rel_path):
+        self._datastore_name, self._prefix = _intern_datastore_name(
+            datastore_name)
+        self._rel_path = rel_path
+        self._str = None
+        self._parent = None
+        self._basename = None
+        self._hash = None
+
+    @classmethod
+    def _create(cls, datastore_name, rel_path):
+        """Creates a path from validated components."""
+        path = cls.__new__(cls)
+        path._init(datastore_name, rel_path)
+        return path
 
     def __str__(self):
         """Full datastore path to the file or directory."""
-        if self._rel_path != '':
-            return "[%s] %s" % (self._datastore_name, self.rel_path)
-        return "[%s]" % self._datastore_name
+        if self._str is None:
+            if self._rel_path != '':
+                self._str = self._prefix + self._rel_path
+            else:
+                self._str = "[%s]" % self._datastore_name
+        return self._str
+
+    def __repr__(self):
+        return 'DatastorePath(%r)' % str(self)
 
     @property
     def datastore(self):
@@ -180,15 +475,20 @@ class DatastorePath(object):
 
     @property
     def parent(self):
-        return DatastorePath(self.datastore, posixpath.dirname(self._rel_path))
+        if self._parent is None:
+            self._parent = self._create(self._datastore_name,
+                                        posixpath.dirname(self._rel_path))
+        return self._parent
 
     @property
     def basename(self):
-        return posixpath.basename(self._rel_path)
+        if self._basename is None:
+            self._basename = posixpath.basename(self._rel_path)
+        return self._basename
 
     @property
     def dirname(self):
-        return posixpath.dirname(self._rel_path)
+        return self.parent._rel_path
 
     @property
     def rel_path(self):
@@ -207,7 +507,8 @@ class DatastorePath(object):
         if paths:
             if None in paths:
                 raise ValueError(_("Path component cannot be None"))
-            return DatastorePath(self.datastore, self._rel_path, *paths)
+            return self._create(self._datastore_name,
+                                posixpath.join(self._rel_path, *paths))
         return self
 
     def __eq__(self, other):
@@ -215,6 +516,20 @@ class DatastorePath(object):
                 self._datastore_name == other._datastore_name and
                 self._rel_path == other._rel_path)
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash((self._datastore_name, self._rel_path))
+        return self._hash
+
+    def __getstate__(self):
+        return (self._datastore_name, self._rel_path)
+
+    def __setstate__(self, state):
+        self._init(*state)
+
     @classmethod
     def parse(cls, datastore_path):
         """Constructs a DatastorePath object given a datastore path string."""
@@ -227,7 +542,48 @@ class DatastorePath(object):
             datastore_name = spl[0]
         else:
             datastore_name, path = spl
-        return cls(datastore_name, path.strip())
+        if not datastore_name:
+            raise ValueError(_("Datastore name cannot be empty"))
+        return cls._create(datastore_name, path.strip())
+
+    @classmethod
+    def parse_many(cls, datastore_paths):
+        """Constructs DatastorePath objects given datastore path strings.
+
+        Same as calling parse() for each path, but faster for the large
+        lists of paths such as those in the results of a datastore browser
+        search.
+
+        :param datastore_paths: iterable of datastore path strings
+        :return: list of DatastorePath objects
+        """
+        paths = []
+        new = cls.__new__
+        datastore_name = entry = None
+        for datastore_path in datastore_paths:
+            if not datastore_path:
+                # parse() raises the appropriate error.
+                paths.append(cls.parse(datastore_path))
+                continue
+            start = datastore_path.find('[')
+            end = datastore_path.find(']', start + 1)
+            if end == -1:
+                end = len(datastore_path)
+            if start == -1 or end == start + 1:
+                # Invalid path; parse() raises the appropriate error.
+                paths.append(cls.parse(datastore_path))
+                continue
+            name = datastore_path[start + 1:end]
+            if name != datastore_name:
+                datastore_name = name
+                entry = _intern_datastore_name(name)
+            # Same as _create(), inlined.
+            path = new(cls)
+            path._datastore_name, path._prefix = entry
+            path._rel_path = datastore_path[end + 1:].strip()
+            path._str = path._parent = path._basename = path._hash = None
+            paths.append(path)
+        return paths
 
 
 class DatastoreURL(object):
@@ -244,9 +600,14 @@ class DatastoreURL(object):
         self._path = path
         self._datacenter_path = datacenter_path
         self._datastore_name = datastore_name
-        params = {'dcPath': self._datacenter_path,
-                  'dsName': self._datastore_name}
-        self._query = urlparse.urlencode(params)
+        key = (datacenter_path, datastore_name)
+        self._query = _url_queries.get(key)
+        if self._query is None:
+            params = {'dcPath': self._datacenter_path,
+                      'dsName': self._datastore_name}
+            self._query = urlparse.urlencode(params)
+            if len(_url_queries) < DATASTORE_NAME_INTERN_SIZE:
+                _url_queries[key] = self._query
 
     @classmethod
     def urlparse(cls, url):
@@ -255,13 +616,20 @@ class DatastoreURL(object):
             path = path.split('?')
             query = path[1]
             path = path[0]
-        params = urlparse.parse_qs(query)
-        dc_path = params.get('dcPath')
-        if dc_path is not None and len(dc_path) > 0:
-            datacenter_path = dc_path[0]
-        ds_name = params.get('dsName')
-        if ds_name is not None and len(ds_name) > 0:
-            datastore_name = ds_name[0]
+        # The URLs of the files in a datastore share the same query.
+        names = _url_query_names.get(query)
+        if names is None:
+            params = urlparse.parse_qs(query)
+            dc_path = params.get('dcPath')
+            if dc_path is not None and len(dc_path) > 0:
+                datacenter_path = dc_path[0]
+            ds_name = params.get('dsName')
+            if ds_name is not None and len(ds_name) > 0:
+                datastore_name = ds_name[0]
+            names = (datacenter_path, datastore_name)
+            if len(_url_query_names) < DATASTORE_NAME_INTERN_SIZE:
+                _url_query_names[query] = names
+        datacenter_path, datastore_name = names
         path = path[len('/folder'):]
         return cls(scheme, server, path, datacenter_path, datastore_name)
 
@@ -281,16 +649,30 @@ class DatastoreURL(object):
         return '%s://%s/folder/%s?%s' % (self._scheme, self._server,
                                          self.path, self._query)
 
-    def connect(self, method, content_length, cookie):
+    def connect(self, method, content_length, cookie, cacert=None,
+                insecure=False):
+        """Opens a connection sending a request for the file.
+
+        The connection is taken from the shared HTTP connection pool;
+        closing it once the response has been read returns it to the pool.
+        The server certificate is verified unless insecure is set.
+
+        :param method: HTTP method of the request
+        :param content_length: size of the request body in bytes
+        :param cookie: value of the Cookie header
+        :param cacert: CA bundle file to use in verifying the server
+                       certificate
+        :param insecure: whether to skip verifying the server certificate
+                         using the system certificates; used only if cacert
+                         is not specified
+        :returns: HTTP connection to write the request body to
+        :raises: VimConnectionException, ValueError
+        """
         try:
-            if self._scheme == 'http':
-                conn = httplib.HTTPConnection(self._server)
-            elif self._scheme == 'https':
-                conn = httplib.HTTPSConnection(self._server)
-            else:
-                excep_msg = _("Invalid scheme: %s.") % self._scheme
-                LOG.error(excep_msg)
-                raise ValueError(excep_msg)
+            cacerts = cacert if cacert else not insecure
+            conn = http_pool.get_default_pool().get(self._scheme,
+                                                    self._server,
+                                                    cacerts=cacerts)
             conn.putrequest(method, '/folder/%s?%s' % (self.path, self._query))
             conn.putheader('User-Agent', constants.USER_AGENT)
             conn.putheader('Content-Length', content_length)
@@ -316,3 +698,102 @@ class DatastoreURL(object):
             session.vim.service_content.sessionManager,
             spec=spec)
         return '%s="%s"' % (constants.CGI_COOKIE_KEY, ticket.id)
+
+
+class _SearchCache(object):
+    """LRU cache of the folder listings."""
+
+    def __init__(self, max_entries):
+        self._max_entries = max_entries
+        self._entries = collections.OrderedDict()
+
+    def get(self, key):
+        files = self._entries.pop(key, None)
+        if files is not None:
+            self._entries[key] = files
+        return files
+
+    def put(self, key, files):
+        self._entries.pop(key, None)
+        self._entries[key] = files
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+
+_search_cache = _SearchCache(SEARCH_CACHE_SIZE)
+
+
+def _is_folder(file_info):
+    return file_info.__class__.__name__ == 'FolderFileInfo'
+
+
+def iter_files(session, locations, match_patterns=None, recursive=True,
+               include_folders=False, max_concurrent=SEARCH_CONCURRENCY):
+    """Iterates over the files in the given datastore folders.
+
+    The folders are listed one by one with SearchDatastore_Task, up to
+    max_concurrent of them concurrently, and the files of each folder are
+    returned as soon as its listing completes, so that the whole tree is
+    never held in memory. The listings of the subfolders without
+    subfolders of their own are memoized by datastore, path and
+    modification time, which makes repeated scans such as the image cache
+    cleanup skip the folders which did not change.
+
+    Example:
+        for ds_path, file_info in iter_files(session, [(ds, base_path)],
+                                             match_patterns=['*.vmdk']):
+            ...
+
+    :param session: session
+    :param locations: iterable of (Datastore, DatastorePath) pairs of the
+                      folders to search
+    :param match_patterns: list of file name patterns; all the files are
+                           returned if None
+    :param recursive: whether to search the subfolders as well
+    :param include_folders: whether to return the folders as well
+    :param max_concurrent: maximum number of folder searches in progress
+    :return: iterator over (DatastorePath, FileInfo) pairs; the FileInfo
+             has the fileType, fileSize and modification details
+    :raises: FileNotFoundException if one of the given folders does not
+             exist
+    """
+    pool = greenpool.GreenPool(max_concurrent)
+
+    def list_folder(ds, ds_path, modification):
+        try:
+            return ds._list_folder(session, ds_path, modification)
+        except exceptions.FileNotFoundException:
+            if modification is None:
+                raise
+            # The subfolder was deleted after its parent was listed.
+            LOG.debug("Folder: %s was deleted during the search.", ds_path)
+            return []
+
+    pending = collections.deque()
+    for ds, ds_path in locations:
+        pending.append((ds, ds_path,
+                        pool.spawn(list_folder, ds, ds_path, None)))
+    try:
+        while pending:
+            ds, folder_path, thread = pending.popleft()
+            for file_info in thread.wait():
+                file_path = folder_path.join(file_info.path)
+                is_folder = _is_folder(file_info)
+                if is_folder and recursive:
+                    pending.append(
+                        (ds, file_path,
+                         pool.spawn(list_folder, ds, file_path,
+                                    file_info.modification)))
+                if is_folder and not include_folders:
+                    continue
+                if (match_patterns and
+                        not any(fnmatch.fnmatch(file_info.path, pattern)
+                                for pattern in match_patterns)):
+                    continue
+                yield file_path, file_info
+    finally:
+        for ds, folder_path, thread in pending:
+            thread.kill()
@@ -0,0 +1,252 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Retry policies for API calls.
+
+A RetryPolicy decides whether a failed call is retried and how long to
+wait before the retry. The policy itself is stateless and can be shared;
+the state of each call (attempts made, start time) is kept in a RetryState
+created for the call, so concurrent calls do not affect each other's
+backoff. The pluggable parts of a policy are:
+
+* backoff: computes the delay before each retry; ExponentialBackoff with
+  jitter spreads the retries of concurrent callers over time instead of
+  synchronizing them against an overloaded server.
+* classifier: decides which exceptions are retried.
+* budget: a RetryBudget shared by the calls of a client which caps the
+  ratio of retries to calls, so that retries cannot multiply the load
+  while the server is failing.
+* deadline: the overall time after which a call is no longer retried.
+"""
+
+import logging
+import random
+import time
+
+from eventlet import greenthread
+
+from oslo_vmware._i18n import _LE, _LW
+
+
+LOG = logging.getLogger(__name__)
+
+
+class LinearBackoff(object):
+    """Delay incremented by a constant after every attempt."""
+
+    def __init__(self, increment=10, max_delay=60):
+        """Initializes the backoff.
+
+        :param increment: delay increment in seconds
+        :param max_delay: maximum delay in seconds
+        """
+        self._increment = increment
+        self._max_delay = max_delay
+
+    def delay(self, attempt):
+        """Returns the delay before the given retry attempt (1 based)."""
+        return min(self._increment * attempt, self._max_delay)
+
+
+class ExponentialBackoff(object):
+    """Exponentially growing delay with optional full jitter.
+
+    With jitter, the delay is picked uniformly between 0 and the
+    exponential delay.
+    """
+
+    def __init__(self, initial_delay=1, multiplier=2, max_delay=60,
+                 jitter=True):
+        """Initializes the backoff.
+
+        :param initial_delay: delay in seconds before the first retry
+        :param multiplier: factor by which the delay grows after every retry
+        :param max_delay: maximum delay in seconds
+        :param jitter: whether to randomize the delay
+        """
+        self._initial_delay = initial_delay
+        self._multiplier = multiplier
+        self._max_delay = max_delay
+        self._jitter = jitter
+
+    def delay(self, attempt):
+        """Returns the delay before the given retry attempt (1 based)."""
+        delay = min(self._initial_delay * self._multiplier ** (attempt - 1),
+                    self._max_delay)
+        if self._jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class RetryBudget(object):
+    """Caps the ratio of retries to calls across the users of the budget.
+
+    Every call deposits 'ratio' tokens, up to 'capacity' tokens, and every
+    retry withdraws one token. Retries are denied while there are no
+    tokens left.
+    """
+
+    def __init__(self, ratio=0.2, capacity=10):
+        """Initializes the budget.
+
+        :param ratio: number of retries allowed per call
+        :param capacity: maximum number of tokens, which is the number of
+                         retries allowed in a burst
+        """
+        self._ratio = ratio
+        self._capacity = capacity
+        self._tokens = float(capacity)
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    def deposit(self):
+        """Records a call."""
+        self._tokens = min(self._tokens + self._ratio, self._capacity)
+
+    def withdraw(self):
+        """Withdraws a token for a retry.
+
+        :returns: True if the retry is allowed; False otherwise
+        """
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class RetryState(object):
+    """State of a single call retried according to a policy."""
+
+    def __init__(self):
+        self.attempts = 0
+        self.retries = 0
+        self.last_delay = 0
+        self.start_time = time.time()
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+
+class RetryPolicy(object):
+    """Decides whether and when failed calls are retried.
+
+    Example:
+        policy = RetryPolicy(max_retry_count=5,
+                             retryable=(VimConnectionException,))
+        result = policy.call(func, *args, **kwargs)
+    """
+
+    def __init__(self, max_retry_count=-1, retryable=(), backoff=None,
+                 budget=None, deadline=None):
+        """Initializes the policy.
+
+        :param max_retry_count: maximum number of retries of a call; -1
+                                means unlimited
+        :param retryable: tuple of exception classes which are retried, or a
+                          callable which returns whether the exception
+                          passed to it should be retried
+        :param backoff: object whose delay(attempt) method returns the
+                        delay in seconds before a retry; defaults to
+                        ExponentialBackoff()
+        :param budget: RetryBudget shared by the calls; no budget is
+                       enforced if None
+        :param deadline: time in seconds since the first attempt after which
+                         a call is not retried; no deadline if None
+        """
+        self._max_retry_count = max_retry_count
+        if isinstance(retryable, type):
+            retryable = (retryable,)
+        if callable(retryable):
+            self._classifier = retryable
+        else:
+            retryable = tuple(retryable)
+            self._classifier = lambda excep: isinstance(excep, retryable)
+        self._backoff = backoff or ExponentialBackoff()
+        self._budget = budget
+        self._deadline = deadline
+
+    def is_retryable(self, excep):
+        """Returns whether the given exception is retried by the policy."""
+        return bool(self._classifier(excep))
+
+    def next_delay(self, state, excep):
+        """Returns the delay before retrying the call which failed.
+
+        :param state: RetryState of the call
+        :param excep: exception raised by the last attempt
+        :returns: delay in seconds or None if the call must not be retried
+        """
+        if not self.is_retryable(excep):
+            return None
+        if (self._max_retry_count != -1 and
+                state.retries >= self._max_retry_count):
+            LOG.error(_LE("Cannot retry upon suggested exception since retry "
+                          "count (%(retry_count)d) reached max retry count "
+                          "(%(max_retry_count)d)."),
+                      {'retry_count': state.retries,
+                       'max_retry_count': self._max_retry_count})
+            return None
+        delay = self._backoff.delay(state.retries + 1)
+        if (self._deadline is not None and
+                state.elapsed() + delay > self._deadline):
+            LOG.error(_LE("Cannot retry since the deadline of %s seconds "
+                          "would be exceeded."), self._deadline)
+            return None
+        if self._budget is not None and not self._budget.withdraw():
+            LOG.error(_LE("Cannot retry since the retry budget is "
+                          "exhausted."))
+            return None
+        return delay
+
+    def call(self, func, *args, **kwargs):
+        """Calls the given function, retrying it according to the policy.
+
+        :param func: function to call
+        :param args: arguments of the function
+        :param kwargs: keyword arguments of the function
+        :returns: return value of the function
+        """
+        return self.call_with_state(RetryState(), func, *args, **kwargs)
+
+    def call_with_state(self, state, func, *args, **kwargs):
+        """Same as call(), recording the attempts in the given state."""
+        func_name = getattr(func, '__name__', func)
+        if self._budget is not None:
+            self._budget.deposit()
+        while True:
+            state.attempts += 1
+            if state.retries:
+                LOG.debug("Invoking %(func_name)s; retry count is "
+                          "%(retry_count)d.",
+                          {'func_name': func_name,
+                           'retry_count': state.retries})
+            try:
+                return func(*args, **kwargs)
+            except Exception as excep:
+                delay = self.next_delay(state, excep)
+                if delay is None:
+                    raise
+                LOG.warn(_LW("Exception which is in the suggested list of "
+                             "exceptions occurred while invoking function: "
+                             "%(func_name)s; retrying in %(delay).02f "
+                             "seconds."),
+                         {'func_name': func_name, 'delay': delay},
+                         exc_info=True)
+            state.retries += 1
+            state.last_delay = delay
+            greenthread.sleep(delay)
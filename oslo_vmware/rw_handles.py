@@ -22,17 +22,22 @@ glance server.
 """
 
 import logging
-import ssl
+import time
 
+from eventlet import event
+from eventlet import greenthread
+from eventlet import semaphore
 import requests
 import six
+import six.moves.http_client as httplib
 import six.moves.urllib.parse as urlparse
-from urllib3 import connection as httplib
 
 from oslo.utils import excutils
 from oslo.utils import netutils
 from oslo_vmware._i18n import _, _LE, _LW
 from oslo_vmware import exceptions
+from oslo_vmware import http_pool
+from oslo_vmware import retry
 from oslo_vmware import vim_util
 
 
@@ -40,7 +45,111 @@ LOG = logging.getLogger(__name__)
 
 MIN_PROGRESS_DIFF_TO_LOG = 25
 READ_CHUNKSIZE = 65536
+RANGE_SIZE = 8 * 1024 * 1024
 USER_AGENT = 'OpenStack-ESX-Adapter'
+# Interval in seconds at which the progress of the leases is checked, and
+# maximum interval in seconds between two progress updates of a lease
+# whose progress percent does not change.
+LEASE_PROGRESS_CHECK_INTERVAL = 1
+LEASE_PROGRESS_UPDATE_INTERVAL = 60
+
+
+class LeaseProgressUpdater(object):
+    """Keeps the HttpNfcLeases of the active transfers alive.
+
+    The VMDK handles register with an updater, whose greenthread checks
+    the progress of all the registered handles every check_interval
+    seconds and calls their update_progress() method only if the integer
+    progress percent changed or update_interval seconds passed since the
+    last update. The progress updates are thereby made off the data path,
+    and their number no longer grows with the number of chunks.
+    """
+
+    def __init__(self, check_interval=LEASE_PROGRESS_CHECK_INTERVAL,
+                 update_interval=LEASE_PROGRESS_UPDATE_INTERVAL):
+        """Initializes the updater with the given parameters.
+
+        :param check_interval: interval in seconds between the checks
+        :param update_interval: maximum interval in seconds between two
+                                updates of a lease
+        """
+        self._check_interval = check_interval
+        self._update_interval = update_interval
+        # Progress percent and time of the last update of each handle.
+        self._handles = {}
+        self._poller = None
+
+    def register(self, handle):
+        """Start updating the lease progress of the given handle.
+
+        :param handle: handle with get_progress() and update_progress()
+                       methods
+        """
+        self._handles[handle] = (None, time.time())
+        if self._poller is None:
+            self._poller = greenthread.spawn(self._poll_loop)
+
+    def unregister(self, handle):
+        """Stop updating the lease progress of the given handle."""
+        self._handles.pop(handle, None)
+
+    def _poll_loop(self):
+        try:
+            while self._handles:
+                greenthread.sleep(self._check_interval)
+                for handle in list(self._handles):
+                    try:
+                        self._update(handle)
+                    except Exception:
+                        # The greenthread is shared by all the leases, hence
+                        # only the failing handle is dropped.
+                        LOG.exception(_LE("Error occurred while updating "
+                                          "the lease progress of: %s."),
+                                      handle)
+                        self.unregister(handle)
+        finally:
+            self._poller = None
+
+    def _update(self, handle):
+        last_progress, last_time = self._handles[handle]
+        progress = handle.get_progress()
+        now = time.time()
+        if (progress == last_progress and
+                now - last_time < self._update_interval):
+            return
+        try:
+            handle.update_progress()
+        except exceptions.VimException:
+            # The error is logged by the handle; the transfer fails on its
+            # own if the lease is lost.
+            pass
+        if handle in self._handles:
+            self._handles[handle] = (progress, now)
+
+
+_default_progress_updater = None
+
+
+def _readinto(file_handle, buf):
+    """Read data from the file into the given buffer.
+
+    Falls back to read() for files without readinto(), such as the HTTP
+    responses of Python 2.
+    """
+    readinto = getattr(file_handle, 'readinto', None)
+    if readinto is not None:
+        return readinto(buf)
+    data = file_handle.read(len(buf))
+    length = len(data)
+    memoryview(buf)[:length] = data
+    return length
+
+
+def _get_default_progress_updater():
+    global _default_progress_updater
+    if _default_progress_updater is None:
+        _default_progress_updater = LeaseProgressUpdater()
+    return _default_progress_updater
 
 
 class FileHandle(object):
@@ -61,14 +170,20 @@ class FileHandle(object):
 
     def _create_read_connection(self, url, cookies=None, cacerts=False):
         LOG.debug("Opening URL: %s for reading.", url)
+        _urlparse = urlparse.urlparse(url)
+        scheme, netloc, path, params, query, fragment = _urlparse
+        if query:
+            path = path + '?' + query
         try:
             headers = {'User-Agent': USER_AGENT}
             if cookies:
                 headers.update({'Cookie':
                                 self._build_vim_cookie_header(cookies)})
-            response = requests.get(url, headers=headers, stream=True,
-                                    verify=cacerts)
-            return response.raw
+            conn = http_pool.get_default_pool().get(scheme, netloc,
+                                                    cacerts=cacerts)
+            conn.request('GET', path, headers=headers)
+            # Closing the response returns the connection to the pool.
+            return conn.getresponse()
         except Exception as excep:
             # TODO(vbala) We need to catch and raise specific exceptions
             # related to connection problems, invalid request and invalid
@@ -84,7 +199,11 @@ class FileHandle(object):
                                  overwrite=None,
                                  content_type=None,
                                  cacerts=False):
-        """Create HTTP connection to write to VMDK file."""
+        """Create HTTP connection to write to VMDK file.
+
+        The connection is taken from the shared HTTP connection pool and
+        returns to it when closed after its response has been read.
+        """
         LOG.debug("Creating HTTP connection to write to file with "
                   "size = %(file_size)d and URL = %(url)s.",
                   {'file_size': file_size,
@@ -93,27 +212,8 @@ class FileHandle(object):
         scheme, netloc, path, params, query, fragment = _urlparse
 
         try:
-            if scheme == 'http':
-                conn = httplib.HTTPConnection(netloc)
-            elif scheme == 'https':
-                conn = httplib.HTTPSConnection(netloc)
-                cert_reqs = None
-
-                # cacerts can be either True or False or contain
-                # actual certificates. If it is a boolean, then
-                # we need to set cert_reqs and clear the cacerts
-                if isinstance(cacerts, bool):
-                    if cacerts:
-                        cert_reqs = ssl.CERT_REQUIRED
-                    else:
-                        cert_reqs = ssl.CERT_NONE
-                    cacerts = None
-
-                conn.set_cert(ca_certs=cacerts, cert_reqs=cert_reqs)
-            else:
-                excep_msg = _("Invalid scheme: %s.") % scheme
-                LOG.error(excep_msg)
-                raise ValueError(excep_msg)
+            conn = http_pool.get_default_pool().get(scheme, netloc,
+                                                    cacerts=cacerts)
 
             if query:
                 path = path + '?' + query
@@ -134,7 +234,7 @@ class FileHandle(object):
                 conn.putheader(key, value)
             conn.endheaders()
             return conn
-        except requests.RequestException as excep:
+        except (IOError, httplib.HTTPException) as excep:
             excep_msg = _("Error occurred while creating HTTP connection "
                           "to write to VMDK file with URL = %s.") % url
             LOG.exception(excep_msg)
@@ -256,6 +356,7 @@ class FileWriteHandle(FileHandle):
                                                    file_size,
                                                    cookies=cookies,
                                                    cacerts=cacerts)
+        self._response = None
         FileHandle.__init__(self, self._conn)
 
     def write(self, data):
@@ -280,11 +381,23 @@ class FileWriteHandle(FileHandle):
             LOG.exception(excep_msg)
             raise exceptions.VimException(excep_msg, excep)
 
+    def getresponse(self):
+        """Get the HTTP response once all the data has been written.
+
+        :returns: the HTTP response
+        """
+        if self._response is None:
+            self._response = self._conn.getresponse()
+        return self._response
+
     def close(self):
-        """Get the response and close the connection."""
+        """Get the response and close the connection.
+
+        The response body is read so that the connection can be reused.
+        """
         LOG.debug("Closing write handle for %s.", self._url)
         try:
-            self._conn.getresponse()
+            self.getresponse().read()
         except Exception:
             LOG.warn(_LW("Error occurred while reading the HTTP response."),
                      exc_info=True)
@@ -302,7 +415,7 @@ class VmdkWriteHandle(FileHandle):
     """
 
     def __init__(self, session, host, port, rp_ref, vm_folder_ref, import_spec,
-                 vmdk_size):
+                 vmdk_size, progress_updater=None):
         """Initializes the VMDK write handle with input parameters.
 
         :param session: valid API session to ESX/VC server
@@ -313,6 +426,9 @@ class VmdkWriteHandle(FileHandle):
                               of backing VM
         :param import_spec: import specification of the backing VM
         :param vmdk_size: size of the backing VM's VMDK file
+        :param progress_updater: LeaseProgressUpdater keeping the lease
+                                 alive; defaults to an updater shared by
+                                 the handles
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException,
                  ValueError
@@ -348,6 +464,9 @@ class VmdkWriteHandle(FileHandle):
                                                    content_type=octet_stream,
                                                    cacerts=session._cacert)
         FileHandle.__init__(self, self._conn)
+        self._progress_updater = (progress_updater or
+                                  _get_default_progress_updater())
+        self._progress_updater.register(self)
 
     def get_imported_vm(self):
         """"Get managed object reference of the VM created for import."""
@@ -394,6 +513,13 @@ class VmdkWriteHandle(FileHandle):
             LOG.exception(excep_msg)
             raise exceptions.VimException(excep_msg, excep)
 
+    def get_progress(self):
+        """Get the write progress percent."""
+        try:
+            return int(float(self._bytes_written) / self._vmdk_size * 100)
+        except ZeroDivisionError:
+            return 0
+
     # TODO(vbala) Move this method to FileHandle.
     def update_progress(self):
         """Updates progress to lease.
@@ -404,7 +530,7 @@ class VmdkWriteHandle(FileHandle):
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException
         """
-        progress = int(float(self._bytes_written) / self._vmdk_size * 100)
+        progress = self.get_progress()
         self._log_progress(progress)
 
         try:
@@ -425,6 +551,7 @@ class VmdkWriteHandle(FileHandle):
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException
         """
+        self._progress_updater.unregister(self)
         LOG.debug("Getting lease state for %s.", self._url)
         try:
             state = self._session.invoke_api(vim_util,
@@ -460,7 +587,7 @@ class VmdkReadHandle(FileHandle):
     """VMDK read handle based on HttpNfcLease."""
 
     def __init__(self, session, host, port, vm_ref, vmdk_path,
-                 vmdk_size):
+                 vmdk_size, progress_updater=None):
         """Initializes the VMDK read handle with the given parameters.
 
         During the read (export) operation, the VMDK file is converted to a
@@ -474,6 +601,9 @@ class VmdkReadHandle(FileHandle):
                        is to be exported
         :param vmdk_path: path of the VMDK file to be exported
         :param vmdk_size: actual size of the VMDK file
+        :param progress_updater: LeaseProgressUpdater keeping the lease
+                                 alive; defaults to an updater shared by
+                                 the handles
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException
         """
@@ -499,6 +629,9 @@ class VmdkReadHandle(FileHandle):
                                                   cookies=cookies,
                                                   cacerts=cacerts)
         FileHandle.__init__(self, self._conn)
+        self._progress_updater = (progress_updater or
+                                  _get_default_progress_updater())
+        self._progress_updater.register(self)
 
     def _create_and_wait_for_lease(self, session, vm_ref):
         """Create and wait for HttpNfcLease lease for VM export."""
@@ -519,7 +652,7 @@ class VmdkReadHandle(FileHandle):
         :raises: VimException
         """
         try:
-            data = self._file_handle.read(READ_CHUNKSIZE)
+            data = self._file_handle.read(chunk_size)
             self._bytes_read += len(data)
             return data
         except Exception as excep:
@@ -531,6 +664,30 @@ class VmdkReadHandle(FileHandle):
             LOG.exception(excep_msg)
             raise exceptions.VimException(excep_msg, excep)
 
+    def readinto(self, buf):
+        """Read data from the VMDK file into the given buffer.
+
+        :param buf: writable buffer to read the data into
+        :returns: the number of bytes read; 0 at the end of the file
+        :raises: VimException
+        """
+        try:
+            length = _readinto(self._file_handle, buf)
+            self._bytes_read += length
+            return length
+        except Exception as excep:
+            excep_msg = _("Error occurred while reading data from"
+                          " %s.") % self._url
+            LOG.exception(excep_msg)
+            raise exceptions.VimException(excep_msg, excep)
+
+    def get_progress(self):
+        """Get the read progress percent."""
+        try:
+            return int(float(self._bytes_read) / self._vmdk_size * 100)
+        except ZeroDivisionError:
+            return 0
+
     def update_progress(self):
         """Updates progress to lease.
 
@@ -540,7 +697,7 @@ class VmdkReadHandle(FileHandle):
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException
         """
-        progress = int(float(self._bytes_read) / self._vmdk_size * 100)
+        progress = self.get_progress()
         self._log_progress(progress)
 
         try:
@@ -560,6 +717,7 @@ class VmdkReadHandle(FileHandle):
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException
         """
+        self._progress_updater.unregister(self)
         LOG.debug("Getting lease state for %s.", self._url)
         try:
             state = self._session.invoke_api(vim_util,
@@ -592,6 +750,238 @@ class VmdkReadHandle(FileHandle):
         return "VMDK read handle for %s" % self._url
 
 
+class ParallelFileReadHandle(object):
+    """Read handle for a datastore file using parallel HTTP range requests.
+
+    The file is split into ranges which are downloaded over several
+    connections. The data is either read in order using read() or
+    readinto(), in which case the ranges are prefetched at most two per
+    connection ahead of the reader, or written at their offsets into a
+    local file using download_to(). A range whose download fails is
+    retried starting from the first byte which was not received.
+
+    Example:
+        ds_url = datastore.build_url('https', host, 'vm/disk-flat.vmdk')
+        cookie = functools.partial(ds_url.get_transfer_ticket, session, 'GET')
+        handle = ParallelFileReadHandle(ds_url, file_size, cookie)
+        handle.download_to(local_file)
+    """
+
+    def __init__(self, url, file_size, cookie=None, cacerts=False,
+                 connections=4, range_size=RANGE_SIZE, max_retries=3):
+        """Initializes the read handle with the given parameters.
+
+        :param url: datastore file URL; either a string or a DatastoreURL
+        :param file_size: size of the file in bytes
+        :param cookie: value of the Cookie header, or a callable returning
+                       it which is called for each request; use a callable
+                       for single use credentials such as the tickets
+                       returned by DatastoreURL.get_transfer_ticket()
+        :param cacerts: CA bundle file or whether to verify the server
+                        certificate
+        :param connections: number of parallel connections
+        :param range_size: size in bytes of each range request
+        :param max_retries: number of times the download of a range is
+                            resumed after connection problems
+        """
+        self._url = str(url)
+        self._file_size = file_size
+        self._cookie = cookie
+        self._cacerts = cacerts
+        self._connections = connections
+        self._range_size = range_size
+        self._range_count = (file_size + range_size - 1) // range_size
+        self._retry_policy = retry.RetryPolicy(
+            max_retry_count=max_retries,
+            retryable=(exceptions.VimConnectionException,),
+            backoff=retry.ExponentialBackoff(initial_delay=1, max_delay=10))
+        self._next_index = 0
+        self._threads = []
+        self._closed = False
+        # State of the in order reads.
+        self._ranges = {}
+        self._window = None
+        self._read_index = 0
+        self._read_offset = 0
+
+    def _get_headers(self, start, end):
+        headers = {'User-Agent': USER_AGENT,
+                   'Range': 'bytes=%d-%d' % (start, end - 1)}
+        cookie = self._cookie() if callable(self._cookie) else self._cookie
+        if cookie:
+            headers['Cookie'] = cookie
+        return headers
+
+    def _fetch_range(self, index):
+        """Download the range with the given index, resuming on errors."""
+        start = index * self._range_size
+        buf = bytearray(min(self._range_size, self._file_size - start))
+        view = memoryview(buf)
+        received = [0]
+        scheme, netloc, path, params, query, fragment = urlparse.urlparse(
+            self._url)
+        if query:
+            path = path + '?' + query
+
+        def fetch():
+            headers = self._get_headers(start + received[0], start + len(buf))
+            conn = http_pool.get_default_pool().get(scheme, netloc,
+                                                    cacerts=self._cacerts)
+            try:
+                conn.request('GET', path, headers=headers)
+                response = conn.getresponse()
+            except (IOError, httplib.HTTPException) as excep:
+                conn.close()
+                excep_msg = _("Error occurred while opening URL: %s for "
+                              "reading.") % self._url
+                raise exceptions.VimConnectionException(excep_msg, excep)
+            try:
+                if response.status != 206:
+                    excep_msg = (_("Unexpected status: %(status)d for range "
+                                   "request to URL: %(url)s.") %
+                                 {'status': response.status,
+                                  'url': self._url})
+                    if response.status >= 500:
+                        raise exceptions.VimConnectionException(excep_msg)
+                    raise exceptions.VimException(excep_msg)
+                while received[0] < len(buf):
+                    length = _readinto(response, view[received[0]:])
+                    if not length:
+                        raise exceptions.VimConnectionException(
+                            _("Connection closed while reading data from "
+                              "%s.") % self._url)
+                    received[0] += length
+            except (IOError, httplib.HTTPException) as excep:
+                excep_msg = _("Error occurred while reading data from"
+                              " %s.") % self._url
+                raise exceptions.VimConnectionException(excep_msg, excep)
+            finally:
+                # Returns the connection to the pool if the range was read
+                # to the end.
+                response.close()
+
+        self._retry_policy.call(fetch)
+        return buf
+
+    def _start(self, deliver):
+        """Start the workers downloading the ranges.
+
+        The workers take their connections from the shared HTTP connection
+        pool.
+
+        :param deliver: callable invoked with the index of each range and
+                        either its data or the exception which occurred
+        """
+        def worker():
+            while not self._closed:
+                if self._window is not None:
+                    self._window.acquire()
+                index = self._next_index
+                if index >= self._range_count:
+                    return
+                self._next_index += 1
+                try:
+                    data = self._fetch_range(index)
+                except Exception as excep:
+                    LOG.exception(_LE("Error occurred while reading "
+                                      "range: %(index)d of %(url)s."),
+                                  {'index': index, 'url': self._url})
+                    deliver(index, excep)
+                    return
+                deliver(index, data)
+
+        for i in range(min(self._connections, self._range_count)):
+            self._threads.append(greenthread.spawn(worker))
+
+    def download_to(self, file_handle):
+        """Download the file and write each range at its offset.
+
+        :param file_handle: seekable local file opened for writing
+        :raises: VimException, VimConnectionException
+        """
+        errors = []
+
+        def deliver(index, data):
+            if isinstance(data, Exception):
+                errors.append(data)
+                self._closed = True
+                return
+            file_handle.seek(index * self._range_size)
+            file_handle.write(data)
+
+        self._start(deliver)
+        for thread in self._threads:
+            thread.wait()
+        if errors:
+            raise errors[0]
+        LOG.debug("Downloaded %(size)d bytes from %(url)s.",
+                  {'size': self._file_size, 'url': self._url})
+
+    def _get_read_view(self):
+        """Get the unread data of the current range; None at the end."""
+        if self._read_index >= self._range_count:
+            return None
+        if not self._threads:
+            self._window = semaphore.Semaphore(self._connections * 2)
+
+            def deliver(index, data):
+                waiter = self._ranges.setdefault(index, event.Event())
+                if isinstance(data, Exception):
+                    waiter.send_exception(data)
+                else:
+                    waiter.send(data)
+
+            self._start(deliver)
+        waiter = self._ranges.setdefault(self._read_index, event.Event())
+        data = waiter.wait()
+        if self._read_offset < len(data):
+            return memoryview(data)[self._read_offset:]
+        del self._ranges[self._read_index]
+        self._read_index += 1
+        self._read_offset = 0
+        self._window.release()
+        return self._get_read_view()
+
+    def read(self, chunk_size):
+        """Read the next chunk of data in order.
+
+        :param chunk_size: maximum size of the chunk
+        :returns: the data; empty at the end of the file
+        :raises: VimException, VimConnectionException
+        """
+        view = self._get_read_view()
+        if view is None:
+            return b''
+        data = view[:chunk_size].tobytes()
+        self._read_offset += len(data)
+        return data
+
+    def readinto(self, buf):
+        """Read the next chunk of data in order into the given buffer.
+
+        :param buf: writable buffer to read the data into
+        :returns: the number of bytes read; 0 at the end of the file
+        :raises: VimException, VimConnectionException
+        """
+        view = self._get_read_view()
+        if view is None:
+            return 0
+        length = min(len(buf), len(view))
+        memoryview(buf)[:length] = view[:length]
+        self._read_offset += length
+        return length
+
+    def close(self):
+        """Stop the downloads."""
+        self._closed = True
+        for thread in self._threads:
+            thread.kill()
+        self._ranges.clear()
+
+    def __str__(self):
+        return "Parallel file read handle for %s" % self._url
+
+
 class ImageReadHandle(object):
     """Read handle for glance images."""
 
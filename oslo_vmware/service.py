@@ -33,6 +33,7 @@ from suds import transport
 from oslo.utils import timeutils
 from oslo_vmware._i18n import _
 from oslo_vmware import exceptions
+from oslo_vmware import soap_fastpath
 from oslo_vmware import vim_util
 
 CACHE_TIMEOUT = 60 * 60  # One hour cache timeout
@@ -184,7 +185,7 @@ class Service(object):
     """
 
     def __init__(self, wsdl_url=None, soap_url=None,
-                 cacert=None, insecure=True):
+                 cacert=None, insecure=True, use_fast_path=False):
         self.wsdl_url = wsdl_url
         self.soap_url = soap_url
         LOG.debug("Creating suds client with soap_url='%s' and wsdl_url='%s'",
@@ -196,6 +197,8 @@ class Service(object):
                                     plugins=[ServiceMessagePlugin()],
                                     cache=_CACHE)
         self._service_content = None
+        self._use_fast_path = use_fast_path
+        self._fast_path = None
 
     @staticmethod
     def build_base_url(protocol, host, port):
@@ -253,6 +256,15 @@ class Service(object):
             self._service_content = self.retrieve_service_content()
         return self._service_content
 
+    def _get_fast_path(self, attr_name):
+        """Returns the SOAP fast path if it handles the given method."""
+        if not self._use_fast_path:
+            return None
+        if self._fast_path is None:
+            self._fast_path = soap_fastpath.FastPath(self.client)
+        if self._fast_path.supports(attr_name):
+            return self._fast_path
+
     def get_http_cookie(self):
         """Return the vCenter session cookie."""
         cookies = self.client.options.transport.cookiejar
@@ -284,8 +296,13 @@ class Service(object):
                                                         managed_object)
                 if managed_object is None:
                     return
-                request = getattr(self.client.service, attr_name)
-                response = request(managed_object, **kwargs)
+                fast_path = self._get_fast_path(attr_name)
+                if fast_path is not None:
+                    response = fast_path.invoke(attr_name, managed_object,
+                                                **kwargs)
+                else:
+                    request = getattr(self.client.service, attr_name)
+                    response = request(managed_object, **kwargs)
                 if (attr_name.lower() == 'retrievepropertiesex'):
                     Service._retrieve_properties_ex_fault_checker(response)
                 return response
@@ -314,7 +331,8 @@ class Service(object):
                         for child in fault.getChildren():
                             details[child.name] = child.getText()
                 raise exceptions.VimFaultException(fault_list, fault_string,
-                                                   excep, details)
+                                                   excep, details,
+                                                   server_fault=True)
 
             except AttributeError as excep:
                 raise exceptions.VimAttributeException(
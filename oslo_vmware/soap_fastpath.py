@@ -0,0 +1,276 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+SOAP fast path for the most frequently invoked VIM methods.
+
+Suds builds every request as an object graph derived from the WSDL schema,
+which is then pruned and walked by ServiceMessagePlugin before being
+serialized. For the few methods which make up most of the API traffic, the
+fast path renders the request directly into a pre-compiled envelope
+template and sends it through the suds client's transport.
+
+The replies of methods returning simple values are parsed by a streaming
+ElementTree parser. The replies of RetrievePropertiesEx and
+ContinueRetrievePropertiesEx contain arbitrary typed data objects; they
+are still unmarshalled by suds using the schema, but their requests skip
+the suds marshalling.
+"""
+
+from xml.etree import ElementTree
+from xml.sax import saxutils
+
+import six
+import six.moves.http_client as httplib
+import suds
+from suds.bindings import binding
+# The suds SAX parser expects suds.metrics to be loaded.
+from suds import metrics  # noqa
+from suds.sax import parser
+from suds import sudsobject
+from suds import transport
+
+from oslo_vmware._i18n import _
+from oslo_vmware import exceptions
+
+
+SOAP_ENV_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+XSD_NS = 'http://www.w3.org/2001/XMLSchema'
+XSI_NS = 'http://www.w3.org/2001/XMLSchema-instance'
+VIM_NS = 'urn:vim25'
+
+RESP_NOT_XML_ERROR = 'Response is "text/html", not "text/xml"'
+
+_ENVELOPE_HEAD = ('<?xml version="1.0" encoding="UTF-8"?>'
+                  '<soapenv:Envelope xmlns:soapenv="%s" xmlns:xsd="%s" '
+                  'xmlns:xsi="%s"><soapenv:Body>' %
+                  (SOAP_ENV_NS, XSD_NS, XSI_NS))
+_ENVELOPE_TAIL = '</soapenv:Body></soapenv:Envelope>'
+
+_RETURNVAL_TAG = '{%s}returnval' % VIM_NS
+_FAULT_TAG = '{%s}Fault' % SOAP_ENV_NS
+_XSI_TYPE = '{%s}type' % XSI_NS
+
+# Parameters, in schema order, of the methods handled by the fast path.
+METHOD_PARAMS = {
+    'RetrievePropertiesEx': ('specSet', 'options'),
+    'ContinueRetrievePropertiesEx': ('token',),
+    'CancelRetrievePropertiesEx': ('token',),
+    'SessionIsActive': ('sessionID', 'userName'),
+    'HttpNfcLeaseProgress': ('percent',),
+}
+
+# Methods whose replies need to be unmarshalled using the schema.
+_TYPED_REPLY_METHODS = frozenset(['RetrievePropertiesEx',
+                                  'ContinueRetrievePropertiesEx'])
+
+
+def _get_reply_takes_root():
+    """Returns whether Binding.get_reply() takes the parsed reply.
+
+    suds-jurko takes the root of the parsed reply and returns the result;
+    suds 0.4 takes the reply string and returns a (root, result) tuple.
+    """
+    code = six.get_function_code(
+        six.get_unbound_function(binding.Binding.get_reply))
+    return 'replyroot' in code.co_varnames[:code.co_argcount]
+
+
+# The replies of the typed reply methods are unmarshalled by suds only if
+# its get_reply() API is the expected one; otherwise these methods are
+# left to the suds client.
+_UNMARSHAL_SUPPORTED = _get_reply_takes_root()
+
+
+def _to_text(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return six.text_type(value)
+
+
+def serialize(name, value):
+    """Serializes the given value into XML elements with the given name.
+
+    Suds objects are serialized in the order of their fields. Fields with
+    a leading underscore are serialized as attributes and the 'value'
+    field of objects with attributes (for e.g., managed object references)
+    as the text content. Elements without content are omitted, as done by
+    the envelope pruning of the suds path.
+
+    :param name: element name
+    :param value: suds object, list or simple value
+    :returns: XML fragment
+    """
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ''.join([serialize(name, item) for item in value])
+    if not isinstance(value, sudsobject.Object):
+        text = _to_text(value)
+        if not text:
+            return ''
+        return '<%s>%s</%s>' % (name, saxutils.escape(text), name)
+
+    attrs = []
+    fields = []
+    for key, val in value:
+        if val is None:
+            continue
+        if key.startswith('_'):
+            attrs.append(' %s=%s' % (key[1:],
+                                     saxutils.quoteattr(_to_text(val))))
+        else:
+            fields.append((key, val))
+    if attrs:
+        content = ''.join([saxutils.escape(_to_text(val))
+                           for key, val in fields if key == 'value'])
+    else:
+        content = ''.join([serialize(key, val) for key, val in fields])
+        if not content:
+            return ''
+        # The declared type of an element might be a base type of the
+        # value's type (for e.g., TraversalSpec in selectSet).
+        attrs.append(' xsi:type="%s"' % value.__class__.__name__)
+    return '<%s%s>%s</%s>' % (name, ''.join(attrs), content, name)
+
+
+def _local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+def _parse_reply(reply):
+    """Parses the reply of a method returning a simple value.
+
+    :param reply: reply XML
+    :returns: text of the returnval element or None
+    :raises: VimFaultException
+    """
+    returnval = None
+    events = ElementTree.iterparse(six.BytesIO(reply), events=('end',))
+    for event, elem in events:
+        if elem.tag == _RETURNVAL_TAG:
+            returnval = elem.text
+        elif elem.tag == _FAULT_TAG:
+            _raise_fault(elem)
+    return returnval
+
+
+def _raise_fault(fault):
+    fault_string = None
+    fault_list = []
+    details = {}
+    for elem in fault:
+        name = _local_name(elem.tag)
+        if name == 'faultstring':
+            fault_string = elem.text
+        elif name == 'detail':
+            for fault_elem in elem:
+                fault_list.append(fault_elem.get(_XSI_TYPE))
+                for child in fault_elem:
+                    details[_local_name(child.tag)] = child.text
+    # The cause is a WebFault as raised by the suds client.
+    fault_obj = sudsobject.Object()
+    fault_obj.faultstring = fault_string
+    raise exceptions.VimFaultException(fault_list, fault_string,
+                                       suds.WebFault(fault_obj, None),
+                                       details, server_fault=True)
+
+
+class FastPath(object):
+    """Invokes the supported VIM methods using pre-compiled envelopes."""
+
+    def __init__(self, client):
+        """Initializes the fast path for the given suds client.
+
+        :param client: suds client of the VIM service
+        """
+        self._client = client
+        self._methods = {}
+        port = client.wsdl.services[0].ports[0]
+        for name in METHOD_PARAMS:
+            if (name in _TYPED_REPLY_METHODS and
+                    not _UNMARSHAL_SUPPORTED):
+                continue
+            method = port.methods.get(name)
+            if method is not None:
+                self._methods[name] = method
+        self._templates = dict(
+            (name, (_ENVELOPE_HEAD + '<%s xmlns="%s">' % (name, VIM_NS),
+                    '</%s>' % name + _ENVELOPE_TAIL))
+            for name in self._methods)
+
+    def supports(self, method_name):
+        """Returns whether the given method is handled by the fast path."""
+        return method_name in self._methods
+
+    def render(self, method_name, managed_object, **kwargs):
+        """Renders the request envelope of the given method call.
+
+        :param method_name: name of the VIM method
+        :param managed_object: managed object reference argument
+        :param kwargs: keyword arguments of the method call
+        :returns: request envelope
+        """
+        params = METHOD_PARAMS[method_name]
+        unexpected = set(kwargs) - set(params)
+        if unexpected:
+            raise TypeError(_("%(method)s() got unexpected keyword "
+                              "arguments: %(args)s.") %
+                            {'method': method_name,
+                             'args': ', '.join(sorted(unexpected))})
+        head, tail = self._templates[method_name]
+        parts = [head, serialize('_this', managed_object)]
+        for param in params:
+            parts.append(serialize(param, kwargs.get(param)))
+        parts.append(tail)
+        return ''.join(parts).encode('utf-8')
+
+    def invoke(self, method_name, managed_object, **kwargs):
+        """Invokes the given method.
+
+        :param method_name: name of the VIM method
+        :param managed_object: managed object reference argument
+        :param kwargs: keyword arguments of the method call
+        :returns: response of the method call
+        :raises: VimFaultException, TypeError, requests.RequestException
+        """
+        method = self._methods[method_name]
+        options = self._client.options
+        request = transport.Request(
+            options.location,
+            self.render(method_name, managed_object, **kwargs))
+        request.headers = {'Content-Type': 'text/xml; charset=utf-8',
+                           'SOAPAction': method.soap.action}
+        request.headers.update(options.headers or {})
+        reply = options.transport.send(request)
+
+        content_type = reply.headers.get('content-type', '')
+        if content_type.startswith('text/html'):
+            # Raised in the same way as suds to be handled as an overload.
+            raise TypeError(RESP_NOT_XML_ERROR)
+        if reply.code not in (httplib.OK, httplib.INTERNAL_SERVER_ERROR):
+            raise exceptions.VimException(
+                _("Unexpected HTTP status: %(status)s in %(method)s.") %
+                {'status': reply.code, 'method': method_name})
+
+        if (method_name not in _TYPED_REPLY_METHODS or
+                reply.code == httplib.INTERNAL_SERVER_ERROR):
+            returnval = _parse_reply(reply.message)
+            if method_name == 'SessionIsActive':
+                return returnval == 'true'
+            return returnval
+
+        replyroot = parser.Parser().parse(string=reply.message)
+        return method.binding.output.get_reply(method, replyroot)
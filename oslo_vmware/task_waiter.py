@@ -0,0 +1,239 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Task completion tracking based on property collector updates.
+
+Instead of polling the info of every task on a fixed interval, the task
+waiter registers a property filter for each task on a property collector
+owned by the waiter. A single greenthread calls WaitForUpdatesEx on that
+collector and fans the task info changes out to the callers waiting on
+the individual tasks. N concurrent waiters therefore cost one long-poll
+instead of N polling loops.
+"""
+
+import logging
+
+from eventlet import event
+from eventlet import greenthread
+from eventlet import semaphore
+
+from oslo_vmware._i18n import _LE, _LW
+from oslo_vmware import exceptions
+from oslo_vmware import vim_util
+
+
+LOG = logging.getLogger(__name__)
+
+# Maximum time in seconds the server blocks a WaitForUpdatesEx call when
+# there are no task updates.
+DEFAULT_MAX_WAIT = 60
+
+TASK_TYPE = 'Task'
+TASK_INFO_PROPERTY = 'info'
+
+
+class _TaskEntry(object):
+    """Book-keeping for a task being waited upon."""
+
+    def __init__(self, task):
+        self.task = task
+        self.prop_filter = None
+        self.done = event.Event()
+
+
+class TaskWaiter(object):
+    """Waits for tasks using a shared WaitForUpdatesEx long-poll.
+
+    Example:
+        waiter = TaskWaiter(api_session)
+        task_info = waiter.wait(task)
+    """
+
+    def __init__(self, session, max_wait=DEFAULT_MAX_WAIT):
+        """Initializes the task waiter.
+
+        :param session: VMwareAPISession object used for the API calls
+        :param max_wait: maximum time in seconds the server blocks each
+                         WaitForUpdatesEx call when there are no updates
+        """
+        self._session = session
+        self._max_wait = max_wait
+        self._collector = None
+        self._collector_lock = semaphore.Semaphore()
+        self._version = ''
+        self._entries = {}
+        self._thread = None
+        self._failures = 0
+
+    def wait(self, task):
+        """Waits for the given task to complete and returns the task info.
+
+        :param task: managed object reference of the task
+        :returns: task info upon successful completion of the task
+        :raises: VimException, VimFaultException, VimAttributeException,
+                 VimSessionOverLoadException, VimConnectionException
+        """
+        entry = self._entries.get(task.value)
+        if entry is None:
+            entry = _TaskEntry(task)
+            self._entries[task.value] = entry
+            try:
+                self._register(entry)
+            except Exception:
+                self._entries.pop(task.value, None)
+                raise
+            if self._thread is None:
+                self._thread = greenthread.spawn(self._run)
+        LOG.debug("Waiting for the task: %s to complete.", task)
+        return entry.done.wait()
+
+    def _get_collector(self):
+        with self._collector_lock:
+            if self._collector is None:
+                LOG.debug("Creating property collector for task updates.")
+                self._collector = self._session.invoke_api(
+                    vim_util, 'create_property_collector', self._session.vim)
+                self._version = ''
+            return self._collector
+
+    def _register(self, entry):
+        """Creates the property filter reporting the given task's info."""
+        collector = self._get_collector()
+        client_factory = self._session.vim.client.factory
+        prop_spec = vim_util.build_property_spec(client_factory,
+                                                 TASK_TYPE,
+                                                 [TASK_INFO_PROPERTY])
+        obj_spec = vim_util.build_object_spec(client_factory, entry.task, [])
+        filter_spec = vim_util.build_property_filter_spec(client_factory,
+                                                          [prop_spec],
+                                                          [obj_spec])
+        entry.prop_filter = self._session.invoke_api(vim_util,
+                                                     'create_filter',
+                                                     self._session.vim,
+                                                     filter_spec,
+                                                     collector)
+
+    def _unregister(self, entry):
+        if entry.prop_filter is None:
+            return
+        try:
+            self._session.invoke_api(vim_util,
+                                     'destroy_filter',
+                                     self._session.vim,
+                                     entry.prop_filter)
+        except exceptions.VimException:
+            LOG.warn(_LW("Error occurred while destroying the property "
+                         "filter of task: %s."),
+                     entry.task,
+                     exc_info=True)
+
+    def _destroy_collector(self):
+        """Destroys the property collector and its filters, if any."""
+        collector, self._collector = self._collector, None
+        if collector is None:
+            return
+        try:
+            self._session.invoke_api(vim_util,
+                                     'destroy_property_collector',
+                                     self._session.vim,
+                                     collector)
+        except exceptions.VimException:
+            # The collector is already gone if the session was re-created.
+            LOG.debug("Error occurred while destroying the property "
+                      "collector for task updates.", exc_info=True)
+
+    def _run(self):
+        """Dispatches task updates until there are no tasks to wait for."""
+        try:
+            while self._entries:
+                try:
+                    update_set = self._session.invoke_api(
+                        vim_util,
+                        'wait_for_updates_ex',
+                        self._session.vim,
+                        self._version,
+                        collector=self._collector,
+                        max_wait=self._max_wait)
+                except exceptions.VimException as excep:
+                    self._recover(excep)
+                    continue
+                self._failures = 0
+                if update_set:
+                    self._version = update_set.version
+                    self._process_update_set(update_set)
+        finally:
+            self._thread = None
+
+    def _recover(self, excep):
+        """Re-registers the pending tasks after a WaitForUpdatesEx error.
+
+        The collector and its filters are lost if the session was re-created
+        while handling the error; therefore they are destroyed, in case they
+        still exist, and created again. The pending waiters are failed if
+        the problem persists.
+        """
+        self._failures += 1
+        if self._failures > 1:
+            self._fail_all(excep)
+            return
+        LOG.warn(_LW("Error occurred while waiting for task updates; "
+                     "re-creating the property collector."),
+                 exc_info=True)
+        self._destroy_collector()
+        try:
+            for entry in list(self._entries.values()):
+                self._register(entry)
+        except exceptions.VimException as reg_excep:
+            self._fail_all(reg_excep)
+
+    def _fail_all(self, excep):
+        LOG.error(_LE("Unable to wait for updates of tasks: %s."),
+                  [entry.task for entry in self._entries.values()])
+        self._destroy_collector()
+        self._failures = 0
+        entries = list(self._entries.values())
+        self._entries.clear()
+        for entry in entries:
+            entry.done.send_exception(excep)
+
+    def _process_update_set(self, update_set):
+        for filter_update in getattr(update_set, 'filterSet', None) or []:
+            for obj_update in getattr(filter_update, 'objectSet', None) or []:
+                entry = self._entries.get(obj_update.obj.value)
+                if entry is None:
+                    continue
+                for change in getattr(obj_update, 'changeSet', None) or []:
+                    if (change.name == TASK_INFO_PROPERTY and
+                            hasattr(change, 'val')):
+                        self._dispatch(entry, change.val)
+
+    def _dispatch(self, entry, task_info):
+        task = entry.task
+        if task_info.state in ['queued', 'running']:
+            if hasattr(task_info, 'progress'):
+                LOG.debug("Task: %(task)s progress is %(progress)s%%.",
+                          {'task': task,
+                           'progress': task_info.progress})
+            return
+
+        self._entries.pop(task.value, None)
+        if task_info.state == 'success':
+            LOG.debug("Task: %s status is success.", task)
+            entry.done.send(task_info)
+        else:
+            entry.done.send_exception(
+                exceptions.translate_fault(task_info.error))
+        self._unregister(entry)
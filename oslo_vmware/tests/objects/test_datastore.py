@@ -12,11 +12,16 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import copy
+import pickle
+import ssl
+
 import mock
 import six.moves.urllib.parse as urlparse
 
 from oslo.utils import units
 from oslo_vmware import constants
+from oslo_vmware import exceptions
 from oslo_vmware.objects import datastore
 from oslo_vmware.tests import base
 from oslo_vmware import vim_util
@@ -133,6 +138,247 @@ class DatastoreTestCase(base.TestCase):
         self.assertFalse(datastore.Datastore.is_datastore_mount_usable(m))
 
 
+class ConnectedHostResolverTestCase(base.TestCase):
+
+    """Test the ConnectedHostResolver."""
+
+    def setUp(self):
+        super(ConnectedHostResolverTestCase, self).setUp()
+        self.ds = datastore.Datastore(
+            vim_util.get_moref('ds-0', 'Datastore'), 'ds-name')
+        self.host_refs = [vim_util.get_moref('host-%d' % index, 'HostSystem')
+                          for index in range(4)]
+
+        class Prop(object):
+            DatastoreHostMount = [
+                HostMount(self.host_refs[0],
+                          MountInfo('readWrite', True, True)),
+                HostMount(self.host_refs[1],
+                          MountInfo('readWrite', True, True)),
+                HostMount(self.host_refs[2],
+                          MountInfo('readWrite', True, True)),
+                HostMount(self.host_refs[3],
+                          MountInfo('read', True, True))]
+
+        self.ds_props = {'summary.accessible': True, 'host': Prop()}
+        self.host_props = {
+            'host-0': {'name': 'esx0', 'runtime.connectionState': 'connected',
+                       'runtime.inMaintenanceMode': False},
+            'host-1': {'name': 'esx1', 'runtime.connectionState': 'connected',
+                       'runtime.inMaintenanceMode': False},
+            'host-2': {'name': 'esx2',
+                       'runtime.connectionState': 'disconnected',
+                       'runtime.inMaintenanceMode': False}}
+        self.session = mock.Mock()
+        self.session.invoke_api.side_effect = self._invoke_api
+
+    def _invoke_api(self, module, method, vim, ds_ref, ds_properties,
+                    host_properties):
+        self.assertEqual(vim_util, module)
+        self.assertEqual('get_datastore_and_host_properties', method)
+        self.assertEqual(self.ds.ref, ds_ref)
+        self.assertEqual(['summary.accessible', 'host'], ds_properties)
+        self.assertEqual(['name', 'runtime.connectionState',
+                          'runtime.inMaintenanceMode'], host_properties)
+        props = {'ds-0': self.ds_props}
+        props.update(self.host_props)
+        return props
+
+    @mock.patch.object(datastore, 'time')
+    def test_get_connected_hosts(self, time_mod):
+        time_mod.time.return_value = 0
+        resolver = datastore.ConnectedHostResolver(ttl=60)
+        hosts = resolver.get_connected_hosts(self.session, self.ds)
+        self.assertEqual(['esx0', 'esx1'], [host.name for host in hosts])
+        self.assertEqual(self.host_refs[:2], [host.ref for host in hosts])
+        self.assertEqual(1, self.session.invoke_api.call_count)
+
+        time_mod.time.return_value = 59
+        self.assertIs(hosts,
+                      resolver.get_connected_hosts(self.session, self.ds))
+        self.assertEqual(1, self.session.invoke_api.call_count)
+
+        time_mod.time.return_value = 60
+        self.host_props['host-1']['runtime.inMaintenanceMode'] = True
+        hosts = resolver.get_connected_hosts(self.session, self.ds)
+        self.assertEqual(['esx0'], [host.name for host in hosts])
+
+    def test_get_connected_hosts_not_accessible(self):
+        self.ds_props['summary.accessible'] = False
+        resolver = datastore.ConnectedHostResolver()
+        self.assertEqual([],
+                         resolver.get_connected_hosts(self.session, self.ds))
+        self.assertEqual(1, self.session.invoke_api.call_count)
+
+    def test_choose_host(self):
+        resolver = datastore.ConnectedHostResolver()
+        first = resolver.choose_host(self.session, self.ds)
+        second = resolver.choose_host(self.session, self.ds)
+        self.assertEqual(['esx0', 'esx1'],
+                         sorted([first.name, second.name]))
+        self.assertEqual({'esx0': 1, 'esx1': 1}, resolver.get_stats())
+
+        resolver.release_host(first)
+        self.assertEqual(first.name,
+                         resolver.choose_host(self.session, self.ds).name)
+        resolver.release_host(second)
+        self.assertEqual({first.name: 1}, resolver.get_stats())
+
+    def test_choose_host_with_no_host(self):
+        self.ds_props['summary.accessible'] = False
+        resolver = datastore.ConnectedHostResolver()
+        self.assertRaises(exceptions.VimException,
+                          resolver.choose_host,
+                          self.session,
+                          self.ds)
+
+
+class FileInfo(object):
+
+    def __init__(self, path, modification=None):
+        self.path = path
+        self.modification = modification
+
+
+class FolderFileInfo(FileInfo):
+    pass
+
+
+class DatastoreSearchTestCase(base.TestCase):
+
+    """Test the datastore search."""
+
+    def setUp(self):
+        super(DatastoreSearchTestCase, self).setUp()
+        self.addCleanup(datastore._search_cache.clear)
+        self.folders = {
+            '[ds] _base': [FolderFileInfo('img1', 1),
+                           FolderFileInfo('img2', 2),
+                           FileInfo('a.txt')],
+            '[ds] _base/img1': [FileInfo('img1.vmdk')],
+            '[ds] _base/img2': [FileInfo('img2.vmdk'),
+                                FolderFileInfo('sub', 3)],
+            '[ds] _base/img2/sub': [FileInfo('x.vmdk')]}
+        self.searches = []
+        self.session = mock.Mock()
+        self.session.invoke_api.side_effect = self._invoke_api
+        self.session.wait_for_task.side_effect = self._wait_for_task
+        self.ds = datastore.Datastore('fake_ref', 'ds')
+
+    def _invoke_api(self, module, method, *args, **kwargs):
+        if method == 'get_object_property':
+            return 'browser'
+        self.assertEqual('browser', args[0])
+        path = kwargs['datastorePath']
+        self.searches.append((method, path))
+        if path not in self.folders:
+            raise exceptions.FileNotFoundException()
+        return path
+
+    def _wait_for_task(self, path):
+        if path not in self.folders:
+            raise exceptions.FileNotFoundException()
+        results = []
+        for folder, files in sorted(self.folders.items()):
+            if folder == path or folder.startswith(path + '/'):
+                results.append(mock.Mock(folderPath=folder, file=files))
+        if self.searches[-1][0] == 'SearchDatastore_Task':
+            return mock.Mock(result=results[0])
+        return mock.Mock(result=mock.Mock(
+            HostDatastoreBrowserSearchResults=results))
+
+    def _iter_files(self, **kwargs):
+        ds_path = datastore.DatastorePath('ds', '_base')
+        return sorted(str(path) for path, file_info in
+                      self.ds.iter_files(self.session, ds_path, **kwargs))
+
+    def test_search(self):
+        ds_path = datastore.DatastorePath('ds', '_base')
+        results = self.ds.search(self.session, ds_path,
+                                 match_patterns=['*.vmdk'], recursive=True)
+        self.assertEqual(4, len(results))
+        self.assertEqual([('SearchDatastoreSubFolders_Task', '[ds] _base')],
+                         self.searches)
+        spec = self.session.invoke_api.call_args[1]['searchSpec']
+        self.assertEqual(['*.vmdk'], spec.matchPattern)
+        self.assertTrue(spec.details.modification)
+        self.assertFalse(spec.details.fileOwner)
+
+        results = self.ds.search(self.session, ds_path)
+        self.assertEqual(self.folders['[ds] _base'], results[0].file)
+        # The datastore browser is read once.
+        self.assertEqual(3, self.session.invoke_api.call_count)
+
+    def test_iter_files(self):
+        self.assertEqual(['[ds] _base/img1/img1.vmdk',
+                          '[ds] _base/img2/img2.vmdk',
+                          '[ds] _base/img2/sub/x.vmdk'],
+                         self._iter_files(match_patterns=['*.vmdk']))
+        self.assertEqual(4, len(self.searches))
+
+    def test_iter_files_not_recursive(self):
+        self.assertEqual(['[ds] _base/a.txt',
+                          '[ds] _base/img1',
+                          '[ds] _base/img2'],
+                         self._iter_files(recursive=False,
+                                          include_folders=True))
+
+    def test_iter_files_memoized(self):
+        self._iter_files()
+        del self.searches[:]
+        self.folders['[ds] _base/img2'].append(FileInfo('img2.vmx'))
+
+        self.assertEqual(['[ds] _base/a.txt',
+                          '[ds] _base/img1/img1.vmdk',
+                          '[ds] _base/img2/img2.vmdk',
+                          '[ds] _base/img2/img2.vmx',
+                          '[ds] _base/img2/sub/x.vmdk'],
+                         self._iter_files())
+        # Only the folders with subfolders are searched again.
+        self.assertEqual([('SearchDatastore_Task', '[ds] _base'),
+                          ('SearchDatastore_Task', '[ds] _base/img2')],
+                         self.searches)
+
+        # The modification time of the folder changed.
+        self.folders['[ds] _base'][0].modification = 4
+        self._iter_files()
+        self.assertIn(('SearchDatastore_Task', '[ds] _base/img1'),
+                      self.searches)
+
+    def test_iter_files_memoized_per_server(self):
+        self.session._host = 'vc1'
+        self._iter_files()
+        del self.searches[:]
+
+        session = self.session
+        self.session = mock.Mock(_host='vc2')
+        self.session.invoke_api.side_effect = self._invoke_api
+        self.session.wait_for_task.side_effect = self._wait_for_task
+        self._iter_files()
+        # The listings of another server's folders are not used.
+        self.assertIn(('SearchDatastore_Task', '[ds] _base/img1'),
+                      self.searches)
+
+        del self.searches[:]
+        self.session = session
+        self._iter_files()
+        self.assertNotIn(('SearchDatastore_Task', '[ds] _base/img1'),
+                         self.searches)
+
+    def test_iter_files_with_deleted_folder(self):
+        del self.folders['[ds] _base/img1']
+        self.assertEqual(['[ds] _base/a.txt',
+                          '[ds] _base/img2/img2.vmdk',
+                          '[ds] _base/img2/sub/x.vmdk'],
+                         self._iter_files())
+
+        self.assertRaises(exceptions.FileNotFoundException,
+                          list,
+                          self.ds.iter_files(
+                              self.session,
+                              datastore.DatastorePath('ds', 'missing')))
+
+
 class DatastorePathTestCase(base.TestCase):
 
     """Test the DatastorePath object."""
@@ -273,6 +519,42 @@ class DatastorePathTestCase(base.TestCase):
         for p in ['bad path', '/a/b/c', 'a/b/c']:
             self.assertRaises(IndexError, datastore.DatastorePath.parse, p)
 
+    def test_ds_path_parse_many(self):
+        paths = ['[ds1] a/b', '[ds1] a/b/c.vmdk', '[ds1]', '[ds2]  x',
+                 '[ds1] y']
+        parsed = datastore.DatastorePath.parse_many(paths)
+        self.assertEqual([datastore.DatastorePath.parse(p) for p in paths],
+                         parsed)
+        self.assertEqual(['a/b', 'a/b/c.vmdk', '', 'x', 'y'],
+                         [p.rel_path for p in parsed])
+        self.assertRaises(IndexError, datastore.DatastorePath.parse_many,
+                          ['[ds1] a', 'a/b'])
+        for p in [None, '']:
+            self.assertRaises(ValueError, datastore.DatastorePath.parse_many,
+                              ['[ds1] a', p])
+
+    def test_ds_path_hash(self):
+        a = datastore.DatastorePath('ds_name', 'a', 'b')
+        b = datastore.DatastorePath.parse('[ds_name] a/b')
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(1, len(set([a, b])))
+        self.assertNotEqual(a, a.parent)
+        self.assertRaises(AttributeError, setattr, a, 'rel_path', 'c')
+
+    def test_ds_path_cached_components(self):
+        p = datastore.DatastorePath('ds_name', 'a/b', 'c.vmdk')
+        self.assertIs(str(p), str(p))
+        self.assertIs(p.parent, p.parent)
+        self.assertIs(p.basename, p.basename)
+        # The datastore name is shared by the paths of the datastore.
+        self.assertIs(p.datastore,
+                      datastore.DatastorePath('ds_' + 'name').datastore)
+
+    def test_ds_path_pickle(self):
+        p = datastore.DatastorePath('ds_name', 'a', 'b')
+        self.assertEqual(p, pickle.loads(pickle.dumps(p)))
+        self.assertEqual(str(p), str(copy.copy(p)))
+
 
 class DatastoreURLTestCase(base.TestCase):
 
@@ -354,7 +636,7 @@ class DatastoreURLTestCase(base.TestCase):
         ds_url = datastore.DatastoreURL.urlparse(url)
         self.assertEqual(path, ds_url.path)
 
-    @mock.patch('six.moves.http_client.HTTPSConnection')
+    @mock.patch('oslo_vmware.http_pool._HTTPSConnection')
     def test_connect(self, mock_conn):
         dc_path = 'datacenter-1'
         ds_name = 'datastore-1'
@@ -364,7 +646,18 @@ class DatastoreURLTestCase(base.TestCase):
         ds_url = datastore.DatastoreURL.urlparse(url)
         cookie = mock.Mock()
         ds_url.connect('PUT', 128, cookie)
-        mock_conn.assert_called_once_with('13.37.73.31')
+        mock_conn.assert_called_once_with('13.37.73.31', context=mock.ANY)
+        # The server certificate is verified by default.
+        context = mock_conn.call_args[1]['context']
+        self.assertEqual(ssl.CERT_REQUIRED, context.verify_mode)
+
+    @mock.patch('oslo_vmware.http_pool._HTTPSConnection')
+    def test_connect_with_insecure(self, mock_conn):
+        url = 'https://13.37.73.31/folder/images/aa.vmdk?dcPath=dc&dsName=ds'
+        ds_url = datastore.DatastoreURL.urlparse(url)
+        ds_url.connect('GET', 0, mock.Mock(), insecure=True)
+        context = mock_conn.call_args[1]['context']
+        self.assertEqual(ssl.CERT_NONE, context.verify_mode)
 
     def test_get_transfer_ticket(self):
         dc_path = 'datacenter-1'
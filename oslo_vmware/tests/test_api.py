@@ -18,14 +18,19 @@
 Unit tests for session management and API invocation classes.
 """
 
+import gc
+
 from eventlet import greenthread
 import mock
 import six
 import suds
 
 from oslo_vmware import api
+from oslo_vmware import circuit_breaker
 from oslo_vmware import exceptions
+from oslo_vmware import inventory_cache
 from oslo_vmware import pbm
+from oslo_vmware import task_waiter
 from oslo_vmware.tests import base
 from oslo_vmware import vim_util
 
@@ -95,6 +100,154 @@ class RetryDecoratorTest(base.TestCase):
         self.assertTrue(retry._retry_count == 0)
 
 
+class SessionLivenessTrackerTest(base.TestCase):
+    """Tests for SessionLivenessTracker."""
+
+    @mock.patch.object(api.timeutils, 'utcnow_ts')
+    def test_is_active(self, utcnow_ts):
+        tracker = api.SessionLivenessTracker(60)
+        self.assertFalse(tracker.is_active())
+        self.assertIsNone(tracker.idle_time())
+
+        utcnow_ts.return_value = 100
+        tracker.record_success()
+        utcnow_ts.return_value = 159
+        self.assertTrue(tracker.is_active())
+        self.assertEqual(59, tracker.idle_time())
+        utcnow_ts.return_value = 160
+        self.assertFalse(tracker.is_active())
+
+        tracker.record_success()
+        tracker.invalidate()
+        self.assertFalse(tracker.is_active())
+
+    def test_is_active_with_tracking_disabled(self):
+        tracker = api.SessionLivenessTracker(0)
+        tracker.record_success()
+        self.assertFalse(tracker.is_active())
+
+
+class SessionPoolTest(base.TestCase):
+    """Tests for SessionPool."""
+
+    def _create_members(self, count):
+        members = []
+        for i in range(count):
+            member = mock.Mock()
+            member._session_id = 'session-%d' % i
+            members.append(member)
+        return members
+
+    def test_init_without_members(self):
+        self.assertRaises(ValueError, api.SessionPool, [])
+
+    def test_invoke(self):
+        members = self._create_members(2)
+        pool = api.SessionPool(members)
+        self.assertEqual('ret', pool.invoke(lambda member: 'ret'))
+        self.assertEqual([0, 0],
+                         [stat['in_flight'] for stat in pool.get_stats()])
+
+    def test_invoke_spreads_concurrent_calls(self):
+        members = self._create_members(3)
+        pool = api.SessionPool(members)
+        used = []
+
+        def call(member):
+            used.append(member)
+            greenthread.sleep(0)
+            return member
+
+        threads = [greenthread.spawn(pool.invoke, call) for i in range(3)]
+        results = [thread.wait() for thread in threads]
+        self.assertEqual(set(members), set(results))
+
+    def test_invoke_keeps_affinity(self):
+        members = self._create_members(3)
+        pool = api.SessionPool(members)
+        first = pool.invoke(lambda member: member)
+        for i in range(3):
+            self.assertIs(first, pool.invoke(lambda member: member))
+
+    def test_invoke_avoids_failed_member(self):
+        members = self._create_members(2)
+        pool = api.SessionPool(members)
+
+        def fail(member):
+            raise exceptions.VimConnectionException('error')
+
+        first = pool.invoke(lambda member: member)
+        self.assertRaises(exceptions.VimConnectionException,
+                          pool.invoke, fail)
+        self.assertEqual(1, pool.get_stats()[members.index(first)][
+            'failures'])
+        second = pool.invoke(lambda member: member)
+        self.assertIsNot(first, second)
+
+    @mock.patch('oslo_vmware.api.timeutils')
+    def test_invoke_probes_failed_member(self, timeutils_mock):
+        timeutils_mock.utcnow_ts.return_value = 100
+        members = self._create_members(2)
+        pool = api.SessionPool(members, probe_interval=30)
+
+        def fail(member):
+            raise exceptions.VimConnectionException('error')
+
+        first = pool.invoke(lambda member: member)
+        self.assertRaises(exceptions.VimConnectionException,
+                          pool.invoke, fail)
+        second = members[1 - members.index(first)]
+        timeutils_mock.utcnow_ts.return_value = 129
+        self.assertIs(second, pool.invoke(lambda member: member))
+
+        # The failed member is leased again once the probe interval passed,
+        # and only for a single call until it succeeds.
+        timeutils_mock.utcnow_ts.return_value = 130
+        probe = greenthread.spawn(pool.invoke,
+                                  lambda member: greenthread.sleep(0) or
+                                  member)
+        greenthread.sleep(0)
+        self.assertIs(second, pool.invoke(lambda member: member))
+        self.assertIs(first, probe.wait())
+        self.assertEqual([0, 0],
+                         [stat['failures'] for stat in pool.get_stats()])
+
+        # The recovered member is back in the rotation.
+        used = set()
+
+        def call(member):
+            used.add(member)
+            greenthread.sleep(0)
+
+        threads = [greenthread.spawn(pool.invoke, call) for i in range(2)]
+        for thread in threads:
+            thread.wait()
+        self.assertEqual(set(members), used)
+
+    def test_invoke_resets_failures_on_success(self):
+        members = self._create_members(1)
+        pool = api.SessionPool(members)
+
+        def fail(member):
+            raise exceptions.VimSessionOverLoadException('error')
+
+        self.assertRaises(exceptions.VimSessionOverLoadException,
+                          pool.invoke, fail)
+        self.assertEqual(1, pool.get_stats()[0]['failures'])
+        pool.invoke(lambda member: member)
+        self.assertEqual(0, pool.get_stats()[0]['failures'])
+
+    def test_invoke_with_other_exception(self):
+        members = self._create_members(1)
+        pool = api.SessionPool(members)
+
+        def fail(member):
+            raise exceptions.VimFaultException([], 'error')
+
+        self.assertRaises(exceptions.VimFaultException, pool.invoke, fail)
+        self.assertEqual(0, pool.get_stats()[0]['failures'])
+
+
 class VMwareAPISessionTest(base.TestCase):
     """Tests for VMwareAPISession."""
 
@@ -132,7 +285,8 @@ class VMwareAPISessionTest(base.TestCase):
                                         port=VMwareAPISessionTest.PORT,
                                         wsdl_url=api_session._vim_wsdl_loc,
                                         cacert=self.cert_mock,
-                                        insecure=False)
+                                        insecure=False,
+                                        use_fast_path=False)
 
     @mock.patch.object(pbm, 'Pbm')
     def test_pbm(self, pbm_mock):
@@ -170,6 +324,58 @@ class VMwareAPISessionTest(base.TestCase):
         self.assertEqual(session.key, api_session._session_id)
         pbm.set_soap_cookie.assert_called_once_with(cookie)
 
+    def test_create_session_concurrently(self):
+        session = mock.Mock()
+        session.key = "12345"
+        api_session = self._create_api_session(False)
+        vim_obj = api_session.vim
+
+        def login(*args, **kwargs):
+            greenthread.sleep(0)
+            return session
+
+        vim_obj.Login.side_effect = login
+        pbm = mock.Mock()
+        api_session._pbm = pbm
+
+        threads = [greenthread.spawn(api_session._create_session)
+                   for i in range(5)]
+        for thread in threads:
+            thread.wait()
+        self.assertEqual(1, vim_obj.Login.call_count)
+        self.assertFalse(vim_obj.SessionIsActive.called)
+        self.assertEqual(session.key, api_session._session_id)
+        pbm.set_soap_cookie.assert_called_once_with(
+            vim_obj.get_http_cookie.return_value)
+        self.assertIsNone(api_session._login_flight)
+
+    def test_create_session_concurrently_with_login_error(self):
+        api_session = self._create_api_session(False)
+        vim_obj = api_session.vim
+
+        def login(*args, **kwargs):
+            greenthread.sleep(0)
+            raise exceptions.VimFaultException([], 'error')
+
+        vim_obj.Login.side_effect = login
+
+        threads = [greenthread.spawn(api_session._create_session)
+                   for i in range(3)]
+        for thread in threads:
+            self.assertRaises(exceptions.VimFaultException, thread.wait)
+        self.assertEqual(1, vim_obj.Login.call_count)
+        self.assertIsNone(api_session._login_flight)
+
+    def test_create_session_does_not_block_other_sessions(self):
+        api_session = self._create_api_session(False)
+        other_session = self._create_api_session(False)
+        # Simulate a login in flight for the first session.
+        api_session._login_flight = mock.Mock()
+
+        other_session._create_session()
+        self.assertTrue(other_session.vim.Login.called)
+        self.assertFalse(api_session._login_flight.wait.called)
+
     def test_create_session_with_existing_inactive_session(self):
         old_session_key = '12345'
         new_session_key = '67890'
@@ -220,6 +426,59 @@ class VMwareAPISessionTest(base.TestCase):
         ret = api_session.invoke_api(module, 'api')
         self.assertEqual(response, ret)
 
+    def test_invoke_api_with_pool(self):
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           pool_size=3)
+        members = api_session._pool.members
+        self.assertEqual(3, len(members))
+        self.assertIs(api_session, members[0])
+        vim_objs = [member.vim for member in members]
+        self.assertEqual(3, len(set(vim_objs)))
+
+        def api_method(vim_obj, moref, prop=None):
+            greenthread.sleep(0)
+            return vim_obj, prop
+
+        module = mock.Mock()
+        module.api = api_method
+        threads = [greenthread.spawn(api_session.invoke_api, module, 'api',
+                                     api_session.vim, 'moref',
+                                     prop=api_session.vim)
+                   for i in range(3)]
+        results = [thread.wait() for thread in threads]
+        self.assertEqual(set(vim_objs),
+                         set(vim_obj for vim_obj, prop in results))
+        for vim_obj, prop in results:
+            self.assertIs(vim_obj, prop)
+
+    def test_invoke_api_with_pool_binds_vim_module(self):
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           pool_size=2)
+        member = api_session._pool.members[1]
+        api_session._pool._affinity[greenthread.getcurrent()] = member
+
+        ret = api_session.invoke_api(api_session.vim, 'ExportVm', 'vm-1')
+        self.assertEqual(member.vim.ExportVm.return_value, ret)
+        member.vim.ExportVm.assert_called_once_with('vm-1')
+        self.assertFalse(api_session.vim.ExportVm.called)
+
+    def test_logout_with_pool(self):
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           pool_size=2)
+        member = api_session._pool.members[1]
+        member.logout = mock.Mock()
+        api_session.logout()
+        member.logout.assert_called_once_with()
+
     def test_logout_with_exception(self):
         session = mock.Mock()
         session.key = "12345"
@@ -275,6 +534,31 @@ class VMwareAPISessionTest(base.TestCase):
             self.assertEqual(ret, api_session.invoke_api(module, 'api'))
         api_session._create_session.assert_called_once_with()
 
+    def test_invoke_api_retries_after_recreating_session(self):
+        api_session = self._create_api_session(True)
+        api_session._create_session = mock.Mock()
+        vim_obj = api_session.vim
+        vim_obj.SessionIsActive.return_value = False
+        failed = set()
+
+        def api(call_id):
+            # The first attempt of each call finds the session expired.
+            if call_id not in failed:
+                failed.add(call_id)
+                raise exceptions.VimConnectionException(None)
+            return call_id
+
+        module = mock.Mock()
+        module.api = api
+        # The default policy retries after every re-login, however many
+        # calls do it.
+        with mock.patch.object(greenthread, 'sleep'):
+            for call_id in range(50):
+                self.assertEqual(call_id,
+                                 api_session.invoke_api(module, 'api',
+                                                        call_id))
+        self.assertEqual(50, api_session._create_session.call_count)
+
     def test_invoke_api_not_recreate_session(self):
         api_session = self._create_api_session(True)
         api_session._create_session = mock.Mock()
@@ -329,6 +613,107 @@ class VMwareAPISessionTest(base.TestCase):
         self.assertEqual(expected_str, six.text_type(e))
         self.assertEqual(details, e.details)
 
+    def test_invoke_api_with_retry_policy(self):
+        policy = mock.Mock()
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           retry_policy=policy)
+        module = mock.Mock()
+
+        ret = api_session.invoke_api(module, 'api', 'arg')
+        self.assertEqual(policy.call.return_value, ret)
+        policy.call.assert_called_once_with(mock.ANY, module, 'api', 'arg')
+
+    @mock.patch.object(greenthread, 'sleep')
+    def test_invoke_api_with_circuit_breaker(self, sleep):
+        breaker = circuit_breaker.CircuitBreaker('server', min_calls=2)
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           circuit_breaker=breaker)
+        api_session.is_current_session_active = mock.Mock(return_value=True)
+        module = mock.Mock()
+        module.api.side_effect = exceptions.VimSessionOverLoadException(
+            'overload')
+
+        # The retries stop once the circuit opens.
+        self.assertRaises(exceptions.VimCircuitOpenException,
+                          api_session.invoke_api,
+                          module,
+                          'api')
+        self.assertEqual(2, module.api.call_count)
+        self.assertEqual(circuit_breaker.OPEN, breaker.state)
+
+    def test_invoke_api_with_long_poll_and_circuit_breaker(self):
+        breaker = mock.Mock()
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           circuit_breaker=breaker)
+
+        ret = api_session.invoke_api(vim_util, 'wait_for_updates_ex',
+                                     api_session.vim, '')
+        self.assertEqual(breaker.call_untimed.return_value, ret)
+        self.assertFalse(breaker.call.called)
+
+    def test_invoke_api_with_concurrency_limiter(self):
+        limiter = circuit_breaker.ConcurrencyLimiter(1)
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           concurrency_limiter=limiter)
+        module = mock.Mock()
+        module.api.side_effect = lambda: api_session.invoke_api(module,
+                                                                'api2')
+
+        self.assertRaises(exceptions.VimCallRejectedException,
+                          api_session.invoke_api,
+                          module,
+                          'api')
+        self.assertFalse(module.api2.called)
+
+    def test_invoke_api_with_concurrency_limiter_and_retry(self):
+        limiter = circuit_breaker.ConcurrencyLimiter(1)
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           concurrency_limiter=limiter)
+        api_session.vim.SessionIsActive.return_value = True
+        module = mock.Mock()
+        module.api.side_effect = [exceptions.VimConnectionException(None),
+                                  'ret']
+        in_progress = []
+
+        def sleep(delay):
+            in_progress.append(limiter.get_stats()['in_progress'])
+
+        with mock.patch.object(greenthread, 'sleep', side_effect=sleep):
+            self.assertEqual('ret', api_session.invoke_api(module, 'api'))
+        # No call slot is held during the backoff.
+        self.assertEqual([0], in_progress)
+
+    def test_invoke_api_with_concurrency_limiter_and_long_poll(self):
+        limiter = circuit_breaker.ConcurrencyLimiter(1)
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           concurrency_limiter=limiter)
+        module = mock.Mock()
+        module.WaitForUpdatesEx.side_effect = (
+            lambda: api_session.invoke_api(module, 'api'))
+        module.api.side_effect = (
+            lambda: api_session.invoke_api(module, 'CancelWaitForUpdates'))
+
+        self.assertEqual(module.CancelWaitForUpdates.return_value,
+                         api_session.invoke_api(module, 'WaitForUpdatesEx'))
+
     def test_invoke_api_with_empty_response(self):
         api_session = self._create_api_session(True)
         vim_obj = api_session.vim
@@ -347,6 +732,76 @@ class VMwareAPISessionTest(base.TestCase):
             sessionID=api_session._session_id,
             userName=api_session._session_username)
 
+    def _create_api_session_with_liveness(self, validity_window=60,
+                                          keep_alive_interval=0):
+        return api.VMwareAPISession(
+            VMwareAPISessionTest.SERVER_IP,
+            VMwareAPISessionTest.USERNAME,
+            VMwareAPISessionTest.PASSWORD,
+            10, 1, create_session=False,
+            session_validity_window=validity_window,
+            keep_alive_interval=keep_alive_interval)
+
+    def test_invoke_api_with_empty_response_within_validity_window(self):
+        api_session = self._create_api_session_with_liveness()
+        api_session._create_session()
+        vim_obj = api_session.vim
+
+        def api(*args, **kwargs):
+            raise exceptions.VimFaultException(
+                [exceptions.NOT_AUTHENTICATED], None)
+
+        module = mock.Mock()
+        module.api = api
+        self.assertEqual([], api_session.invoke_api(module, 'api'))
+        self.assertFalse(vim_obj.SessionIsActive.called)
+
+    def test_invoke_api_with_not_authenticated_fault(self):
+        api_session = self._create_api_session_with_liveness()
+        api_session._create_session()
+        vim_obj = api_session.vim
+        vim_obj.SessionIsActive.return_value = True
+
+        def api(*args, **kwargs):
+            raise exceptions.VimFaultException(
+                [exceptions.NOT_AUTHENTICATED], None, server_fault=True)
+
+        module = mock.Mock()
+        module.api = api
+        self.assertEqual([], api_session.invoke_api(module, 'api'))
+        self.assertEqual(1, vim_obj.SessionIsActive.call_count)
+
+    def test_create_session_within_validity_window(self):
+        api_session = self._create_api_session_with_liveness()
+        api_session._create_session()
+        api_session._create_session()
+        self.assertEqual(1, api_session.vim.Login.call_count)
+        self.assertFalse(api_session.vim.SessionIsActive.called)
+
+    @mock.patch.object(api.timeutils, 'utcnow_ts')
+    def test_keep_alive(self, utcnow_ts):
+        utcnow_ts.return_value = 100
+        api_session = self._create_api_session_with_liveness(
+            keep_alive_interval=30)
+        self.addCleanup(api_session._stop_keep_alive)
+        api_session._create_session()
+        vim_obj = api_session.vim
+        self.assertIsNotNone(api_session._keep_alive_loop)
+
+        utcnow_ts.return_value = 120
+        api_session._keep_alive()
+        self.assertFalse(vim_obj.SessionIsActive.called)
+
+        utcnow_ts.return_value = 130
+        vim_obj.SessionIsActive.return_value = False
+        api_session._keep_alive()
+        self.assertTrue(vim_obj.SessionIsActive.called)
+        self.assertEqual(2, vim_obj.Login.call_count)
+        self.assertTrue(api_session._liveness.is_active())
+
+        api_session.logout()
+        self.assertIsNone(api_session._keep_alive_loop)
+
     def test_invoke_api_with_stale_session(self):
         api_session = self._create_api_session(True)
         api_session._create_session = mock.Mock()
@@ -373,6 +828,40 @@ class VMwareAPISessionTest(base.TestCase):
             userName=api_session._session_username)
         api_session._create_session.assert_called_once_with()
 
+    def test_iter_objects(self):
+        api_session = self._create_api_session(False)
+        first_page = mock.Mock(objects=['obj-1', 'obj-2'])
+        second_page = mock.Mock(objects=['obj-3'])
+        pages = {'get_objects': [first_page],
+                 'continue_retrieval': [second_page, None]}
+        api_session.invoke_api = mock.Mock(
+            side_effect=lambda module, method, *args, **kwargs:
+            pages[method].pop(0))
+
+        objects = api_session.iter_objects('VirtualMachine', 2,
+                                           properties_to_collect=['name'])
+        self.assertEqual('obj-1', next(objects))
+        self.assertEqual(['obj-2', 'obj-3'], list(objects))
+        vim_obj = api_session.vim
+        api_session.invoke_api.assert_has_calls(
+            [mock.call(vim_util, 'get_objects', vim_obj, 'VirtualMachine', 2,
+                       properties_to_collect=['name'],
+                       all_properties=False),
+             mock.call(vim_util, 'continue_retrieval', vim_obj, first_page),
+             mock.call(vim_util, 'continue_retrieval', vim_obj,
+                       second_page)])
+
+    def test_iter_objects_stopped_early(self):
+        api_session = self._create_api_session(False)
+        first_page = mock.Mock(objects=['obj-1', 'obj-2'])
+        api_session.invoke_api = mock.Mock(return_value=first_page)
+
+        for obj in api_session.iter_objects('VirtualMachine', 2):
+            break
+        gc.collect()
+        api_session.invoke_api.assert_called_with(
+            vim_util, 'cancel_retrieval', api_session.vim, first_page)
+
     def test_wait_for_task(self):
         api_session = self._create_api_session(True)
         task_info_list = [('queued', 0), ('running', 40), ('success', 100)]
@@ -398,6 +887,36 @@ class VMwareAPISessionTest(base.TestCase):
         self.assertEqual(task_info_list_size,
                          api_session.invoke_api.call_count)
 
+    @mock.patch.object(task_waiter, 'TaskWaiter')
+    def test_wait_for_task_with_task_waiter(self, task_waiter_mock):
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           use_task_waiter=True)
+        task_waiter_mock.assert_called_once_with(api_session)
+        api_session.invoke_api = mock.Mock()
+        task = mock.Mock()
+
+        ret = api_session.wait_for_task(task)
+        waiter = task_waiter_mock.return_value
+        self.assertEqual(waiter.wait.return_value, ret)
+        waiter.wait.assert_called_once_with(task)
+        self.assertFalse(api_session.invoke_api.called)
+
+    @mock.patch.object(inventory_cache, 'InventoryCache')
+    def test_inventory_cache(self, inventory_cache_mock):
+        api_session = api.VMwareAPISession(VMwareAPISessionTest.SERVER_IP,
+                                           VMwareAPISessionTest.USERNAME,
+                                           VMwareAPISessionTest.PASSWORD,
+                                           10, 1, create_session=False,
+                                           pool_size=2)
+        cache = api_session.inventory_cache
+        self.assertEqual(inventory_cache_mock.return_value, cache)
+        self.assertIs(cache, api_session.inventory_cache)
+        inventory_cache_mock.assert_called_once_with(
+            api_session._pool.members[-1])
+
     def test_wait_for_task_with_error_state(self):
         api_session = self._create_api_session(True)
         task_info_list = [('queued', 0), ('running', 40), ('error', -1)]
@@ -0,0 +1,156 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the circuit breaker and the concurrency limiter.
+"""
+
+from eventlet import event
+from eventlet import greenthread
+import mock
+
+from oslo_vmware import circuit_breaker
+from oslo_vmware import exceptions
+from oslo_vmware.tests import base
+
+
+class CircuitBreakerTest(base.TestCase):
+    """Tests for CircuitBreaker."""
+
+    def setUp(self):
+        super(CircuitBreakerTest, self).setUp()
+        patcher = mock.patch.object(circuit_breaker, 'time')
+        self.addCleanup(patcher.stop)
+        self.time = patcher.start()
+        self.now = 0
+        self.time.time.side_effect = lambda: self.now
+
+    def _fail(self, breaker):
+        def func():
+            raise exceptions.VimConnectionException('error')
+        self.assertRaises(exceptions.VimConnectionException,
+                          breaker.call,
+                          func)
+
+    def test_open_on_failure_rate(self):
+        breaker = circuit_breaker.CircuitBreaker(
+            'server', min_calls=4, failure_rate_threshold=0.5)
+        breaker.call(lambda: None)
+        self._fail(breaker)
+        breaker.call(lambda: None)
+        self.assertEqual(circuit_breaker.CLOSED, breaker.state)
+
+        self._fail(breaker)
+        self.assertEqual(circuit_breaker.OPEN, breaker.state)
+        func = mock.Mock()
+        self.assertRaises(exceptions.VimCircuitOpenException,
+                          breaker.call,
+                          func)
+        self.assertFalse(func.called)
+
+    def test_fault_is_not_failure(self):
+        breaker = circuit_breaker.CircuitBreaker('server', min_calls=1)
+
+        def func():
+            raise exceptions.VimFaultException(['FileNotFound'], 'error')
+
+        self.assertRaises(exceptions.VimFaultException, breaker.call, func)
+        self.assertEqual(circuit_breaker.CLOSED, breaker.state)
+
+    def test_open_on_latency(self):
+        breaker = circuit_breaker.CircuitBreaker(
+            'server', min_calls=2, latency_threshold=5, latency_percentile=50)
+
+        def slow_call():
+            self.now += 10
+
+        breaker.call_untimed(slow_call)
+        breaker.call(lambda: None)
+        self.assertEqual(circuit_breaker.CLOSED, breaker.state)
+        breaker.call(slow_call)
+        breaker.call(slow_call)
+        self.assertEqual(circuit_breaker.OPEN, breaker.state)
+
+    def test_half_open(self):
+        breaker = circuit_breaker.CircuitBreaker('server', min_calls=1,
+                                                 reset_timeout=30)
+        self._fail(breaker)
+        self.now = 30
+        self.assertEqual(circuit_breaker.HALF_OPEN, breaker.state)
+
+        # A failed trial call opens the circuit again.
+        self._fail(breaker)
+        self.assertEqual(circuit_breaker.OPEN, breaker.state)
+
+        self.now = 60
+        self.assertEqual('result', breaker.call(lambda: 'result'))
+        self.assertEqual(circuit_breaker.CLOSED, breaker.state)
+        self.assertEqual(0, breaker.get_stats()['calls'])
+
+    def test_half_open_max_calls(self):
+        breaker = circuit_breaker.CircuitBreaker('server', min_calls=1,
+                                                 reset_timeout=30)
+        self._fail(breaker)
+        self.now = 30
+
+        def trial_call():
+            self.assertRaises(exceptions.VimCircuitOpenException,
+                              breaker.call,
+                              lambda: None)
+            return 'result'
+
+        self.assertEqual('result', breaker.call(trial_call))
+        self.assertEqual(circuit_breaker.CLOSED, breaker.state)
+
+
+class ConcurrencyLimiterTest(base.TestCase):
+    """Tests for ConcurrencyLimiter."""
+
+    def test_call(self):
+        limiter = circuit_breaker.ConcurrencyLimiter(2)
+        self.assertEqual('result', limiter.call(lambda: 'result'))
+        self.assertEqual({'in_progress': 0, 'waiting': 0, 'rejected': 0},
+                         limiter.get_stats())
+
+    def test_call_with_waiting(self):
+        limiter = circuit_breaker.ConcurrencyLimiter(1, max_waiting=1)
+        done = event.Event()
+        first = greenthread.spawn(limiter.call, done.wait)
+        greenthread.sleep(0)
+        second = greenthread.spawn(limiter.call, lambda: 'second')
+        greenthread.sleep(0)
+
+        # The queue is full.
+        self.assertRaises(exceptions.VimCallRejectedException,
+                          limiter.call,
+                          lambda: None)
+        self.assertEqual({'in_progress': 1, 'waiting': 1, 'rejected': 1},
+                         limiter.get_stats())
+
+        done.send('first')
+        self.assertEqual('first', first.wait())
+        self.assertEqual('second', second.wait())
+
+    def test_call_with_wait_timeout(self):
+        limiter = circuit_breaker.ConcurrencyLimiter(1, max_waiting=1,
+                                                     wait_timeout=0.01)
+        done = event.Event()
+        greenthread.spawn(limiter.call, done.wait)
+        greenthread.sleep(0)
+
+        self.assertRaises(exceptions.VimCallRejectedException,
+                          limiter.call,
+                          lambda: None)
+        done.send()
@@ -0,0 +1,173 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the HTTP connection pool.
+"""
+
+import socket
+import ssl
+
+import mock
+import six.moves.http_client as httplib
+
+from oslo_vmware import http_pool
+from oslo_vmware.tests import base
+
+
+class HTTPConnectionPoolTest(base.TestCase):
+    """Tests for HTTPConnectionPool."""
+
+    def setUp(self):
+        super(HTTPConnectionPoolTest, self).setUp()
+        self.pool = http_pool.HTTPConnectionPool(max_per_host=1,
+                                                 idle_timeout=30)
+
+    def _get(self, response=b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n\r\nok'):
+        conn = self.pool.get('http', '10.1.2.3')
+        if conn.sock is None:
+            # Stands in for the server end of the connection.
+            conn.sock, peer = socket.socketpair()
+            self.addCleanup(peer.close)
+            self.addCleanup(conn._close_socket)
+            conn.peer = peer
+        conn.peer.sendall(response)
+        conn.request('GET', '/folder/file')
+        return conn, conn.getresponse()
+
+    def test_get(self):
+        conn, response = self._get()
+        self.assertEqual(b'ok', response.read())
+        conn.close()
+        self.assertEqual(1, self.pool.get_stats()['idle'])
+
+        reused, response = self._get()
+        self.assertIs(conn, reused)
+        self.assertEqual(b'ok', response.read())
+        # Closing the response also returns the connection to the pool.
+        response.close()
+        self.assertEqual({'hits': 1, 'misses': 1, 'evictions': 0,
+                          'resumed_sessions': 0, 'idle': 1},
+                         self.pool.get_stats())
+
+    def test_get_with_chunked_body(self):
+        conn, response = self._get(b'HTTP/1.1 200 OK\r\n'
+                                   b'Transfer-Encoding: chunked\r\n\r\n'
+                                   b'2\r\nok\r\n0\r\n\r\n')
+        self.assertEqual(b'ok', response.read())
+        response.close()
+        self.assertIs(conn, self._get()[0])
+
+    def test_get_with_read_closing_response(self):
+        # Python 2.7 closes the response from read() when it reaches the
+        # end of the body.
+        read = httplib.HTTPResponse.read
+
+        def read_and_close(response, amt=None):
+            data = read(response, amt)
+            if response.length == 0:
+                response.close()
+            return data
+
+        with mock.patch.object(httplib.HTTPResponse, 'read',
+                               read_and_close):
+            conn, response = self._get()
+            self.assertEqual(b'o', response.read(1))
+            self.assertEqual(0, self.pool.get_stats()['idle'])
+            self.assertEqual(b'k', response.read(1))
+        self.assertFalse(response.discarded)
+        self.assertEqual(1, self.pool.get_stats()['idle'])
+
+        reused, response = self._get()
+        self.assertIs(conn, reused)
+        self.assertEqual(b'ok', response.read())
+
+    def test_get_with_truncated_body(self):
+        conn, response = self._get(b'HTTP/1.1 200 OK\r\n'
+                                   b'Content-Length: 4\r\n\r\nok')
+        conn.peer.shutdown(socket.SHUT_WR)
+        self.assertEqual(b'ok', response.read(4))
+        self.assertEqual(b'', response.read(2))
+        response.close()
+        self.assertTrue(response.discarded)
+        self.assertIsNone(conn.sock)
+
+    def test_get_with_unread_body(self):
+        conn, response = self._get()
+        response.read(1)
+        response.close()
+        self.assertIsNone(conn.sock)
+        self.assertIsNot(conn, self.pool.get('http', '10.1.2.3'))
+
+    def test_get_with_connection_close(self):
+        conn, response = self._get(b'HTTP/1.1 200 OK\r\nContent-Length: 2\r\n'
+                                   b'Connection: close\r\n\r\nok')
+        self.assertEqual(b'ok', response.read())
+        conn.close()
+        self.assertEqual(0, self.pool.get_stats()['idle'])
+
+    def test_get_with_dropped_connection(self):
+        conn, response = self._get()
+        response.read()
+        conn.close()
+        conn.peer.close()
+
+        self.assertIsNot(conn, self.pool.get('http', '10.1.2.3'))
+        self.assertEqual(1, self.pool.get_stats()['evictions'])
+
+    @mock.patch.object(http_pool, 'time')
+    def test_idle_timeout(self, time_mod):
+        time_mod.time.return_value = 0
+        conn, response = self._get()
+        response.read()
+        conn.close()
+
+        time_mod.time.return_value = 30
+        self.pool.evict_idle()
+        self.assertIsNone(conn.sock)
+        self.assertEqual({'hits': 0, 'misses': 1, 'evictions': 1,
+                          'resumed_sessions': 0, 'idle': 0},
+                         self.pool.get_stats())
+
+    def test_max_per_host(self):
+        conn, response = self._get()
+        other_conn = self.pool.get('http', '10.1.2.3')
+        response.read()
+        conn.close()
+
+        sock = mock.Mock(spec=['close'])
+        other_conn.sock = sock
+        other_conn._response = mock.Mock(discarded=False, will_close=False)
+        other_conn.close()
+        sock.close.assert_called_once_with()
+        self.assertEqual(1, self.pool.get_stats()['evictions'])
+        self.assertIs(conn, self.pool.get('http', '10.1.2.3'))
+
+    def test_get_with_invalid_scheme(self):
+        self.assertRaises(ValueError, self.pool.get, 'ftp', '10.1.2.3')
+
+    def test_get_with_https(self):
+        conn = self.pool.get('https', '10.1.2.3:443', cacerts=False)
+        self.assertEqual(443, conn.port)
+        self.assertEqual(ssl.CERT_NONE, conn._context.verify_mode)
+        # The SSL context is shared so that TLS sessions can be resumed.
+        self.assertIs(conn._context,
+                      self.pool.get('https', '10.1.2.4', False)._context)
+
+    @mock.patch.object(http_pool, '_HAS_SSL_CONTEXT', False)
+    def test_get_with_https_without_ssl_context(self):
+        conn = self.pool.get('https', '10.1.2.3:443', cacerts=True)
+        self.assertIsInstance(conn, http_pool._LegacyHTTPSConnection)
+        self.assertEqual(443, conn.port)
@@ -17,11 +17,18 @@
 Unit tests for functions and classes for image transfer.
 """
 
+import hashlib
+import io
+import json
 import math
+import os
 
+from eventlet import event
 from eventlet import greenthread
 from eventlet import timeout
+import fixtures
 import mock
+import six
 
 from oslo_vmware import exceptions
 from oslo_vmware import image_transfer
@@ -52,6 +59,63 @@ class BlockingQueueTest(base.TestCase):
                                                   chunk_size))
         self.assertEqual(exp_calls, queue.get.call_args_list)
 
+    def test_read_buffer(self):
+        queue = image_transfer.BlockingQueue(10, 0)
+        buf = queue.get_buffer()
+        self.assertEqual(rw_handles.READ_CHUNKSIZE, len(buf))
+        buf[:3] = b'abc'
+        queue.write_buffer(buf, 3)
+        self.assertEqual(b'abc', queue.read(rw_handles.READ_CHUNKSIZE))
+        self.assertEqual(3, queue._transferred)
+        # The buffer is returned to the pool after its contents are copied.
+        self.assertIs(buf, queue.get_buffer())
+
+    def test_read_view(self):
+        queue = image_transfer.BlockingQueue(10, 0)
+        buf = queue.get_buffer()
+        buf[:3] = b'abc'
+        queue.write_buffer(buf, 3)
+        queue.write(b'de')
+
+        view = queue.read_view()
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(b'abc', view.tobytes())
+        self.assertIsNot(buf, queue.get_buffer())
+        self.assertEqual(b'de', queue.read_view())
+        self.assertIs(buf, queue.get_buffer())
+
+    def test_get_buffer_blocks_when_exhausted(self):
+        queue = image_transfer.BlockingQueue(0, 0)
+        buffers = [queue.get_buffer(), queue.get_buffer()]
+        waiter = greenthread.spawn(queue.get_buffer)
+        greenthread.sleep(0)
+        self.assertFalse(waiter.dead)
+        queue.release_buffer(buffers[0])
+        self.assertIs(buffers[0], waiter.wait())
+
+    def test_chunk_size(self):
+        queue = image_transfer.BlockingQueue(10, 0, chunk_size=1024)
+        self.assertEqual(1024, queue.chunk_size)
+        self.assertEqual(1024, len(queue.get_buffer()))
+
+    def test_write_with_max_bytes(self):
+        queue = image_transfer.BlockingQueue(1, 0, max_bytes=10)
+        queue.write(b'x' * 6)
+        queue.write(b'x' * 4)
+        writer = greenthread.spawn(queue.write, b'x')
+        greenthread.sleep(0)
+        self.assertFalse(writer.dead)
+        self.assertEqual(2, queue.qsize())
+
+        self.assertEqual(b'x' * 6, queue.read(6))
+        writer.wait()
+        self.assertEqual(5, queue._queued_bytes)
+
+    def test_write_with_max_bytes_and_large_chunk(self):
+        queue = image_transfer.BlockingQueue(1, 0, max_bytes=10)
+        queue.write(b'x' * 20)
+        self.assertEqual(20, queue._queued_bytes)
+
     def test_write(self):
         queue = image_transfer.BlockingQueue(10, 30)
         queue.put = mock.Mock()
@@ -73,6 +137,163 @@ class BlockingQueueTest(base.TestCase):
         self.assertEqual(10, queue.tell())
 
 
+class ByteRingBufferTest(base.TestCase):
+    """Tests for ByteRingBuffer."""
+
+    def test_read_coalesces_chunks(self):
+        ring = image_transfer.ByteRingBuffer(16, 0, chunk_size=4)
+        ring.write(b'ab')
+        ring.write(b'cd')
+        ring.write(b'e')
+        self.assertEqual(b'abcd', ring.read())
+        ring.write(b'')
+        self.assertEqual(b'e', ring.read())
+        self.assertEqual(b'', ring.read())
+        self.assertEqual(5, ring.tell())
+
+    def test_write_splits_large_chunk(self):
+        ring = image_transfer.ByteRingBuffer(8, 20, chunk_size=4)
+        data = b'0123456789abcdefghij'
+        writer = greenthread.spawn(ring.write, data)
+        chunks = []
+        while True:
+            chunk = ring.read()
+            if not chunk:
+                break
+            chunks.append(chunk)
+        writer.wait()
+        self.assertEqual(data, b''.join(chunks))
+        self.assertEqual([4] * 5, [len(chunk) for chunk in chunks])
+        self.assertEqual(8, ring.get_stats()['max_fill'])
+
+    def test_watermarks(self):
+        ring = image_transfer.ByteRingBuffer(8, 0, chunk_size=2,
+                                             low_watermark=2,
+                                             high_watermark=6)
+        writer = greenthread.spawn(ring.write, b'x' * 10)
+        greenthread.sleep(0)
+        self.assertEqual(6, ring.get_stats()['fill'])
+
+        # The producer resumes once the low watermark is reached.
+        ring.read()
+        greenthread.sleep(0)
+        self.assertEqual(4, ring.get_stats()['fill'])
+        ring.read()
+        greenthread.sleep(0)
+        self.assertEqual(6, ring.get_stats()['fill'])
+        writer.wait()
+        self.assertEqual(1, ring.get_stats()['producer_waits'])
+
+    def test_read_view_with_wraparound(self):
+        ring = image_transfer.ByteRingBuffer(8, 0, chunk_size=4)
+        ring.write(b'abcdef')
+        self.assertEqual(b'abcd', ring.read())
+        ring.write(b'ghij')
+        self.assertEqual(b'efgh', ring.read())
+        ring.write(b'')
+        self.assertEqual(b'ij', bytes(ring.read_view()))
+        self.assertEqual(b'', bytes(ring.read_view()))
+
+    def test_get_buffer(self):
+        ring = image_transfer.ByteRingBuffer(8, 3, chunk_size=4)
+        buf = ring.get_buffer()
+        self.assertEqual(4, len(buf))
+        buf[:3] = b'abc'
+        ring.write_buffer(buf, 3)
+        self.assertEqual(b'abc', bytes(ring.read_view()))
+        self.assertEqual(b'', ring.read())
+
+    def test_data_is_kept_until_hashed(self):
+        digest_task = image_transfer.DigestTask({'md5': None})
+        ring = image_transfer.ByteRingBuffer(8, 0, chunk_size=8,
+                                             digest_task=digest_task)
+        digest_task.start()
+        ring.write(b'abcdefgh')
+        self.assertEqual(b'abcdefgh', ring.read())
+        self.assertEqual(8, ring.get_stats()['fill'])
+        ring.write(b'ijkl')
+        self.assertEqual({'md5': hashlib.md5(b'abcdefghijkl').hexdigest()},
+                         digest_task.finish())
+        self.assertEqual(4, ring.get_stats()['fill'])
+
+    def test_invalid_watermarks(self):
+        self.assertRaises(ValueError, image_transfer.ByteRingBuffer, 8, 0,
+                          low_watermark=4, high_watermark=4)
+
+    def test_transfer_from_iterator(self):
+        chunks = [b'x' * size for size in [10, 100000, 3, 70000, 5]]
+        data = b''.join(chunks)
+        output_file = mock.Mock()
+        written = []
+        output_file.write.side_effect = lambda chunk: written.append(
+            bytes(chunk))
+        image_transfer._start_transfer(None, 10,
+                                       rw_handles.ImageReadHandle(chunks),
+                                       len(data),
+                                       write_file_handle=output_file,
+                                       ring_buffer=True)
+        self.assertEqual(data, b''.join(written))
+        self.assertTrue(all(len(chunk) <= rw_handles.READ_CHUNKSIZE
+                            for chunk in written))
+
+
+class BufferPoolTest(base.TestCase):
+    """Tests for BufferPool."""
+
+    def test_get_with_buffer_size(self):
+        pool = image_transfer.BufferPool(10)
+        buf = pool.get()
+        pool.put(buf)
+        self.assertIs(buf, pool.get())
+        pool.put(buf)
+
+        new_buf = pool.get(20)
+        self.assertEqual(20, len(new_buf))
+        self.assertEqual(1, pool._allocated)
+        # Buffers of the previous size are dropped when returned.
+        pool.put(bytearray(10))
+        self.assertEqual(0, pool._allocated)
+
+
+class AdaptiveChunkSizerTest(base.TestCase):
+    """Tests for AdaptiveChunkSizer."""
+
+    def _record_window(self, sizer, seconds):
+        self.now += seconds
+        for _ in range(image_transfer.ADAPTIVE_CHUNK_WINDOW):
+            sizer.record(sizer.chunk_size)
+
+    @mock.patch.object(image_transfer, 'time')
+    def test_record(self, time_mod):
+        self.now = 0
+        time_mod.time.side_effect = lambda: self.now
+        sizer = image_transfer.AdaptiveChunkSizer(1024, 8192)
+        sizer.record(1024)
+
+        self._record_window(sizer, 1)
+        self.assertEqual(2048, sizer.chunk_size)
+        # Twice the throughput of the previous window.
+        self._record_window(sizer, 1)
+        self.assertEqual(4096, sizer.chunk_size)
+        # Less than ADAPTIVE_CHUNK_MIN_GAIN improvement.
+        self._record_window(sizer, 2)
+        self.assertEqual(2048, sizer.chunk_size)
+
+        self._record_window(sizer, 0.1)
+        self.assertEqual(2048, sizer.chunk_size)
+
+    @mock.patch.object(image_transfer, 'time')
+    def test_record_with_max_chunk_size(self, time_mod):
+        self.now = 0
+        time_mod.time.side_effect = lambda: self.now
+        sizer = image_transfer.AdaptiveChunkSizer(1024, 2048)
+        sizer.record(1024)
+
+        self._record_window(sizer, 1)
+        self._record_window(sizer, 0.1)
+        self.assertEqual(2048, sizer.chunk_size)
+
+
 class ImageWriterTest(base.TestCase):
     """Tests for ImageWriter class."""
 
@@ -145,6 +366,112 @@ class ImageWriterTest(base.TestCase):
         self.image_service.show.assert_called_once_with(self.context,
                                                         self.image_id)
 
+    def test_start_with_status_waiter(self):
+        status_waiter = mock.Mock()
+        self.image_service = mock.Mock()
+        self.context = mock.Mock()
+        writer = image_transfer.ImageWriter(self.context, mock.Mock(),
+                                            self.image_service, 'image-1',
+                                            status_waiter=status_waiter)
+        writer.start()
+        self.assertTrue(writer.wait())
+        status_waiter.wait.assert_called_once_with(self.context,
+                                                   self.image_service,
+                                                   'image-1')
+
+    def test_stop_cancels_status_wait(self):
+        status_waiter = image_transfer.ImageStatusWaiter(initial_delay=10)
+        image_service = mock.Mock()
+        image_service.show.return_value = {'status': 'saving'}
+        writer = image_transfer.ImageWriter(mock.Mock(), mock.Mock(),
+                                            image_service, 'image-1',
+                                            status_waiter=status_waiter)
+        writer.start()
+        greenthread.sleep(0)
+        writer.stop()
+        self.assertRaises(exceptions.ImageTransferException, writer.wait)
+
+
+class ImageStatusWaiterTest(base.TestCase):
+    """Tests for ImageStatusWaiter."""
+
+    def _image_service(self, statuses):
+        image_service = mock.Mock()
+        polls = []
+
+        def show(context, image_id):
+            polls.append(image_id)
+            return {'id': image_id, 'status': statuses[image_id].pop(0)}
+
+        image_service.show.side_effect = show
+        return image_service, polls
+
+    def test_wait(self):
+        waiter = image_transfer.ImageStatusWaiter(initial_delay=0.001,
+                                                  max_delay=0.002)
+        image_service, polls = self._image_service(
+            {'image-1': ['queued', 'saving', 'saving', 'active']})
+        self.assertEqual({'id': 'image-1', 'status': 'active'},
+                         waiter.wait(mock.Mock(), image_service, 'image-1'))
+        self.assertEqual(4, len(polls))
+        self.assertEqual([0.001, 0.002, 0.002],
+                         [waiter._backoff.delay(poll) for poll in [1, 2, 3]])
+
+    def test_wait_batches_polls(self):
+        waiter = image_transfer.ImageStatusWaiter(initial_delay=0.01)
+        image_service, polls = self._image_service(
+            {'image-1': ['queued', 'saving', 'active'],
+             'image-2': ['queued', 'saving', 'active']})
+        waits = [greenthread.spawn(waiter.wait, mock.Mock(), image_service,
+                                   image_id)
+                 for image_id in ['image-1', 'image-2']]
+        for wait in waits:
+            wait.wait()
+        # The polls of both images are made in the same rounds.
+        self.assertEqual(['image-1', 'image-2'] * 3, polls)
+
+    def test_wait_with_killed_status(self):
+        waiter = image_transfer.ImageStatusWaiter()
+        image_service, polls = self._image_service({'image-1': ['killed']})
+        self.assertRaises(exceptions.ImageTransferException,
+                          waiter.wait,
+                          mock.Mock(),
+                          image_service,
+                          'image-1')
+
+    def test_wait_with_timeout(self):
+        waiter = image_transfer.ImageStatusWaiter(initial_delay=0.01,
+                                                  timeout_secs=0.001)
+        image_service, polls = self._image_service({'image-1': ['queued']})
+        self.assertRaises(exceptions.ImageTransferException,
+                          waiter.wait,
+                          mock.Mock(),
+                          image_service,
+                          'image-1')
+        self.assertEqual(['image-1'], polls)
+
+    def test_wait_with_show_exception(self):
+        waiter = image_transfer.ImageStatusWaiter()
+        image_service = mock.Mock()
+        image_service.show.side_effect = RuntimeError()
+        self.assertRaises(RuntimeError,
+                          waiter.wait,
+                          mock.Mock(),
+                          image_service,
+                          'image-1')
+
+    def test_wait_with_invalid_image_meta(self):
+        waiter = image_transfer.ImageStatusWaiter()
+        image_service = mock.Mock()
+        image_service.show.return_value = None
+        with timeout.Timeout(1):
+            self.assertRaises(AttributeError,
+                              waiter.wait,
+                              mock.Mock(),
+                              image_service,
+                              'image-1')
+        self.assertEqual(1, image_service.show.call_count)
+
 
 class FileReadWriteTaskTest(base.TestCase):
     """Tests for FileReadWriteTask class."""
@@ -172,10 +499,19 @@ class FileReadWriteTaskTest(base.TestCase):
             exp_calls.append(mock.call(data_items[i]))
         self.assertEqual(exp_calls, output_file.write.call_args_list)
 
-        self.assertEqual(len(data_items),
-                         input_file.update_progress.call_count)
-        self.assertEqual(len(data_items),
-                         output_file.update_progress.call_count)
+        # The lease progress is updated by the LeaseProgressUpdater.
+        self.assertFalse(input_file.update_progress.called)
+        self.assertFalse(output_file.update_progress.called)
+
+    def test_start_with_chunk_size(self):
+        input_file = mock.Mock(spec=['read'])
+        input_file.read.side_effect = [b'x' * 10, b'']
+        queue = image_transfer.BlockingQueue(10, 0, chunk_size=1024)
+        rw_task = image_transfer.FileReadWriteTask(input_file, queue)
+        rw_task.start()
+        self.assertTrue(rw_task.wait())
+        self.assertEqual([mock.call(1024)] * 2,
+                         input_file.read.call_args_list)
 
     def test_start_with_read_exception(self):
         input_file = mock.Mock()
@@ -186,6 +522,517 @@ class FileReadWriteTaskTest(base.TestCase):
         self.assertRaises(exceptions.ImageTransferException, rw_task.wait)
         input_file.read.assert_called_once_with(rw_handles.READ_CHUNKSIZE)
 
+    def test_transfer_with_buffers(self):
+        data = b'x' * (rw_handles.READ_CHUNKSIZE * 3 + 10)
+        input_file = six.BytesIO(data)
+        output_file = mock.Mock()
+        written = []
+        output_file.write.side_effect = lambda chunk: written.append(
+            bytes(chunk))
+        queue = image_transfer.BlockingQueue(2, len(data))
+        reader = image_transfer.FileReadWriteTask(input_file, queue)
+        writer = image_transfer.FileReadWriteTask(queue, output_file)
+        reader.start()
+        writer.start()
+        self.assertTrue(reader.wait())
+        self.assertTrue(writer.wait())
+
+        self.assertEqual(data, b''.join(written))
+        self.assertEqual([rw_handles.READ_CHUNKSIZE] * 3 + [10, 0],
+                         [len(chunk) for chunk in written])
+        # The buffers are reused.
+        self.assertTrue(queue._buffer_pool._allocated <= 4)
+
+
+class DigestTaskTest(base.TestCase):
+    """Tests for DigestTask."""
+
+    def test_finish(self):
+        task = image_transfer.DigestTask({'md5': None, 'sha256': None})
+        task.start()
+        released = []
+        task.feed(b'abc')
+        task.feed(memoryview(b'defg')[:3], lambda: released.append(True))
+
+        self.assertEqual({'md5': hashlib.md5(b'abcdef').hexdigest(),
+                          'sha256': hashlib.sha256(b'abcdef').hexdigest()},
+                         task.finish())
+        self.assertEqual([True], released)
+
+    def test_finish_with_mismatch(self):
+        task = image_transfer.DigestTask({'md5': 'invalid'})
+        task.start()
+        task.feed(b'abc')
+        self.assertRaises(exceptions.ImageChecksumMismatchException,
+                          task.finish)
+
+    def test_stop_with_full_queue(self):
+        task = image_transfer.DigestTask({'md5': None}, max_pending=1)
+        done = task.start()
+        released = []
+        task.feed(b'abc', lambda: released.append(True))
+        task.stop()
+        self.assertEqual([True], released)
+        with timeout.Timeout(1):
+            self.assertEqual({'md5': hashlib.md5(b'').hexdigest()},
+                             done.wait())
+
+    def test_invalid_algorithm(self):
+        self.assertRaises(ValueError, image_transfer.DigestTask,
+                          {'invalid': None})
+
+    def test_transfer_with_digests(self):
+        data = b'x' * (rw_handles.READ_CHUNKSIZE * 3 + 10)
+        output_file = mock.Mock()
+        written = []
+        output_file.write.side_effect = lambda chunk: written.append(
+            bytes(chunk))
+        digest = hashlib.sha256(data).hexdigest()
+
+        self.assertEqual({'sha256': digest},
+                         image_transfer._start_transfer(
+                             None, 10, six.BytesIO(data), len(data),
+                             write_file_handle=output_file,
+                             digests={'sha256': digest}))
+        self.assertEqual(data, b''.join(written))
+
+    def test_transfer_with_digest_mismatch(self):
+        data = b'x' * (rw_handles.READ_CHUNKSIZE + 10)
+        self.assertRaises(exceptions.ImageChecksumMismatchException,
+                          image_transfer._start_transfer,
+                          None, 10, six.BytesIO(data), len(data),
+                          write_file_handle=six.BytesIO(),
+                          digests={'md5': hashlib.md5(b'x').hexdigest()})
+
+
+class NativeBlockingQueueTest(base.TestCase):
+    """Tests for NativeBlockingQueue."""
+
+    def test_read(self):
+        queue = image_transfer.NativeBlockingQueue(2, 6)
+        queue.write(b'abc')
+        queue.write(b'def')
+        self.assertEqual(b'abc', queue.read(10))
+        self.assertEqual(b'def', queue.read(10))
+        self.assertEqual(b'', queue.read(10))
+        self.assertEqual(6, queue.tell())
+
+    def test_write_blocks_when_full(self):
+        queue = image_transfer.NativeBlockingQueue(1, 0)
+        queue.write(b'abc')
+        writer = image_transfer._threading.Thread(target=queue.write,
+                                                  args=(b'def',))
+        writer.start()
+        writer.join(0.01)
+        self.assertTrue(writer.is_alive())
+
+        self.assertEqual(b'abc', queue.read(10))
+        writer.join()
+        self.assertEqual(b'def', queue.read(10))
+
+    def test_abort(self):
+        queue = image_transfer.NativeBlockingQueue(1, 0)
+        errors = []
+
+        def read():
+            try:
+                queue.read(10)
+            except IOError as excep:
+                errors.append(excep)
+
+        reader = image_transfer._threading.Thread(target=read)
+        reader.start()
+        queue.abort()
+        reader.join()
+        self.assertEqual(1, len(errors))
+        self.assertRaises(IOError, queue.write, b'abc')
+
+    def test_write_with_digest_task(self):
+        digest_task = image_transfer.DigestTask({'md5': None})
+        queue = image_transfer.NativeBlockingQueue(2, 0,
+                                                   digest_task=digest_task)
+        queue.write(b'abc')
+        self.assertEqual({'md5': hashlib.md5(b'abc').hexdigest()},
+                         digest_task.finish())
+
+
+class NativeReadWriteTaskTest(base.TestCase):
+    """Tests for NativeReadWriteTask."""
+
+    def test_transfer(self):
+        data = b'x' * (rw_handles.READ_CHUNKSIZE * 3 + 10)
+        written = []
+
+        class OutputFile(io.BytesIO):
+            def write(self, chunk):
+                written.append(
+                    (bytes(chunk), image_transfer._threading.current_thread()))
+
+        output_file = OutputFile()
+        digest = hashlib.sha256(data).hexdigest()
+
+        self.assertEqual({'sha256': digest},
+                         image_transfer._start_transfer(
+                             None, 10, six.BytesIO(data), len(data),
+                             write_file_handle=output_file,
+                             digests={'sha256': digest},
+                             native_threads=True))
+        self.assertEqual(data, b''.join(chunk for chunk, thread in written))
+        self.assertNotIn(image_transfer._threading.current_thread(),
+                         [thread for chunk, thread in written])
+
+    def test_transfer_with_write_exception(self):
+        output_file = mock.Mock(spec=io.BytesIO)
+        output_file.write.side_effect = RuntimeError()
+        data = b'x' * (rw_handles.READ_CHUNKSIZE * 20)
+        self.assertRaises(exceptions.ImageTransferException,
+                          image_transfer._start_transfer,
+                          None, 10, six.BytesIO(data), len(data),
+                          write_file_handle=output_file,
+                          native_threads=True)
+
+    @mock.patch.object(image_transfer, 'NativeBlockingQueue')
+    def test_transfer_with_network_handle(self, fake_queue):
+        data = b'x' * (rw_handles.READ_CHUNKSIZE + 10)
+        output_file = mock.Mock()
+        written = []
+        output_file.write.side_effect = lambda chunk: written.append(
+            (bytes(chunk), image_transfer._threading.current_thread()))
+
+        image_transfer._start_transfer(None, 10, six.BytesIO(data),
+                                       len(data),
+                                       write_file_handle=output_file,
+                                       native_threads=True)
+        # The greened handles are only used from greenthreads.
+        self.assertFalse(fake_queue.called)
+        self.assertEqual(data, b''.join(chunk for chunk, thread in written))
+        self.assertEqual(set([image_transfer._threading.current_thread()]),
+                         set(thread for chunk, thread in written))
+
+
+class TokenBucketTest(base.TestCase):
+    """Tests for TokenBucket."""
+
+    @mock.patch.object(greenthread, 'sleep')
+    @mock.patch.object(image_transfer, 'time')
+    def test_consume(self, time_mod, sleep):
+        time_mod.time.return_value = 0
+        bucket = image_transfer.TokenBucket(100, burst=50)
+        bucket.consume(50)
+        self.assertFalse(sleep.called)
+
+        # A chunk larger than the burst size puts the bucket in debt.
+        bucket.consume(100)
+        sleep.assert_called_once_with(1.0)
+
+        time_mod.time.return_value = 1.5
+        sleep.reset_mock()
+        bucket.consume(50)
+        self.assertFalse(sleep.called)
+
+    @mock.patch.object(greenthread, 'sleep')
+    @mock.patch.object(image_transfer, '_time')
+    @mock.patch.object(image_transfer, 'time')
+    def test_consume_in_native_thread(self, time_mod, native_time, sleep):
+        time_mod.time.return_value = 0
+        bucket = image_transfer.TokenBucket(100, burst=50)
+        thread = image_transfer._threading.Thread(target=bucket.consume,
+                                                  args=(150,))
+        thread.start()
+        thread.join()
+        native_time.sleep.assert_called_once_with(1.0)
+        self.assertFalse(sleep.called)
+
+
+class TransferSchedulerTest(base.TestCase):
+    """Tests for TransferScheduler."""
+
+    def _transfer(self, started, release):
+        def func(name, throttle=None):
+            started.append(name)
+            throttle(10)
+            release[name].wait()
+            return name
+        return func
+
+    def test_submit_with_limits(self):
+        scheduler = image_transfer.TransferScheduler(max_concurrent=2,
+                                                     max_per_host=1)
+        started = []
+        release = dict((name, event.Event()) for name in 'abcd')
+        func = self._transfer(started, release)
+        done = [scheduler.submit('host-1', 'ds-1', func, 'a'),
+                scheduler.submit('host-1', 'ds-1', func, 'b'),
+                scheduler.submit('host-2', 'ds-1', func, 'c'),
+                scheduler.submit('host-3', 'ds-1', func, 'd')]
+        greenthread.sleep(0)
+
+        # The transfer to the busy host does not block the next one.
+        self.assertEqual(['a', 'c'], started)
+        stats = scheduler.get_stats()
+        self.assertEqual(2, stats['queued'])
+        self.assertEqual(2, stats['running'])
+        self.assertEqual(20, stats['transferred'])
+
+        release['a'].send()
+        self.assertEqual('a', done[0].wait())
+        greenthread.sleep(0)
+        self.assertEqual(['a', 'c', 'b'], started)
+
+        for name in 'bcd':
+            release[name].send()
+        self.assertEqual(['b', 'c', 'd'],
+                         [request.wait() for request in done[1:]])
+        stats = scheduler.get_stats()
+        self.assertEqual(0, stats['queued'])
+        self.assertEqual(4, stats['completed'])
+        self.assertEqual(40, stats['transferred'])
+
+    def test_submit_with_per_datastore_limit(self):
+        scheduler = image_transfer.TransferScheduler(max_per_datastore=1)
+        started = []
+        release = dict((name, event.Event()) for name in 'ab')
+        func = self._transfer(started, release)
+        scheduler.submit('host-1', 'ds-1', func, 'a')
+        scheduler.submit('host-2', 'ds-1', func, 'b')
+        greenthread.sleep(0)
+        self.assertEqual(['a'], started)
+        release['a'].send()
+        release['b'].send()
+
+    def test_submit_with_exception(self):
+        scheduler = image_transfer.TransferScheduler()
+
+        def func(throttle=None):
+            raise exceptions.ImageTransferException('error')
+
+        done = scheduler.submit(None, None, func)
+        self.assertRaises(exceptions.ImageTransferException, done.wait)
+        self.assertEqual(1, scheduler.get_stats()['failed'])
+
+    @mock.patch.object(image_transfer.TokenBucket, 'consume')
+    def test_submit_with_bandwidth(self, consume):
+        scheduler = image_transfer.TransferScheduler(bandwidth=1024)
+        data = b'x' * (rw_handles.READ_CHUNKSIZE + 10)
+        output_file = mock.Mock()
+        done = scheduler.submit(None, None, image_transfer._start_transfer,
+                                None, 10, six.BytesIO(data), len(data),
+                                write_file_handle=output_file)
+        done.wait()
+        self.assertEqual([mock.call(rw_handles.READ_CHUNKSIZE),
+                          mock.call(10),
+                          mock.call(0)],
+                         consume.call_args_list)
+        self.assertEqual(len(data), scheduler.get_stats()['transferred'])
+
+
+class FakeSegmentHandle(object):
+    """Write handle which records the data written to a datastore file."""
+
+    def __init__(self, files, path, size, status=201):
+        self._files = files
+        self._path = path
+        self._status = status
+        self._data = six.BytesIO()
+        self.size = size
+
+    def write(self, data):
+        self._data.write(data)
+
+    def getresponse(self):
+        if self._status < 300:
+            self._files[self._path] = self._data.getvalue()
+        return mock.Mock(status=self._status)
+
+    def close(self):
+        pass
+
+
+class ResumableTransferTest(base.TestCase):
+    """Tests for the resumable segmented transfer."""
+
+    def setUp(self):
+        super(ResumableTransferTest, self).setUp()
+        self.checkpoint_path = os.path.join(
+            self.useFixture(fixtures.TempDir()).path, 'checkpoint')
+        self.files = {}
+        self.statuses = {}
+        self.opened = []
+        patcher = mock.patch.object(greenthread, 'sleep')
+        self.addCleanup(patcher.stop)
+        self.sleep = patcher.start()
+
+    def _open_file(self, path, size):
+        self.opened.append(path)
+        statuses = self.statuses.get(path)
+        status = statuses.pop(0) if statuses else 201
+        return FakeSegmentHandle(self.files, path, size, status)
+
+    def _upload(self, data, **kwargs):
+        return image_transfer._upload_segments(
+            six.BytesIO(data), len(data), '[ds1] disk/disk-flat.vmdk',
+            self._open_file, self.checkpoint_path, 'image-1', **kwargs)
+
+    def test_upload_segments(self):
+        data = b'a' * 1024 + b'b' * 1024 + b'c' * 100
+        self.assertEqual('[ds1] disk/disk.vmdk',
+                         self._upload(data, segment_size=1024))
+
+        self.assertEqual(b'a' * 1024, self.files['[ds1] disk/disk-f001.vmdk'])
+        self.assertEqual(b'b' * 1024, self.files['[ds1] disk/disk-f002.vmdk'])
+        self.assertEqual(b'c' * 100, self.files['[ds1] disk/disk-f003.vmdk'])
+        descriptor = self.files['[ds1] disk/disk.vmdk'].decode('utf-8')
+        self.assertIn('createType="twoGbMaxExtentFlat"', descriptor)
+        self.assertIn('RW 2 FLAT "disk-f001.vmdk" 0\n'
+                      'RW 2 FLAT "disk-f002.vmdk" 0\n'
+                      'RW 1 FLAT "disk-f003.vmdk" 0\n', descriptor)
+        self.assertFalse(os.path.exists(self.checkpoint_path))
+
+    def test_upload_segments_retries_failed_segment(self):
+        self.statuses['[ds1] disk/disk-f002.vmdk'] = [503]
+        data = b'a' * 1024 + b'b' * 1024
+        self._upload(data, segment_size=1024)
+
+        self.assertEqual(['[ds1] disk/disk-f001.vmdk',
+                          '[ds1] disk/disk-f002.vmdk',
+                          '[ds1] disk/disk-f002.vmdk',
+                          '[ds1] disk/disk.vmdk'],
+                         self.opened)
+        self.assertEqual(b'b' * 1024, self.files['[ds1] disk/disk-f002.vmdk'])
+        self.assertEqual(1, self.sleep.call_count)
+
+    def test_upload_segments_resume(self):
+        self.statuses['[ds1] disk/disk-f002.vmdk'] = [403]
+        data = b'a' * 1024 + b'b' * 1024
+        self.assertRaises(exceptions.VimException,
+                          self._upload,
+                          data,
+                          segment_size=1024)
+        with open(self.checkpoint_path) as checkpoint_file:
+            self.assertEqual([0], json.load(checkpoint_file)['completed'])
+
+        self.opened = []
+        self._upload(data, segment_size=1024)
+        self.assertEqual(['[ds1] disk/disk-f002.vmdk',
+                          '[ds1] disk/disk.vmdk'],
+                         self.opened)
+        self.assertEqual(b'b' * 1024, self.files['[ds1] disk/disk-f002.vmdk'])
+
+    def test_checkpoint_of_other_upload(self):
+        checkpoint = image_transfer.UploadCheckpoint(self.checkpoint_path,
+                                                     'image-1', 2048, 1024)
+        checkpoint.mark_completed(0)
+
+        checkpoint = image_transfer.UploadCheckpoint(self.checkpoint_path,
+                                                     'image-1', 2048, 512)
+        self.assertFalse(checkpoint.is_completed(0))
+
+    def test_upload_segments_with_invalid_segment_size(self):
+        self.assertRaises(ValueError, self._upload, b'a', segment_size=1000)
+
+    @mock.patch.object(image_transfer, '_upload_segments')
+    def test_start_resumable_transfer_with_error(self, upload_segments):
+        upload_segments.side_effect = exceptions.VimException('error')
+        read_handle = mock.Mock()
+        self.assertRaises(exceptions.ImageTransferException,
+                          image_transfer._start_resumable_transfer,
+                          10, read_handle, 1024, 'disk-flat.vmdk',
+                          self._open_file, self.checkpoint_path, 'image-1')
+        read_handle.close.assert_called_once_with()
+
+    @mock.patch('oslo_vmware.rw_handles.FileWriteHandle')
+    @mock.patch('oslo_vmware.rw_handles.ImageReadHandle')
+    @mock.patch.object(image_transfer, '_start_resumable_transfer')
+    def test_download_flat_image_with_checkpoint(
+            self,
+            fake_transfer,
+            fake_rw_handles_ImageReadHandle,
+            fake_rw_handles_FileWriteHandle):
+        context = mock.Mock()
+        fake_transfer.return_value = 'disk.vmdk'
+        ret = image_transfer.download_flat_image(
+            context, 10, mock.Mock(), 'image-1', image_size=1000,
+            host='127.0.0.1', port=443, data_center_name='dc1',
+            datastore_name='ds1', cookies=[], file_path='disk-flat.vmdk',
+            checkpoint_path=self.checkpoint_path, segment_size=512)
+
+        self.assertEqual('disk.vmdk', ret)
+
+        fake_transfer.assert_called_once_with(
+            10,
+            fake_rw_handles_ImageReadHandle.return_value,
+            1000,
+            'disk-flat.vmdk',
+            mock.ANY,
+            self.checkpoint_path,
+            'image-1',
+            segment_size=512)
+        open_file = fake_transfer.call_args[0][4]
+        self.assertEqual(fake_rw_handles_FileWriteHandle.return_value,
+                         open_file('disk-f001.vmdk', 512))
+        fake_rw_handles_FileWriteHandle.assert_called_once_with(
+            '127.0.0.1', 443, 'dc1', 'ds1', [], 'disk-f001.vmdk', 512,
+            cacerts=None)
+
+    @mock.patch.object(image_transfer, '_start_resumable_transfer')
+    def test_download_flat_image_with_checkpoint_and_digests(
+            self, fake_transfer):
+        self.assertRaises(ValueError,
+                          image_transfer.download_flat_image,
+                          mock.Mock(), 10, mock.Mock(), 'image-1',
+                          image_size=1000, file_path='disk-flat.vmdk',
+                          checkpoint_path=self.checkpoint_path,
+                          digests={'sha256': 'abc'}, verify_checksum=True)
+        self.assertFalse(fake_transfer.called)
+
+    @mock.patch.object(image_transfer, '_start_resumable_transfer')
+    def test_download_image_with_checkpoint(self, fake_transfer):
+        session = mock.Mock(_scheme='https', _host='10.1.2.3')
+        datastore = mock.Mock()
+        ret = image_transfer.download_image(
+            mock.Mock(), {'size': 1000, 'id': 'image-1'}, session, datastore,
+            'disk-flat.vmdk', bypass=False,
+            checkpoint_path=self.checkpoint_path)
+        self.assertEqual(fake_transfer.return_value, ret)
+        self.assertEqual('disk-flat.vmdk', fake_transfer.call_args[0][3])
+
+    @mock.patch.object(image_transfer, '_start_transfer')
+    def test_download_image_verifies_server(self, fake_transfer):
+        session = mock.Mock(_scheme='https', _host='10.1.2.3',
+                            _cacert='/etc/ca.pem', _insecure=False)
+        datastore = mock.Mock()
+        ds_url = datastore.build_url.return_value
+        image_transfer.download_image(
+            mock.Mock(), {'size': 1000}, session, datastore,
+            'disk-flat.vmdk', bypass=False)
+        ds_url.connect.assert_called_once_with(
+            'PUT', 1000, mock.ANY, cacert='/etc/ca.pem', insecure=False)
+        self.assertTrue(fake_transfer.called)
+
+    @mock.patch.object(image_transfer, '_start_transfer')
+    def test_download_image_with_failed_transfer(self, fake_transfer):
+        session = mock.Mock(_scheme='https', _host='10.1.2.3')
+        datastore = mock.Mock()
+        host_resolver = mock.Mock()
+        fake_transfer.side_effect = exceptions.ImageTransferException('error')
+        self.assertRaises(exceptions.ImageTransferException,
+                          image_transfer.download_image,
+                          mock.Mock(), {'size': 1000}, session, datastore,
+                          'disk-flat.vmdk', host_resolver=host_resolver)
+        # The hosts of the datastore are resolved again by the next
+        # transfer.
+        host_resolver.invalidate.assert_called_once_with(session, datastore)
+        host_resolver.release_host.assert_called_once_with(
+            host_resolver.choose_host.return_value)
+
+    def test_download_image_with_checkpoint_and_throttle(self):
+        self.assertRaises(ValueError,
+                          image_transfer.download_image,
+                          mock.Mock(), {'size': 1000}, mock.Mock(),
+                          mock.Mock(), 'disk-flat.vmdk',
+                          checkpoint_path=self.checkpoint_path,
+                          throttle=mock.Mock())
+
 
 class ImageTransferUtilityTest(base.TestCase):
     """Tests for image_transfer utility methods."""
@@ -230,7 +1077,11 @@ class ImageTransferUtilityTest(base.TestCase):
                                            image_meta=image_meta)
 
         exp_calls = [mock.call(blocking_queue_size,
-                               max_data_size)] * len(write_file_handles)
+                               max_data_size,
+                               chunk_size=None,
+                               max_bytes=None,
+                               adaptive=False,
+                               digest_task=None)] * len(write_file_handles)
         self.assertEqual(exp_calls,
                          fake_BlockingQueue.call_args_list)
 
@@ -257,6 +1108,43 @@ class ImageTransferUtilityTest(base.TestCase):
 
         write_file_handle1.close.assert_called_once()
 
+    @mock.patch.object(image_transfer, 'FileReadWriteTask')
+    @mock.patch.object(image_transfer, 'ByteRingBuffer')
+    @mock.patch.object(image_transfer, 'BlockingQueue')
+    def test_start_transfer_with_queue_bytes(self, fake_BlockingQueue,
+                                             fake_ByteRingBuffer,
+                                             fake_FileReadWriteTask):
+        # The source has no readinto(), but the BlockingQueue is still used
+        # unless the ring buffer is asked for.
+        read_file_handle = mock.Mock(spec=['read', 'close'])
+        image_transfer._start_transfer(None, 10, read_file_handle, 30,
+                                       write_file_handle=mock.Mock(),
+                                       queue_bytes=1024)
+        fake_BlockingQueue.assert_called_once_with(10, 30,
+                                                   chunk_size=None,
+                                                   max_bytes=1024,
+                                                   adaptive=False,
+                                                   digest_task=None)
+        self.assertFalse(fake_ByteRingBuffer.called)
+
+    @mock.patch.object(image_transfer, 'FileReadWriteTask')
+    @mock.patch.object(image_transfer, 'ByteRingBuffer')
+    @mock.patch.object(image_transfer, 'BlockingQueue')
+    def test_start_transfer_with_ring_buffer(self, fake_BlockingQueue,
+                                             fake_ByteRingBuffer,
+                                             fake_FileReadWriteTask):
+        read_file_handle = mock.Mock()
+        image_transfer._start_transfer(None, 10, read_file_handle, 30,
+                                       write_file_handle=mock.Mock(),
+                                       queue_bytes=1024, ring_buffer=True)
+        fake_ByteRingBuffer.assert_called_once_with(1024, 30,
+                                                    chunk_size=None,
+                                                    adaptive=False,
+                                                    digest_task=None)
+        self.assertFalse(fake_BlockingQueue.called)
+        fake_FileReadWriteTask.assert_any_call(
+            read_file_handle, fake_ByteRingBuffer.return_value)
+
     @mock.patch.object(image_transfer, 'FileReadWriteTask')
     @mock.patch.object(image_transfer, 'BlockingQueue')
     def test_start_transfer_with_no_image_destination(self, fake_BlockingQueue,
@@ -287,11 +1175,114 @@ class ImageTransferUtilityTest(base.TestCase):
                           image_meta=image_meta)
 
         fake_BlockingQueue.assert_called_once_with(blocking_queue_size,
-                                                   max_data_size)
+                                                   max_data_size,
+                                                   chunk_size=None,
+                                                   max_bytes=None,
+                                                   adaptive=False,
+                                                   digest_task=None)
 
         fake_FileReadWriteTask.assert_called_once_with(read_file_handle,
                                                        blocking_queue)
 
+    @mock.patch('oslo_vmware.rw_handles.FileWriteHandle')
+    @mock.patch('oslo_vmware.rw_handles.ImageReadHandle')
+    @mock.patch.object(image_transfer, '_start_transfer')
+    def test_download_flat_image_with_transfer_options(
+            self,
+            fake_transfer,
+            fake_rw_handles_ImageReadHandle,
+            fake_rw_handles_FileWriteHandle):
+        context = mock.Mock()
+        image_transfer.download_flat_image(
+            context, 10, mock.Mock(), 'image-1', image_size=1000,
+            chunk_size=1024 * 1024, queue_bytes=64 * 1024 * 1024,
+            adaptive_chunking=True)
+
+        fake_transfer.assert_called_once_with(
+            context,
+            10,
+            fake_rw_handles_ImageReadHandle.return_value,
+            1000,
+            write_file_handle=fake_rw_handles_FileWriteHandle.return_value,
+            chunk_size=1024 * 1024,
+            queue_bytes=64 * 1024 * 1024,
+            adaptive_chunking=True)
+
+    @mock.patch('oslo_vmware.rw_handles.FileWriteHandle')
+    @mock.patch('oslo_vmware.rw_handles.ImageReadHandle')
+    @mock.patch.object(image_transfer, '_start_transfer')
+    def test_download_flat_image_with_verify_checksum(
+            self,
+            fake_transfer,
+            fake_rw_handles_ImageReadHandle,
+            fake_rw_handles_FileWriteHandle):
+        context = mock.Mock()
+        image_service = mock.Mock()
+        image_service.show.return_value = {'checksum': 'fake-md5'}
+        image_transfer.download_flat_image(
+            context, 10, image_service, 'image-1', image_size=1000,
+            verify_checksum=True, digests={'sha256': 'fake-sha256'})
+
+        image_service.show.assert_called_once_with(context, 'image-1')
+        fake_transfer.assert_called_once_with(
+            context,
+            10,
+            fake_rw_handles_ImageReadHandle.return_value,
+            1000,
+            write_file_handle=fake_rw_handles_FileWriteHandle.return_value,
+            digests={'md5': 'fake-md5', 'sha256': 'fake-sha256'})
+
+    @mock.patch('oslo_vmware.rw_handles.ParallelFileReadHandle')
+    def test_download_datastore_file(self, fake_ParallelFileReadHandle):
+        session = mock.Mock(_scheme='https', _host='10.1.2.3', _cacert=None,
+                            _insecure=False)
+        session.vim.get_http_cookie.return_value = '"cookie"'
+        datastore = mock.Mock()
+        file_handle = mock.Mock()
+
+        image_transfer.download_datastore_file(
+            session, datastore, 'vm/disk-flat.vmdk', 1000, file_handle,
+            bypass=False, connections=4, range_size=100)
+        datastore.build_url.assert_called_once_with('https', '10.1.2.3',
+                                                    'vm/disk-flat.vmdk')
+        fake_ParallelFileReadHandle.assert_called_once_with(
+            datastore.build_url.return_value, 1000,
+            cookie='vmware_soap_session=cookie', cacerts=True,
+            connections=4, range_size=100)
+        read_handle = fake_ParallelFileReadHandle.return_value
+        read_handle.download_to.assert_called_once_with(file_handle)
+        read_handle.close.assert_called_once_with()
+
+    @mock.patch('oslo_vmware.rw_handles.ParallelFileReadHandle')
+    def test_download_datastore_file_with_bypass(
+            self, fake_ParallelFileReadHandle):
+        session = mock.Mock(_scheme='https', _host='10.1.2.3',
+                            _cacert='/etc/ca.pem')
+        datastore = mock.Mock()
+        host_resolver = mock.Mock()
+        host = host_resolver.choose_host.return_value
+        read_handle = fake_ParallelFileReadHandle.return_value
+        read_handle.download_to.side_effect = (
+            exceptions.VimConnectionException('error'))
+
+        self.assertRaises(exceptions.VimConnectionException,
+                          image_transfer.download_datastore_file,
+                          session, datastore, 'vm/disk-flat.vmdk', 1000,
+                          mock.Mock(), host_resolver=host_resolver)
+        datastore.build_url.assert_called_once_with(
+            'https', host.name, 'vm/disk-flat.vmdk', mock.ANY)
+        kwargs = fake_ParallelFileReadHandle.call_args[1]
+        self.assertEqual('/etc/ca.pem', kwargs['cacerts'])
+        self.assertEqual(1, kwargs['connections'])
+        # A ticket is requested for each range request.
+        ds_url = datastore.build_url.return_value
+        self.assertEqual(ds_url.get_transfer_ticket.return_value,
+                         kwargs['cookie']())
+        ds_url.get_transfer_ticket.assert_called_once_with(session, 'GET')
+        host_resolver.invalidate.assert_called_once_with(session, datastore)
+        host_resolver.release_host.assert_called_once_with(host)
+        read_handle.close.assert_called_once_with()
+
     @mock.patch('oslo_vmware.rw_handles.FileWriteHandle')
     @mock.patch('oslo_vmware.rw_handles.ImageReadHandle')
     @mock.patch.object(image_transfer, '_start_transfer')
@@ -550,3 +1541,25 @@ class ImageTransferUtilityTest(base.TestCase):
                                               image_service=image_service,
                                               image_id=image_id,
                                               image_meta=image_metadata)
+
+    @mock.patch('oslo_vmware.rw_handles.VmdkReadHandle')
+    @mock.patch.object(image_transfer, '_start_transfer')
+    def test_upload_image_with_checksum_mismatch(self, fake_transfer,
+                                                 fake_VmdkReadHandle):
+        context = mock.Mock()
+        image_service = mock.Mock()
+        image_service.show.return_value = {'checksum': 'fake-md5'}
+        fake_transfer.return_value = {'md5': 'other-md5'}
+
+        self.assertRaises(exceptions.ImageChecksumMismatchException,
+                          image_transfer.upload_image,
+                          context,
+                          10,
+                          image_service,
+                          'image-1',
+                          'owner-1',
+                          vmdk_size=1000,
+                          verify_checksum=True)
+        self.assertEqual({'md5': None},
+                         fake_transfer.call_args[1]['digests'])
+        image_service.show.assert_called_once_with(context, 'image-1')
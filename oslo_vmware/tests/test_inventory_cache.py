@@ -0,0 +1,232 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the property collector based inventory cache.
+"""
+
+from eventlet import greenthread
+import mock
+
+from oslo_vmware import exceptions
+from oslo_vmware import inventory_cache
+from oslo_vmware.tests import base
+from oslo_vmware import vim_util
+
+
+class FakePropertyCollectorServer(object):
+    """Simulates the property collector methods of a vCenter server.
+
+    A WaitForUpdatesEx call reports the initial contents of the filters
+    created since the previous call and the queued inventory changes.
+    """
+
+    def __init__(self, inventory):
+        self.inventory = inventory
+        self.collectors = []
+        self.created_collectors = 0
+        self.filters = {}
+        self.new_filters = []
+        self.changes = []
+        self.wait_calls = 0
+        self.wait_errors = []
+        self.cancel_calls = 0
+        self.version = 0
+
+    def CreatePropertyCollector(self, collector):
+        moref = vim_util.get_moref('session[%d]' % self.created_collectors,
+                                   'PropertyCollector')
+        self.created_collectors += 1
+        self.collectors.append(moref)
+        self.filters = {}
+        self.new_filters = []
+        return moref
+
+    def DestroyPropertyCollector(self, collector):
+        self.collectors.remove(collector)
+
+    def CreateFilter(self, collector, spec, partialUpdates):
+        prop_spec = spec.propSet[0]
+        prop_filter = vim_util.get_moref('filter-%d' % len(self.filters),
+                                         'PropertyFilter')
+        self.filters[prop_filter.value] = (prop_spec.type,
+                                           list(prop_spec.pathSet))
+        self.new_filters.append(prop_filter)
+        return prop_filter
+
+    def CancelWaitForUpdates(self, collector):
+        self.cancel_calls += 1
+
+    def WaitForUpdatesEx(self, collector, version, options):
+        self.wait_calls += 1
+        greenthread.sleep(0)
+        if self.wait_errors:
+            raise self.wait_errors.pop(0)
+        filter_updates = []
+        for prop_filter in self.new_filters:
+            type_, path_set = self.filters[prop_filter.value]
+            obj_updates = [self._obj_update(type_, value, 'enter',
+                                            props, path_set)
+                           for value, props in self.inventory[type_].items()]
+            filter_updates.append(mock.Mock(filter=prop_filter,
+                                            objectSet=obj_updates))
+        self.new_filters = []
+        for type_, value, kind, props in self.changes:
+            for filter_value, (f_type, path_set) in self.filters.items():
+                if f_type != type_:
+                    continue
+                obj_update = self._obj_update(type_, value, kind, props,
+                                              path_set)
+                filter_updates.append(mock.Mock(
+                    filter=vim_util.get_moref(filter_value, 'PropertyFilter'),
+                    objectSet=[obj_update]))
+        self.changes = []
+        if not filter_updates:
+            return None
+        self.version += 1
+        return mock.Mock(version=str(self.version), truncated=False,
+                         filterSet=filter_updates)
+
+    @staticmethod
+    def _obj_update(type_, value, kind, props, path_set):
+        change_set = []
+        for name in path_set:
+            if name not in props:
+                continue
+            change = mock.Mock(op='assign', val=props[name])
+            change.name = name
+            change_set.append(change)
+        return mock.Mock(obj=vim_util.get_moref(value, type_), kind=kind,
+                         changeSet=change_set)
+
+
+class InventoryCacheTest(base.TestCase):
+    """Tests for InventoryCache."""
+
+    def setUp(self):
+        super(InventoryCacheTest, self).setUp()
+        self.server = FakePropertyCollectorServer(
+            {'HostSystem': {'host-1': {'name': 'h1', 'runtime': 'on'},
+                            'host-2': {'name': 'h2', 'runtime': 'off'}},
+             'Datastore': {'ds-1': {'name': 'ds1'}}})
+        vim = mock.Mock()
+        vim.client.factory.create.side_effect = lambda ns: mock.Mock()
+        for method in ['CreatePropertyCollector', 'DestroyPropertyCollector',
+                       'CreateFilter', 'CancelWaitForUpdates',
+                       'WaitForUpdatesEx']:
+            setattr(vim, method, getattr(self.server, method))
+        self.session = mock.Mock()
+        self.session.vim = vim
+
+        def invoke_api(module, method, *args, **kwargs):
+            return getattr(module, method)(*args, **kwargs)
+
+        self.session.invoke_api.side_effect = invoke_api
+        self.cache = inventory_cache.InventoryCache(self.session)
+        self.addCleanup(self.cache.close)
+
+    def _wait_until(self, condition):
+        for i in range(100):
+            if condition():
+                return
+            greenthread.sleep(0)
+        self.fail('Condition not met.')
+
+    def test_get_objects(self):
+        hosts = self.cache.get_objects('HostSystem', ['runtime', 'name'])
+        self.assertEqual({'host-1': {'name': 'h1', 'runtime': 'on'},
+                          'host-2': {'name': 'h2', 'runtime': 'off'}},
+                         hosts)
+        self.assertEqual(1, len(self.server.collectors))
+        self.assertEqual(1, len(self.server.filters))
+
+        # Reads of a synchronized (type, properties) pair are local.
+        calls = len(self.session.invoke_api.mock_calls)
+        hosts = self.cache.get_objects('HostSystem', ['name', 'runtime'])
+        self.assertEqual(2, len(hosts))
+        self.assertEqual({'name': 'h1', 'runtime': 'on'},
+                         self.cache.get_object_properties(
+                             vim_util.get_moref('host-1', 'HostSystem'),
+                             ['name', 'runtime']))
+        self.assertEqual(
+            [], [call for call in self.session.invoke_api.mock_calls[calls:]
+                 if call[1][1] != 'wait_for_updates_ex'])
+
+    def test_get_objects_with_multiple_filters(self):
+        self.cache.get_objects('HostSystem', ['name'])
+        datastores = self.cache.get_objects('Datastore', ['name'])
+        self.assertEqual({'ds-1': {'name': 'ds1'}}, datastores)
+        self.assertEqual(1, len(self.server.collectors))
+        self.assertEqual(2, len(self.server.filters))
+
+    def test_updates(self):
+        self.cache.get_objects('HostSystem', ['name', 'runtime'])
+        version = self.cache.version
+        self.server.changes = [
+            ('HostSystem', 'host-1', 'modify', {'runtime': 'off'}),
+            ('HostSystem', 'host-2', 'leave', {}),
+            ('HostSystem', 'host-3', 'enter', {'name': 'h3',
+                                               'runtime': 'on'})]
+
+        self._wait_until(lambda: self.cache.version != version)
+        self.assertEqual({'host-1': {'name': 'h1', 'runtime': 'off'},
+                          'host-3': {'name': 'h3', 'runtime': 'on'}},
+                         self.cache.get_objects('HostSystem',
+                                                ['name', 'runtime']))
+        self.assertIsNone(self.cache.get_object_properties(
+            vim_util.get_moref('host-2', 'HostSystem'), ['name', 'runtime']))
+
+    def test_recover_from_wait_for_updates_error(self):
+        self.cache.get_objects('HostSystem', ['name'])
+        self.server.wait_errors = [exceptions.VimFaultException(
+            ['ManagedObjectNotFound'], 'collector not found')]
+        self.server.inventory['HostSystem'].pop('host-2')
+
+        self._wait_until(lambda: self.server.created_collectors == 2)
+        self._wait_until(
+            lambda: 'host-2' not in self.cache.get_objects('HostSystem',
+                                                           ['name']))
+        self.assertEqual({'host-1': {'name': 'h1'}},
+                         self.cache.get_objects('HostSystem', ['name']))
+        # The old collector is destroyed along with its filters.
+        self.assertEqual(1, len(self.server.collectors))
+
+    def test_get_objects_with_persistent_wait_for_updates_error(self):
+        self.server.wait_errors = [exceptions.VimConnectionException('error'),
+                                   exceptions.VimConnectionException('error')]
+        self.assertRaises(exceptions.VimConnectionException,
+                          self.cache.get_objects,
+                          'HostSystem',
+                          ['name'])
+        self.assertEqual({}, self.cache._registrations)
+        self.assertEqual([], self.server.collectors)
+
+        # The next read registers the filter again.
+        self.assertEqual(2, len(self.cache.get_objects('HostSystem',
+                                                       ['name'])))
+
+    def test_get_objects_with_request_canceled(self):
+        self.cache.get_objects('HostSystem', ['name'])
+        self.server.wait_errors = [exceptions.VimFaultException(
+            [inventory_cache.REQUEST_CANCELED], 'canceled')]
+
+        self._wait_until(lambda: not self.server.wait_errors)
+        self.assertEqual(1, len(self.server.collectors))
+
+    def test_close(self):
+        self.cache.get_objects('HostSystem', ['name'])
+        self.cache.close()
+        self.assertEqual([], self.server.collectors)
+        self._wait_until(lambda: self.cache._thread is None)
@@ -0,0 +1,177 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for retry policies.
+"""
+
+from eventlet import greenthread
+import mock
+
+from oslo_vmware import api
+from oslo_vmware import exceptions
+from oslo_vmware import retry
+from oslo_vmware.tests import base
+
+
+class BackoffTest(base.TestCase):
+    """Tests for the backoff strategies."""
+
+    def test_linear_backoff(self):
+        backoff = retry.LinearBackoff(10, 25)
+        self.assertEqual([10, 20, 25],
+                         [backoff.delay(attempt) for attempt in [1, 2, 3]])
+
+    def test_exponential_backoff(self):
+        backoff = retry.ExponentialBackoff(0.5, 2, 3, jitter=False)
+        self.assertEqual([0.5, 1, 2, 3],
+                         [backoff.delay(attempt)
+                          for attempt in [1, 2, 3, 4]])
+
+    @mock.patch('random.uniform')
+    def test_exponential_backoff_with_jitter(self, uniform):
+        backoff = retry.ExponentialBackoff(1, 2, 60)
+        self.assertEqual(uniform.return_value, backoff.delay(3))
+        uniform.assert_called_once_with(0, 4)
+
+
+class RetryBudgetTest(base.TestCase):
+    """Tests for RetryBudget."""
+
+    def test_withdraw(self):
+        budget = retry.RetryBudget(ratio=0.5, capacity=2)
+        self.assertTrue(budget.withdraw())
+        self.assertTrue(budget.withdraw())
+        self.assertFalse(budget.withdraw())
+
+        budget.deposit()
+        self.assertFalse(budget.withdraw())
+        budget.deposit()
+        self.assertTrue(budget.withdraw())
+
+    def test_deposit_up_to_capacity(self):
+        budget = retry.RetryBudget(ratio=1, capacity=2)
+        budget.deposit()
+        self.assertEqual(2, budget.tokens)
+
+
+class RetryPolicyTest(base.TestCase):
+    """Tests for RetryPolicy."""
+
+    def setUp(self):
+        super(RetryPolicyTest, self).setUp()
+        patcher = mock.patch.object(greenthread, 'sleep')
+        self.addCleanup(patcher.stop)
+        self.sleep = patcher.start()
+
+    def _func(self, responses):
+        def func(*args, **kwargs):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+        return func
+
+    def test_call(self):
+        policy = retry.RetryPolicy(
+            retryable=(exceptions.VimConnectionException,),
+            backoff=retry.LinearBackoff(1, 10))
+        func = self._func([exceptions.VimConnectionException('error'),
+                           exceptions.VimConnectionException('error'),
+                           'result'])
+
+        self.assertEqual('result', policy.call(func))
+        self.assertEqual([mock.call(1), mock.call(2)],
+                         self.sleep.mock_calls)
+
+    def test_call_with_unexpected_exception(self):
+        policy = retry.RetryPolicy(
+            retryable=(exceptions.VimConnectionException,))
+        func = self._func([exceptions.VimFaultException([], 'error')])
+
+        self.assertRaises(exceptions.VimFaultException, policy.call, func)
+        self.assertFalse(self.sleep.called)
+
+    def test_call_with_classifier(self):
+        policy = retry.RetryPolicy(
+            retryable=lambda excep: 'Busy' in excep.fault_list)
+        func = self._func([exceptions.VimFaultException(['Busy'], 'error'),
+                           exceptions.VimFaultException(['Fatal'], 'error')])
+
+        self.assertRaises(exceptions.VimFaultException, policy.call, func)
+        self.assertEqual(1, self.sleep.call_count)
+
+    def test_call_with_max_retries(self):
+        policy = retry.RetryPolicy(
+            max_retry_count=2,
+            retryable=(exceptions.VimConnectionException,))
+        func = self._func([exceptions.VimConnectionException('error')] * 3)
+
+        state = retry.RetryState()
+        self.assertRaises(exceptions.VimConnectionException,
+                          policy.call_with_state,
+                          state,
+                          func)
+        self.assertEqual(3, state.attempts)
+        self.assertEqual(2, state.retries)
+
+    @mock.patch.object(retry, 'time')
+    def test_call_with_deadline(self, time_mod):
+        # Times of the first attempt and of the two failures.
+        time_mod.time.side_effect = [0, 0, 10]
+        policy = retry.RetryPolicy(
+            retryable=(exceptions.VimConnectionException,),
+            backoff=retry.LinearBackoff(10, 60),
+            deadline=25)
+        func = self._func([exceptions.VimConnectionException('error')] * 3)
+
+        self.assertRaises(exceptions.VimConnectionException,
+                          policy.call,
+                          func)
+        # The third attempt would start 10 + 20 seconds after the first one.
+        self.assertEqual([mock.call(10)], self.sleep.mock_calls)
+
+    def test_call_with_budget(self):
+        budget = retry.RetryBudget(ratio=0, capacity=1)
+        policy = retry.RetryPolicy(
+            retryable=(exceptions.VimConnectionException,),
+            budget=budget)
+        func = self._func([exceptions.VimConnectionException('error')] * 2)
+
+        self.assertRaises(exceptions.VimConnectionException,
+                          policy.call,
+                          func)
+        self.assertEqual(1, self.sleep.call_count)
+
+    def test_retry_decorator_state_per_call(self):
+        retry_decorator = api.RetryDecorator(
+            10, 1, 10, (exceptions.VimConnectionException,))
+        responses = {'a': [exceptions.VimConnectionException('error'),
+                           'a'],
+                     'b': ['b']}
+
+        @retry_decorator
+        def func(key):
+            response = responses[key].pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual('a', func('a'))
+        self.assertEqual(1, retry_decorator._retry_count)
+        self.assertEqual('b', func('b'))
+        # The second call does not inherit the backoff of the first one.
+        self.assertEqual(0, retry_decorator._retry_count)
+        self.assertEqual([mock.call(1)], self.sleep.mock_calls)
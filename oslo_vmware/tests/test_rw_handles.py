@@ -17,6 +17,9 @@
 Unit tests for read and write handles for image transfer.
 """
 
+import functools
+
+from eventlet import greenthread
 import mock
 import six
 
@@ -64,7 +67,7 @@ class FileWriteHandleTest(base.TestCase):
 
         self._conn = mock.Mock()
         patcher = mock.patch(
-            'urllib3.connection.HTTPConnection')
+            'oslo_vmware.http_pool._HTTPConnection')
         self.addCleanup(patcher.stop)
         HTTPConnectionMock = patcher.start()
         HTTPConnectionMock.return_value = self._conn
@@ -82,6 +85,13 @@ class FileWriteHandleTest(base.TestCase):
         self._conn.getresponse.assert_called_once_with()
         self._conn.close.assert_called_once_with()
 
+    def test_getresponse(self):
+        response = self.vmw_http_write_file.getresponse()
+        self.assertEqual(self._conn.getresponse.return_value, response)
+        self.vmw_http_write_file.close()
+        # The response is read only once.
+        self._conn.getresponse.assert_called_once_with()
+
 
 class VmdkWriteHandleTest(base.TestCase):
     """Tests for VmdkWriteHandle."""
@@ -90,7 +100,7 @@ class VmdkWriteHandleTest(base.TestCase):
         super(VmdkWriteHandleTest, self).setUp()
         self._conn = mock.Mock()
         patcher = mock.patch(
-            'urllib3.connection.HTTPConnection')
+            'oslo_vmware.http_pool._HTTPConnection')
         self.addCleanup(patcher.stop)
         HTTPConnectionMock = patcher.start()
         HTTPConnectionMock.return_value = self._conn
@@ -176,6 +186,99 @@ class VmdkWriteHandleTest(base.TestCase):
         handle.close()
         self.assertEqual(2, session.invoke_api.call_count)
 
+    def test_progress_updater(self):
+        session = self._create_mock_session()
+        progress_updater = mock.Mock()
+        handle = rw_handles.VmdkWriteHandle(session, '10.1.2.3', 443,
+                                            'rp-1', 'folder-1', None,
+                                            100,
+                                            progress_updater=progress_updater)
+        progress_updater.register.assert_called_once_with(handle)
+        handle.write([1] * 25)
+        self.assertEqual(25, handle.get_progress())
+        handle.close()
+        progress_updater.unregister.assert_called_once_with(handle)
+
+    def test_get_progress_with_zero_size(self):
+        session = self._create_mock_session()
+        handle = rw_handles.VmdkWriteHandle(session, '10.1.2.3', 443,
+                                            'rp-1', 'folder-1', None, 0,
+                                            progress_updater=mock.Mock())
+        self.assertEqual(0, handle.get_progress())
+
+
+class LeaseProgressUpdaterTest(base.TestCase):
+    """Tests for LeaseProgressUpdater."""
+
+    @mock.patch.object(rw_handles, 'time')
+    def test_update(self, time_mod):
+        time_mod.time.return_value = 0
+        updater = rw_handles.LeaseProgressUpdater(update_interval=60)
+        handle = mock.Mock()
+        handle.get_progress.return_value = 0
+        with mock.patch.object(updater, '_poll_loop'):
+            updater.register(handle)
+
+        updater._update(handle)
+        self.assertEqual(1, handle.update_progress.call_count)
+        # The progress is unchanged.
+        updater._update(handle)
+        self.assertEqual(1, handle.update_progress.call_count)
+
+        handle.get_progress.return_value = 1
+        updater._update(handle)
+        self.assertEqual(2, handle.update_progress.call_count)
+
+        # The lease is kept alive even if the progress is unchanged.
+        time_mod.time.return_value = 60
+        updater._update(handle)
+        self.assertEqual(3, handle.update_progress.call_count)
+
+    def test_update_with_error(self):
+        updater = rw_handles.LeaseProgressUpdater()
+        handle = mock.Mock()
+        handle.get_progress.return_value = 10
+        handle.update_progress.side_effect = exceptions.VimException(None)
+        with mock.patch.object(updater, '_poll_loop'):
+            updater.register(handle)
+        updater._update(handle)
+        self.assertEqual((10, mock.ANY), updater._handles[handle])
+
+    def test_poll_loop(self):
+        updater = rw_handles.LeaseProgressUpdater(check_interval=0.001)
+        handles = [mock.Mock(), mock.Mock()]
+        for handle in handles:
+            handle.get_progress.return_value = 50
+            updater.register(handle)
+        greenthread.sleep(0.01)
+        for handle in handles:
+            updater.unregister(handle)
+        greenthread.sleep(0.01)
+
+        for handle in handles:
+            handle.update_progress.assert_called_once_with()
+        self.assertIsNone(updater._poller)
+
+    def test_poll_loop_with_unexpected_error(self):
+        updater = rw_handles.LeaseProgressUpdater(check_interval=0.001)
+        bad_handle = mock.Mock()
+        bad_handle.get_progress.side_effect = ZeroDivisionError
+        handle = mock.Mock()
+        handle.get_progress.return_value = 50
+        updater.register(bad_handle)
+        updater.register(handle)
+        greenthread.sleep(0.01)
+
+        # Only the failing handle is dropped.
+        self.assertNotIn(bad_handle, updater._handles)
+        self.assertFalse(bad_handle.update_progress.called)
+        handle.update_progress.assert_called_once_with()
+        self.assertIsNotNone(updater._poller)
+
+        updater.unregister(handle)
+        greenthread.sleep(0.01)
+        self.assertIsNone(updater._poller)
+
 
 class VmdkReadHandleTest(base.TestCase):
     """Tests for VmdkReadHandle."""
@@ -183,11 +286,11 @@ class VmdkReadHandleTest(base.TestCase):
     def setUp(self):
         super(VmdkReadHandleTest, self).setUp()
 
-        send_patcher = mock.patch('requests.sessions.Session.send')
-        self.addCleanup(send_patcher.stop)
-        send_mock = send_patcher.start()
-        self._response = mock.Mock()
-        send_mock.return_value = self._response
+        patcher = mock.patch('oslo_vmware.http_pool._HTTPConnection')
+        self.addCleanup(patcher.stop)
+        HTTPConnectionMock = patcher.start()
+        self._conn = HTTPConnectionMock.return_value
+        self._response = self._conn.getresponse.return_value
 
     def _create_mock_session(self, disk=True, progress=-1):
         device_url = mock.Mock()
@@ -227,25 +330,58 @@ class VmdkReadHandleTest(base.TestCase):
     def test_read(self):
         chunk_size = rw_handles.READ_CHUNKSIZE
         session = self._create_mock_session()
-        self._response.raw.read.return_value = [1] * chunk_size
+        self._response.read.return_value = [1] * chunk_size
         handle = rw_handles.VmdkReadHandle(session, '10.1.2.3', 443,
                                            'vm-1', '[ds] disk1.vmdk',
                                            chunk_size * 10)
         handle.read(chunk_size)
         self.assertEqual(chunk_size, handle._bytes_read)
-        self._response.raw.read.assert_called_once_with(chunk_size)
+        self._response.read.assert_called_once_with(chunk_size)
+
+    def test_read_with_chunk_size(self):
+        session = self._create_mock_session()
+        self._response.read.return_value = [1] * 1024
+        handle = rw_handles.VmdkReadHandle(session, '10.1.2.3', 443,
+                                           'vm-1', '[ds] disk1.vmdk',
+                                           1024 * 10)
+        handle.read(1024)
+        self._response.read.assert_called_once_with(1024)
+
+    def test_readinto(self):
+        session = self._create_mock_session()
+        self._response.readinto.return_value = 10
+        handle = rw_handles.VmdkReadHandle(session, '10.1.2.3', 443,
+                                           'vm-1', '[ds] disk1.vmdk',
+                                           100)
+        buf = bytearray(20)
+        self.assertEqual(10, handle.readinto(buf))
+        self.assertEqual(10, handle._bytes_read)
+        self._response.readinto.assert_called_once_with(buf)
+
+    def test_readinto_without_response_readinto(self):
+        session = self._create_mock_session()
+        self._conn.getresponse.return_value = mock.Mock(spec=['read',
+                                                              'close'])
+        self._conn.getresponse.return_value.read.return_value = b'data'
+        handle = rw_handles.VmdkReadHandle(session, '10.1.2.3', 443,
+                                           'vm-1', '[ds] disk1.vmdk',
+                                           100)
+        buf = bytearray(20)
+        self.assertEqual(4, handle.readinto(buf))
+        self.assertEqual(b'data', bytes(buf[:4]))
+        self.assertEqual(4, handle._bytes_read)
 
     def test_update_progress(self):
         chunk_size = rw_handles.READ_CHUNKSIZE
         vmdk_size = chunk_size * 10
         session = self._create_mock_session(True, 10)
-        self._response.raw.read.return_value = [1] * chunk_size
+        self._response.read.return_value = [1] * chunk_size
         handle = rw_handles.VmdkReadHandle(session, '10.1.2.3', 443,
                                            'vm-1', '[ds] disk1.vmdk',
                                            vmdk_size)
         handle.read(chunk_size)
         handle.update_progress()
-        self._response.raw.read.assert_called_once_with(chunk_size)
+        self._response.read.assert_called_once_with(chunk_size)
 
     def test_update_progress_with_error(self):
         session = self._create_mock_session(True, 10)
@@ -273,6 +409,105 @@ class VmdkReadHandleTest(base.TestCase):
         self.assertEqual(2, session.invoke_api.call_count)
 
 
+class FakeRangePool(object):
+    """Serves range requests for the given data."""
+
+    def __init__(self, data, truncate=None, status=206):
+        self.data = data
+        # Offsets at which a response is cut short once.
+        self.truncate = set(truncate or [])
+        self.status = status
+        self.requests = []
+
+    def get(self, scheme, netloc, cacerts=False):
+        conn = mock.Mock()
+        conn.request.side_effect = functools.partial(self._request, conn)
+        return conn
+
+    def _request(self, conn, method, path, headers):
+        self.requests.append(headers['Range'])
+        start, end = headers['Range'][len('bytes='):].split('-')
+        start = int(start)
+        end = int(end) + 1
+        for offset in list(self.truncate):
+            if start <= offset < end:
+                self.truncate.remove(offset)
+                end = offset
+        response = six.BytesIO(self.data[start:end])
+        response.status = self.status
+        conn.getresponse.return_value = response
+
+
+class ParallelFileReadHandleTest(base.TestCase):
+    """Tests for ParallelFileReadHandle."""
+
+    def setUp(self):
+        super(ParallelFileReadHandleTest, self).setUp()
+        self.data = b''.join([six.int2byte(i) * 10 for i in range(10)])[:95]
+        self.http_pool = FakeRangePool(self.data)
+        patcher = mock.patch('oslo_vmware.http_pool.get_default_pool',
+                             return_value=self.http_pool)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def _create_handle(self, **kwargs):
+        handle = rw_handles.ParallelFileReadHandle(
+            'https://host/folder/disk-flat.vmdk?dcPath=dc&dsName=ds',
+            len(self.data), cookie='cookie', connections=3, range_size=10,
+            **kwargs)
+        self.addCleanup(handle.close)
+        return handle
+
+    def test_read(self):
+        handle = self._create_handle()
+        chunks = []
+        while True:
+            data = handle.read(7)
+            if not data:
+                break
+            chunks.append(data)
+        self.assertEqual(self.data, b''.join(chunks))
+        self.assertEqual(10, len(self.http_pool.requests))
+        self.assertIn('bytes=90-94', self.http_pool.requests)
+
+    def test_readinto(self):
+        handle = self._create_handle()
+        received = bytearray()
+        buf = bytearray(16)
+        while True:
+            length = handle.readinto(buf)
+            if not length:
+                break
+            received += buf[:length]
+        self.assertEqual(self.data, bytes(received))
+
+    @mock.patch('eventlet.greenthread.sleep')
+    def test_download_to_with_resumed_range(self, sleep):
+        self.http_pool.truncate = [45]
+        handle = self._create_handle()
+        local_file = six.BytesIO()
+        handle.download_to(local_file)
+
+        self.assertEqual(self.data, local_file.getvalue())
+        # Only the missing part of the range is requested again.
+        self.assertEqual(1, self.http_pool.requests.count('bytes=40-49'))
+        self.assertEqual(1, self.http_pool.requests.count('bytes=45-49'))
+
+    def test_download_to_without_range_support(self):
+        self.http_pool.status = 200
+        handle = self._create_handle()
+        self.assertRaises(exceptions.VimException,
+                          handle.download_to,
+                          six.BytesIO())
+
+    def test_get_headers_with_cookie_factory(self):
+        cookie = mock.Mock(side_effect=['ticket1', 'ticket2'])
+        handle = self._create_handle()
+        handle._cookie = cookie
+        self.assertEqual('ticket1', handle._get_headers(0, 10)['Cookie'])
+        self.assertEqual('ticket2', handle._get_headers(10, 20)['Cookie'])
+
+
 class ImageReadHandleTest(base.TestCase):
     """Tests for ImageReadHandle."""
 
@@ -94,6 +94,22 @@ class ServiceTest(base.TestCase):
         ret = svc_obj.powerOn(managed_object)
         self.assertEqual(resp, ret)
 
+    @mock.patch('oslo_vmware.soap_fastpath.FastPath')
+    def test_request_handler_with_fast_path(self, fast_path_cls):
+        fast_path = fast_path_cls.return_value
+        fast_path.supports.side_effect = lambda name: name == 'powerOn'
+        svc_obj = service.Service(use_fast_path=True)
+
+        ret = svc_obj.powerOn('VirtualMachine', force=True)
+        self.assertEqual(fast_path.invoke.return_value, ret)
+        fast_path_cls.assert_called_once_with(svc_obj.client)
+        fast_path.invoke.assert_called_once_with('powerOn', mock.ANY,
+                                                 force=True)
+
+        svc_obj.powerOff('VirtualMachine')
+        svc_obj.client.service.powerOff.assert_called_once_with(mock.ANY)
+        fast_path_cls.assert_called_once_with(svc_obj.client)
+
     def test_request_handler_with_retrieve_properties_ex_fault(self):
         managed_object = 'Datacenter'
 
@@ -142,6 +158,7 @@ class ServiceTest(base.TestCase):
         self.assertEqual(fault_list, ex.fault_list)
         self.assertEqual({'name': 'value'}, ex.details)
         self.assertEqual("MyFault", ex.msg)
+        self.assertTrue(ex.server_fault)
         doc.childAtPath.assertCalledOnceWith('/detail')
 
     def test_request_handler_with_empty_web_fault_doc(self):
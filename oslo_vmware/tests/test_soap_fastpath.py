@@ -0,0 +1,205 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the SOAP fast path.
+"""
+
+import mock
+from suds import sudsobject
+from suds import transport
+
+from oslo_vmware import exceptions
+from oslo_vmware import soap_fastpath
+from oslo_vmware.tests import base
+from oslo_vmware import vim_util
+
+
+def _reply(body):
+    return (soap_fastpath._ENVELOPE_HEAD + body +
+            soap_fastpath._ENVELOPE_TAIL).encode('utf-8')
+
+
+class SerializeTest(base.TestCase):
+    """Tests for serialize()."""
+
+    def test_serialize_simple_values(self):
+        self.assertEqual('<percent>40</percent>',
+                         soap_fastpath.serialize('percent', 40))
+        self.assertEqual('<skip>false</skip>',
+                         soap_fastpath.serialize('skip', False))
+        self.assertEqual('<token>a&lt;b&amp;c</token>',
+                         soap_fastpath.serialize('token', 'a<b&c'))
+        self.assertEqual('', soap_fastpath.serialize('token', None))
+        self.assertEqual('', soap_fastpath.serialize('token', ''))
+        self.assertEqual('<p>a</p><p>b</p>',
+                         soap_fastpath.serialize('p', ['a', 'b']))
+
+    def test_serialize_moref(self):
+        moref = vim_util.get_moref('vm-"1"', 'VirtualMachine')
+        self.assertEqual('<obj type="VirtualMachine">vm-"1"</obj>',
+                         soap_fastpath.serialize('obj', moref))
+
+    def test_serialize_object(self):
+        sel_spec = sudsobject.Factory.object('SelectionSpec',
+                                             {'name': 'visitFolders'})
+        trav_spec = sudsobject.Factory.object(
+            'TraversalSpec',
+            {'name': 'visitFolders', 'type': 'Folder', 'path': 'childEntity',
+             'skip': False, 'selectSet': [sel_spec]})
+        obj_spec = sudsobject.Factory.object(
+            'ObjectSpec',
+            {'obj': vim_util.get_moref('group-d1', 'Folder'),
+             'skip': False, 'selectSet': [trav_spec]})
+        self.assertEqual(
+            '<objectSet xsi:type="ObjectSpec">'
+            '<obj type="Folder">group-d1</obj><skip>false</skip>'
+            '<selectSet xsi:type="TraversalSpec"><name>visitFolders</name>'
+            '<type>Folder</type><path>childEntity</path><skip>false</skip>'
+            '<selectSet xsi:type="SelectionSpec"><name>visitFolders</name>'
+            '</selectSet></selectSet></objectSet>',
+            soap_fastpath.serialize('objectSet', obj_spec))
+
+    def test_serialize_empty_object(self):
+        options = sudsobject.Factory.object('RetrieveOptions',
+                                            {'maxObjects': None})
+        self.assertEqual('', soap_fastpath.serialize('options', options))
+
+
+class FastPathTest(base.TestCase):
+    """Tests for FastPath."""
+
+    def setUp(self):
+        super(FastPathTest, self).setUp()
+        self.client = mock.Mock()
+        self.client.options.location = 'https://vc/sdk'
+        self.client.options.headers = {}
+        self.methods = {}
+        for name in ['SessionIsActive', 'HttpNfcLeaseProgress',
+                     'RetrievePropertiesEx']:
+            method = mock.Mock()
+            method.soap.action = '"urn:vim25/5.5"'
+            self.methods[name] = method
+        port = mock.Mock(methods=self.methods)
+        self.client.wsdl.services = [mock.Mock(ports=[port])]
+        self.fast_path = soap_fastpath.FastPath(self.client)
+
+    def _set_reply(self, body, code=200, headers=None):
+        if headers is None:
+            headers = {'content-type': 'text/xml; charset=utf-8'}
+        self.client.options.transport.send.return_value = transport.Reply(
+            code, headers, _reply(body))
+
+    def test_supports(self):
+        self.assertTrue(self.fast_path.supports('SessionIsActive'))
+        self.assertFalse(self.fast_path.supports('CancelRetrievePropertiesEx'))
+        self.assertFalse(self.fast_path.supports('Login'))
+
+    def test_invoke_session_is_active(self):
+        self._set_reply('<SessionIsActiveResponse xmlns="urn:vim25">'
+                        '<returnval>true</returnval>'
+                        '</SessionIsActiveResponse>')
+        session_manager = vim_util.get_moref('SessionManager',
+                                             'SessionManager')
+
+        self.assertTrue(self.fast_path.invoke('SessionIsActive',
+                                              session_manager,
+                                              sessionID='123',
+                                              userName='admin'))
+        request = self.client.options.transport.send.call_args[0][0]
+        self.assertEqual('https://vc/sdk', request.url)
+        self.assertEqual('"urn:vim25/5.5"', request.headers['SOAPAction'])
+        self.assertEqual(
+            _reply('<SessionIsActive xmlns="urn:vim25">'
+                   '<_this type="SessionManager">SessionManager</_this>'
+                   '<sessionID>123</sessionID><userName>admin</userName>'
+                   '</SessionIsActive>'),
+            request.message)
+
+    def test_invoke_with_fault(self):
+        self._set_reply(
+            '<soapenv:Fault><faultcode>ServerFaultCode</faultcode>'
+            '<faultstring>The object has already been deleted.</faultstring>'
+            '<detail><ManagedObjectNotFoundFault xmlns="urn:vim25" '
+            'xsi:type="ManagedObjectNotFound"><obj type="HttpNfcLease">'
+            'lease-1</obj></ManagedObjectNotFoundFault></detail>'
+            '</soapenv:Fault>', code=500)
+        lease = vim_util.get_moref('lease-1', 'HttpNfcLease')
+
+        try:
+            self.fast_path.invoke('HttpNfcLeaseProgress', lease, percent=50)
+            self.fail('VimFaultException was not raised.')
+        except exceptions.VimFaultException as excep:
+            self.assertEqual(['ManagedObjectNotFound'], excep.fault_list)
+            self.assertEqual({'obj': 'lease-1'}, excep.details)
+            self.assertIn('already been deleted', excep.msg)
+            self.assertTrue(excep.server_fault)
+            self.assertIsNotNone(excep.cause)
+
+    @mock.patch.object(soap_fastpath, '_UNMARSHAL_SUPPORTED', False)
+    def test_supports_without_unmarshal_support(self):
+        fast_path = soap_fastpath.FastPath(self.client)
+        self.assertTrue(fast_path.supports('SessionIsActive'))
+        self.assertFalse(fast_path.supports('RetrievePropertiesEx'))
+
+    def test_invoke_with_html_reply(self):
+        self._set_reply('', headers={'content-type': 'text/html'})
+        lease = vim_util.get_moref('lease-1', 'HttpNfcLease')
+        self.assertRaises(TypeError,
+                          self.fast_path.invoke,
+                          'HttpNfcLeaseProgress',
+                          lease,
+                          percent=50)
+
+    def test_invoke_with_unexpected_status(self):
+        self._set_reply('', code=503)
+        lease = vim_util.get_moref('lease-1', 'HttpNfcLease')
+        self.assertRaises(exceptions.VimException,
+                          self.fast_path.invoke,
+                          'HttpNfcLeaseProgress',
+                          lease,
+                          percent=50)
+
+    def test_invoke_with_unexpected_argument(self):
+        lease = vim_util.get_moref('lease-1', 'HttpNfcLease')
+        self.assertRaises(TypeError,
+                          self.fast_path.invoke,
+                          'HttpNfcLeaseProgress',
+                          lease,
+                          progress=50)
+        self.assertFalse(self.client.options.transport.send.called)
+
+    def test_invoke_retrieve_properties_ex(self):
+        self._set_reply('<RetrievePropertiesExResponse xmlns="urn:vim25">'
+                        '<returnval><token>1</token></returnval>'
+                        '</RetrievePropertiesExResponse>')
+        method = self.methods['RetrievePropertiesEx']
+        collector = vim_util.get_moref('propertyCollector',
+                                       'PropertyCollector')
+        options = sudsobject.Factory.object('RetrieveOptions',
+                                            {'maxObjects': 100})
+
+        ret = self.fast_path.invoke('RetrievePropertiesEx', collector,
+                                    specSet=[], options=options)
+        self.assertEqual(method.binding.output.get_reply.return_value, ret)
+        reply_root = method.binding.output.get_reply.call_args[0][1]
+        self.assertEqual(
+            '1', reply_root.childAtPath('Envelope/Body/'
+                                        'RetrievePropertiesExResponse/'
+                                        'returnval/token').getText())
+        request = self.client.options.transport.send.call_args[0][0]
+        self.assertIn(b'<options xsi:type="RetrieveOptions">'
+                      b'<maxObjects>100</maxObjects></options>',
+                      request.message)
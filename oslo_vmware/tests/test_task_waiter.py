@@ -0,0 +1,224 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Unit tests for the property collector based task waiter.
+"""
+
+from eventlet import greenthread
+import mock
+
+from oslo_vmware import exceptions
+from oslo_vmware import task_waiter
+from oslo_vmware.tests import base
+from oslo_vmware import vim_util
+
+
+class FakeTaskInfo(object):
+
+    def __init__(self, state, progress=None, error=None):
+        self.state = state
+        if progress is not None:
+            self.progress = progress
+        if error is not None:
+            self.error = error
+
+
+class FakePropertyCollectorServer(object):
+    """Simulates the property collector methods of a vCenter server.
+
+    Each task advances to its next scripted info on every WaitForUpdatesEx
+    call, and the call returns the modified task infos.
+    """
+
+    def __init__(self, task_states):
+        self.task_states = task_states
+        self.filters = {}
+        self.collectors = []
+        self.destroyed_collectors = []
+        self.wait_calls = 0
+        self.wait_errors = []
+        self.version = 0
+
+    def CreatePropertyCollector(self, collector):
+        moref = vim_util.get_moref('session[%d]' % len(self.collectors),
+                                   'PropertyCollector')
+        self.collectors.append(moref)
+        self.filters = {}
+        return moref
+
+    def CreateFilter(self, collector, spec, partialUpdates):
+        task = spec.objectSet[0].obj
+        self.assert_property_spec(spec.propSet[0])
+        prop_filter = vim_util.get_moref('filter-%s' % task.value,
+                                         'PropertyFilter')
+        self.filters[prop_filter.value] = task
+        return prop_filter
+
+    def DestroyPropertyFilter(self, prop_filter):
+        del self.filters[prop_filter.value]
+
+    def DestroyPropertyCollector(self, collector):
+        self.destroyed_collectors.append(collector)
+        self.filters = {}
+
+    def WaitForUpdatesEx(self, collector, version, options):
+        self.wait_calls += 1
+        if self.wait_errors:
+            raise self.wait_errors.pop(0)
+        obj_updates = []
+        for task in list(self.filters.values()):
+            states = self.task_states[task.value]
+            if not states:
+                continue
+            info = states.pop(0)
+            change = mock.Mock(op='assign', val=info)
+            change.name = task_waiter.TASK_INFO_PROPERTY
+            obj_updates.append(mock.Mock(obj=task, kind='modify',
+                                         changeSet=[change]))
+        if not obj_updates:
+            return None
+        self.version += 1
+        return mock.Mock(version=str(self.version),
+                         filterSet=[mock.Mock(objectSet=obj_updates)])
+
+    @staticmethod
+    def assert_property_spec(prop_spec):
+        assert prop_spec.type == task_waiter.TASK_TYPE
+        assert prop_spec.pathSet == [task_waiter.TASK_INFO_PROPERTY]
+
+
+class TaskWaiterTest(base.TestCase):
+    """Tests for TaskWaiter."""
+
+    def _create_session(self, server):
+        vim = mock.Mock()
+        vim.client.factory.create.side_effect = lambda ns: mock.Mock()
+        for method in ['CreatePropertyCollector', 'CreateFilter',
+                       'DestroyPropertyFilter', 'DestroyPropertyCollector',
+                       'WaitForUpdatesEx']:
+            setattr(vim, method, getattr(server, method))
+        session = mock.Mock()
+        session.vim = vim
+
+        def invoke_api(module, method, *args, **kwargs):
+            return getattr(module, method)(*args, **kwargs)
+
+        session.invoke_api.side_effect = invoke_api
+        return session
+
+    def _task(self, value):
+        return vim_util.get_moref(value, 'Task')
+
+    def test_wait(self):
+        states = {'task-1': [FakeTaskInfo('queued'),
+                             FakeTaskInfo('running', progress=40),
+                             FakeTaskInfo('success', progress=100)]}
+        server = FakePropertyCollectorServer(states)
+        waiter = task_waiter.TaskWaiter(self._create_session(server))
+
+        task_info = waiter.wait(self._task('task-1'))
+        self.assertEqual('success', task_info.state)
+        self.assertEqual(3, server.wait_calls)
+        self.assertEqual(1, len(server.collectors))
+        self.assertEqual({}, server.filters)
+
+    def test_wait_concurrent_tasks(self):
+        task_count = 20
+        states = {}
+        for i in range(task_count):
+            states['task-%d' % i] = [FakeTaskInfo('running', progress=50),
+                                     FakeTaskInfo('success')]
+        server = FakePropertyCollectorServer(states)
+        waiter = task_waiter.TaskWaiter(self._create_session(server))
+
+        threads = [greenthread.spawn(waiter.wait, self._task(value))
+                   for value in states]
+        results = [thread.wait() for thread in threads]
+        self.assertEqual(['success'] * task_count,
+                         [result.state for result in results])
+        # All the waiters share one collector and a few long-polls.
+        self.assertEqual(1, len(server.collectors))
+        self.assertTrue(server.wait_calls < task_count)
+
+    def test_wait_same_task_twice(self):
+        states = {'task-1': [FakeTaskInfo('running'),
+                             FakeTaskInfo('success')]}
+        server = FakePropertyCollectorServer(states)
+        session = self._create_session(server)
+        waiter = task_waiter.TaskWaiter(session)
+
+        task = self._task('task-1')
+        threads = [greenthread.spawn(waiter.wait, task) for i in range(2)]
+        results = [thread.wait() for thread in threads]
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(1, session.invoke_api.mock_calls.count(
+            mock.call(vim_util, 'create_filter', session.vim, mock.ANY,
+                      server.collectors[0])))
+
+    def test_wait_with_error_state(self):
+        class FileNotFound(object):
+            pass
+
+        error = mock.Mock()
+        error.localizedMessage = 'File not found.'
+        error.fault = FileNotFound()
+        states = {'task-1': [FakeTaskInfo('error', error=error)]}
+        server = FakePropertyCollectorServer(states)
+        waiter = task_waiter.TaskWaiter(self._create_session(server))
+
+        self.assertRaises(exceptions.FileNotFoundException,
+                          waiter.wait,
+                          self._task('task-1'))
+        self.assertEqual({}, server.filters)
+
+    def test_wait_recovers_from_wait_for_updates_error(self):
+        states = {'task-1': [FakeTaskInfo('success')]}
+        server = FakePropertyCollectorServer(states)
+        server.wait_errors = [exceptions.VimFaultException(
+            ['ManagedObjectNotFound'], 'collector not found')]
+        waiter = task_waiter.TaskWaiter(self._create_session(server))
+
+        task_info = waiter.wait(self._task('task-1'))
+        self.assertEqual('success', task_info.state)
+        self.assertEqual(2, len(server.collectors))
+        self.assertEqual(server.collectors[:1], server.destroyed_collectors)
+        self.assertEqual(2, server.wait_calls)
+
+    def test_wait_with_persistent_wait_for_updates_error(self):
+        states = {'task-1': [FakeTaskInfo('success')]}
+        server = FakePropertyCollectorServer(states)
+        server.wait_errors = [exceptions.VimConnectionException('error'),
+                              exceptions.VimConnectionException('error')]
+        waiter = task_waiter.TaskWaiter(self._create_session(server))
+
+        self.assertRaises(exceptions.VimConnectionException,
+                          waiter.wait,
+                          self._task('task-1'))
+        self.assertEqual({}, waiter._entries)
+        self.assertEqual(server.collectors, server.destroyed_collectors)
+
+    def test_wait_with_create_filter_error(self):
+        server = FakePropertyCollectorServer({})
+        session = self._create_session(server)
+        session.vim.CreateFilter = mock.Mock(
+            side_effect=exceptions.VimConnectionException('error'))
+        waiter = task_waiter.TaskWaiter(session)
+
+        self.assertRaises(exceptions.VimConnectionException,
+                          waiter.wait,
+                          self._task('task-1'))
+        self.assertEqual({}, waiter._entries)
+        self.assertIsNone(waiter._thread)
@@ -18,9 +18,11 @@ Unit tests for VMware API utility module.
 """
 
 import collections
+import gc
 
 import mock
 
+from oslo_vmware import exceptions
 from oslo_vmware.tests import base
 from oslo_vmware import vim_util
 
@@ -210,6 +212,137 @@ class VimUtilTest(base.TestCase):
         vim_util.get_objects(vim, _type, max_objects)
         self.assertEqual(1, vim.RetrievePropertiesEx.call_count)
 
+    @mock.patch(
+        'oslo_vmware.vim_util.build_recursive_traversal_spec')
+    def test_get_objects_reuses_specs(self, build_recursive_traversal_spec):
+        vim = mock.Mock()
+        vim.client.factory.create.side_effect = lambda ns: mock.Mock()
+        vim_util.get_objects(vim, 'VirtualMachine', 10)
+        vim_util.get_objects(vim, 'VirtualMachine', 20)
+        vim_util.get_objects(vim, 'HostSystem', 10,
+                             properties_to_collect=['name', 'runtime'])
+
+        self.assertEqual(1, build_recursive_traversal_spec.call_count)
+        spec_sets = [call[2]['specSet'] for call in
+                     vim.RetrievePropertiesEx.mock_calls]
+        self.assertIs(spec_sets[0][0], spec_sets[1][0])
+        self.assertIsNot(spec_sets[0][0], spec_sets[2][0])
+        self.assertIs(spec_sets[0][0].objectSet[0],
+                      spec_sets[2][0].objectSet[0])
+        self.assertEqual(['name', 'runtime'],
+                         spec_sets[2][0].propSet[0].pathSet)
+        options = [call[2]['options'] for call in
+                   vim.RetrievePropertiesEx.mock_calls]
+        self.assertEqual([10, 20, 10],
+                         [option.maxObjects for option in options])
+
+    def test_get_property_spec(self):
+        client_factory = mock.Mock()
+        client_factory.create.side_effect = lambda ns: mock.Mock()
+        prop_spec = vim_util.get_property_spec(client_factory, 'Datastore',
+                                               ['summary'])
+        self.assertEqual('Datastore', prop_spec.type)
+        self.assertEqual(['summary'], prop_spec.pathSet)
+        self.assertIs(prop_spec,
+                      vim_util.get_property_spec(client_factory, 'Datastore',
+                                                 ['summary']))
+        self.assertIsNot(prop_spec,
+                         vim_util.get_property_spec(mock.Mock(), 'Datastore',
+                                                    ['summary']))
+
+    @mock.patch.object(vim_util, 'SPEC_CACHE_SIZE', 2)
+    def test_get_property_spec_with_full_cache(self):
+        client_factory = mock.Mock()
+        client_factory.create.side_effect = lambda ns: mock.Mock()
+        for prop in ['name', 'summary', 'runtime']:
+            vim_util.get_property_spec(client_factory, 'Datastore', [prop])
+        self.assertEqual(1, len(vim_util._spec_cache[client_factory]))
+
+    @mock.patch('oslo_vmware.vim_util.continue_retrieval')
+    def test_iter_retrieve_result(self, continue_retrieval):
+        vim = mock.Mock()
+        first_page = mock.Mock(objects=['obj-1', 'obj-2'])
+        second_page = mock.Mock(objects=['obj-3'])
+        continue_retrieval.side_effect = [second_page, None]
+
+        objects = vim_util.iter_retrieve_result(vim, first_page)
+        self.assertEqual('obj-1', next(objects))
+        self.assertFalse(continue_retrieval.called)
+        self.assertEqual(['obj-2', 'obj-3'], list(objects))
+        continue_retrieval.assert_has_calls([mock.call(vim, first_page),
+                                             mock.call(vim, second_page)])
+
+    def test_iter_retrieve_result_with_invoke(self):
+        vim = mock.Mock()
+        first_page = mock.Mock(objects=['obj-1'])
+        invoke = mock.Mock(return_value=None)
+
+        objects = vim_util.iter_retrieve_result(vim, first_page,
+                                                invoke=invoke)
+        self.assertEqual(['obj-1'], list(objects))
+        invoke.assert_called_once_with('continue_retrieval', vim,
+                                       first_page)
+
+    @mock.patch('oslo_vmware.vim_util.cancel_retrieval')
+    @mock.patch('oslo_vmware.vim_util.continue_retrieval')
+    def test_iter_retrieve_result_stopped_early(self, continue_retrieval,
+                                                cancel_retrieval):
+        vim = mock.Mock()
+        first_page = mock.Mock(objects=['obj-1', 'obj-2'])
+
+        objects = vim_util.iter_retrieve_result(vim, first_page)
+        for obj in objects:
+            break
+        objects.close()
+        objects.close()
+        self.assertFalse(continue_retrieval.called)
+        cancel_retrieval.assert_called_once_with(vim, first_page)
+        self.assertEqual([], list(objects))
+
+    @mock.patch('oslo_vmware.vim_util.cancel_retrieval')
+    def test_iter_retrieve_result_abandoned(self, cancel_retrieval):
+        vim = mock.Mock()
+        first_page = mock.Mock(objects=['obj-1', 'obj-2'])
+
+        for obj in vim_util.iter_retrieve_result(vim, first_page):
+            break
+        gc.collect()
+        cancel_retrieval.assert_called_once_with(vim, first_page)
+
+    @mock.patch('oslo_vmware.vim_util.cancel_retrieval')
+    def test_iter_retrieve_result_abandoned_with_cancel_error(
+            self, cancel_retrieval):
+        cancel_retrieval.side_effect = exceptions.VimException('error')
+        vim_util.iter_retrieve_result(mock.Mock(), mock.Mock(objects=[]))
+        gc.collect()
+        self.assertTrue(cancel_retrieval.called)
+
+    @mock.patch('oslo_vmware.vim_util.cancel_retrieval')
+    def test_iter_retrieve_result_closed_before_start(self, cancel_retrieval):
+        vim = mock.Mock()
+        retrieve_result = mock.Mock(objects=['obj-1'])
+        with vim_util.iter_retrieve_result(vim, retrieve_result):
+            pass
+        cancel_retrieval.assert_called_once_with(vim, retrieve_result)
+
+    @mock.patch('oslo_vmware.vim_util.cancel_retrieval')
+    @mock.patch('oslo_vmware.vim_util.continue_retrieval')
+    def test_iter_retrieve_result_exhausted(self, continue_retrieval,
+                                            cancel_retrieval):
+        vim = mock.Mock()
+        retrieve_result = mock.Mock(objects=['obj-1'])
+        continue_retrieval.return_value = None
+        with vim_util.iter_retrieve_result(vim, retrieve_result) as objects:
+            self.assertEqual(['obj-1'], list(objects))
+        continue_retrieval.assert_called_once_with(vim, retrieve_result)
+        self.assertFalse(cancel_retrieval.called)
+
+    @mock.patch('oslo_vmware.vim_util.cancel_retrieval')
+    def test_iter_retrieve_result_with_empty_result(self, cancel_retrieval):
+        vim = mock.Mock()
+        self.assertEqual([], list(vim_util.iter_retrieve_result(vim, [])))
+        self.assertFalse(cancel_retrieval.called)
+
     def test_get_object_properties_with_empty_moref(self):
         vim = mock.Mock()
         ret = vim_util.get_object_properties(vim, None, None)
@@ -253,6 +386,90 @@ class VimUtilTest(base.TestCase):
         self.assertTrue(res is retrieve_result.objects)
         cancel_retrieval.assert_called_once_with(vim, retrieve_result)
 
+    def test_get_properties_for_managed_objects_with_no_morefs(self):
+        vim = mock.Mock()
+        ret = vim_util.get_properties_for_managed_objects(
+            vim, 'HostSystem', [], ['name'])
+        self.assertEqual({}, ret)
+        self.assertFalse(vim.RetrievePropertiesEx.called)
+
+    @mock.patch('oslo_vmware.vim_util.continue_retrieval')
+    def test_get_properties_for_managed_objects(self, continue_retrieval):
+        vim = mock.Mock()
+        vim.client.factory.create.side_effect = lambda ns: mock.Mock()
+        morefs = [vim_util.get_moref('host-%d' % i, 'HostSystem')
+                  for i in range(3)]
+        DynamicProperty = collections.namedtuple('Property', ['name', 'val'])
+
+        def obj_content(moref, name):
+            return mock.Mock(obj=moref,
+                             propSet=[DynamicProperty('name', name)])
+
+        first_page = mock.Mock(objects=[obj_content(morefs[0], 'h0'),
+                                        obj_content(morefs[1], 'h1')])
+        second_page = mock.Mock(objects=[mock.Mock(obj=morefs[2],
+                                                   spec=['obj'])])
+        continue_retrieval.side_effect = [second_page, None]
+
+        def vim_RetrievePropertiesEx_side_effect(pc, specSet, options):
+            self.assertTrue(pc is vim.service_content.propertyCollector)
+            self.assertEqual(3, options.maxObjects)
+            self.assertEqual(1, len(specSet))
+            property_filter_spec = specSet[0]
+            prop_spec = property_filter_spec.propSet[0]
+            self.assertEqual('HostSystem', prop_spec.type)
+            self.assertEqual(['name'], prop_spec.pathSet)
+            self.assertEqual(morefs, [obj_spec.obj for obj_spec in
+                                      property_filter_spec.objectSet])
+            return first_page
+
+        vim.RetrievePropertiesEx.side_effect = \
+            vim_RetrievePropertiesEx_side_effect
+        ret = vim_util.get_properties_for_managed_objects(
+            vim, 'HostSystem', morefs, ['name'])
+        self.assertEqual({'host-0': {'name': 'h0'},
+                          'host-1': {'name': 'h1'},
+                          'host-2': {}}, ret)
+        self.assertEqual(1, vim.RetrievePropertiesEx.call_count)
+        continue_retrieval.assert_has_calls([mock.call(vim, first_page),
+                                             mock.call(vim, second_page)])
+
+    def test_get_datastore_and_host_properties(self):
+        vim = mock.Mock()
+        vim.client.factory.create.side_effect = lambda ns: mock.Mock()
+        ds_ref = vim_util.get_moref('ds-0', 'Datastore')
+        host_ref = vim_util.get_moref('host-0', 'HostSystem')
+        DynamicProperty = collections.namedtuple('Property', ['name', 'val'])
+        result = mock.Mock(
+            spec=['objects'],
+            objects=[mock.Mock(obj=ds_ref,
+                               propSet=[DynamicProperty('host', 'mounts')]),
+                     mock.Mock(obj=host_ref,
+                               propSet=[DynamicProperty('name', 'esx0')])])
+
+        def vim_RetrievePropertiesEx_side_effect(pc, specSet, options):
+            self.assertIs(vim.service_content.propertyCollector, pc)
+            self.assertEqual(1, len(specSet))
+            property_filter_spec = specSet[0]
+            self.assertEqual(
+                [('Datastore', ['host']), ('HostSystem', ['name'])],
+                [(prop_spec.type, prop_spec.pathSet)
+                 for prop_spec in property_filter_spec.propSet])
+            obj_spec, = property_filter_spec.objectSet
+            self.assertEqual(ds_ref, obj_spec.obj)
+            traversal_spec, = obj_spec.selectSet
+            self.assertEqual('Datastore', traversal_spec.type)
+            self.assertEqual('host', traversal_spec.path)
+            return result
+
+        vim.RetrievePropertiesEx.side_effect = \
+            vim_RetrievePropertiesEx_side_effect
+        ret = vim_util.get_datastore_and_host_properties(vim, ds_ref,
+                                                         ['host'], ['name'])
+        self.assertEqual({'ds-0': {'host': 'mounts'},
+                          'host-0': {'name': 'esx0'}}, ret)
+        self.assertEqual(1, vim.RetrievePropertiesEx.call_count)
+
     def test_get_token(self):
         retrieve_result = object()
         self.assertFalse(vim_util._get_token(retrieve_result))
@@ -295,6 +512,65 @@ class VimUtilTest(base.TestCase):
         get_object_properties.assert_called_once_with(
             vim, moref, [property_name])
 
+    def test_create_property_collector(self):
+        vim = mock.Mock()
+        ret = vim_util.create_property_collector(vim)
+        self.assertEqual(vim.CreatePropertyCollector.return_value, ret)
+        vim.CreatePropertyCollector.assert_called_once_with(
+            vim.service_content.propertyCollector)
+
+    def test_destroy_property_collector(self):
+        vim = mock.Mock()
+        collector = mock.Mock()
+        vim_util.destroy_property_collector(vim, collector)
+        vim.DestroyPropertyCollector.assert_called_once_with(collector)
+
+    def test_create_filter(self):
+        vim = mock.Mock()
+        spec = mock.Mock()
+        collector = mock.Mock()
+        ret = vim_util.create_filter(vim, spec, collector)
+        self.assertEqual(vim.CreateFilter.return_value, ret)
+        vim.CreateFilter.assert_called_once_with(collector,
+                                                 spec=spec,
+                                                 partialUpdates=False)
+
+    def test_destroy_filter(self):
+        vim = mock.Mock()
+        prop_filter = mock.Mock()
+        vim_util.destroy_filter(vim, prop_filter)
+        vim.DestroyPropertyFilter.assert_called_once_with(prop_filter)
+
+    def test_wait_for_updates_ex(self):
+        vim = mock.Mock()
+        wait_options = mock.Mock(spec=[])
+        vim.client.factory.create.return_value = wait_options
+        ret = vim_util.wait_for_updates_ex(vim, '1', max_wait=30)
+        self.assertEqual(vim.WaitForUpdatesEx.return_value, ret)
+        vim.client.factory.create.assert_called_once_with('ns0:WaitOptions')
+        self.assertEqual(30, wait_options.maxWaitSeconds)
+        self.assertFalse(hasattr(wait_options, 'maxObjectUpdates'))
+        vim.WaitForUpdatesEx.assert_called_once_with(
+            vim.service_content.propertyCollector,
+            version='1',
+            options=wait_options)
+
+    def test_wait_for_updates_ex_with_max_update_count(self):
+        vim = mock.Mock()
+        collector = mock.Mock()
+        vim_util.wait_for_updates_ex(vim, '', collector=collector,
+                                     max_update_count=100)
+        wait_options = vim.client.factory.create.return_value
+        self.assertEqual(100, wait_options.maxObjectUpdates)
+        vim.WaitForUpdatesEx.assert_called_once_with(
+            collector, version='', options=wait_options)
+
+    def test_cancel_wait_for_updates(self):
+        vim = mock.Mock()
+        vim_util.cancel_wait_for_updates(vim)
+        vim.CancelWaitForUpdates.assert_called_once_with(
+            vim.service_content.propertyCollector)
+
     def test_find_extension(self):
         vim = mock.Mock()
         ret = vim_util.find_extension(vim, 'fake-key')
@@ -20,7 +20,8 @@ class Vim(service.Service):
     """Service class that provides access to the VIM API."""
 
     def __init__(self, protocol='https', host='localhost', port=None,
-                 wsdl_url=None, cacert=None, insecure=True):
+                 wsdl_url=None, cacert=None, insecure=True,
+                 use_fast_path=False):
         """Constructs a VIM service client object.
 
         :param protocol: http or https
@@ -31,6 +32,8 @@ class Vim(service.Service):
                        TLS (https) server certificate.
         :param insecure: Verify HTTPS connections using system certificates,
                          used only if cacert is not specified
+        :param use_fast_path: whether to invoke the most frequently used
+                              methods using pre-compiled SOAP envelopes
         :raises: VimException, VimFaultException, VimAttributeException,
                  VimSessionOverLoadException, VimConnectionException
         """
@@ -38,7 +41,8 @@ class Vim(service.Service):
         soap_url = base_url + '/sdk'
         if wsdl_url is None:
             wsdl_url = soap_url + '/vimService.wsdl'
-        super(Vim, self).__init__(wsdl_url, soap_url, cacert, insecure)
+        super(Vim, self).__init__(wsdl_url, soap_url, cacert, insecure,
+                                  use_fast_path)
 
     def retrieve_service_content(self):
         return self.RetrieveServiceContent(service.SERVICE_INSTANCE)
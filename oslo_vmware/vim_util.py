@@ -17,11 +17,24 @@
 The VMware API utility module.
 """
 
+import functools
+import logging
+import weakref
+
 from suds import sudsobject
 
 from oslo.utils import timeutils
 
 
+LOG = logging.getLogger(__name__)
+
+# Prebuilt specs keyed by client factory and spec shape. The specs are only
+# read while marshalling the requests, hence they are shared by the callers.
+_spec_cache = weakref.WeakKeyDictionary()
+# Maximum number of specs cached per client factory.
+SPEC_CACHE_SIZE = 256
+
+
 def get_moref(value, type_):
     """Get managed object reference.
 
@@ -187,6 +200,82 @@ def build_recursive_traversal_spec(client_factory):
     return traversal_spec
 
 
+def _get_cached_spec(client_factory, key, build_spec):
+    """Returns the cached spec for the given key, building it on a miss."""
+    specs = _spec_cache.get(client_factory)
+    if specs is None:
+        specs = {}
+        _spec_cache[client_factory] = specs
+    spec = specs.get(key)
+    if spec is None:
+        if len(specs) >= SPEC_CACHE_SIZE:
+            specs.clear()
+        spec = build_spec()
+        specs[key] = spec
+    return spec
+
+
+def get_recursive_traversal_spec(client_factory):
+    """Returns the shared recursive traversal spec of the client factory.
+
+    The spec is built once per client factory; callers must not modify it.
+
+    :param client_factory: factory to get API input specs
+    :returns: recursive traversal spec
+    """
+    return _get_cached_spec(
+        client_factory,
+        ('TraversalSpec', 'visitFolders'),
+        lambda: build_recursive_traversal_spec(client_factory))
+
+
+def get_property_spec(client_factory, type_='VirtualMachine',
+                      properties_to_collect=None, all_properties=False):
+    """Returns a shared property spec for the given managed object type.
+
+    The spec is built once per client factory and spec shape; callers must
+    not modify it.
+
+    :param client_factory: factory to get API input specs
+    :param type_: type of the managed object
+    :param properties_to_collect: names of the managed object properties to be
+                                  collected while traversal filtering
+    :param all_properties: whether all properties of the managed object need
+                           to be collected
+    :returns: property spec
+    """
+    if not properties_to_collect:
+        properties_to_collect = ['name']
+    return _get_cached_spec(
+        client_factory,
+        ('PropertySpec', type_, tuple(properties_to_collect),
+         bool(all_properties)),
+        lambda: build_property_spec(client_factory,
+                                    type_=type_,
+                                    properties_to_collect=list(
+                                        properties_to_collect),
+                                    all_properties=all_properties))
+
+
+def get_recursive_object_spec(client_factory, root_folder):
+    """Returns a shared object spec traversing the inventory from the root.
+
+    The spec is built once per client factory and root folder; callers must
+    not modify it.
+
+    :param client_factory: factory to get API input specs
+    :param root_folder: root folder reference; the starting point of traversal
+    :returns: object spec
+    """
+    return _get_cached_spec(
+        client_factory,
+        ('ObjectSpec', root_folder.value),
+        lambda: build_object_spec(
+            client_factory,
+            root_folder,
+            [get_recursive_traversal_spec(client_factory)]))
+
+
 def build_property_spec(client_factory, type_='VirtualMachine',
                         properties_to_collect=None, all_properties=False):
     """Builds the property spec.
@@ -260,18 +349,24 @@ def get_objects(vim, type_, max_objects, properties_to_collect=None,
         properties_to_collect = ['name']
 
     client_factory = vim.client.factory
-    recur_trav_spec = build_recursive_traversal_spec(client_factory)
-    object_spec = build_object_spec(client_factory,
-                                    vim.service_content.rootFolder,
-                                    [recur_trav_spec])
-    property_spec = build_property_spec(
+    root_folder = vim.service_content.rootFolder
+
+    def _build_property_filter_spec():
+        object_spec = get_recursive_object_spec(client_factory, root_folder)
+        property_spec = get_property_spec(
+            client_factory,
+            type_=type_,
+            properties_to_collect=properties_to_collect,
+            all_properties=all_properties)
+        return build_property_filter_spec(client_factory,
+                                          [property_spec],
+                                          [object_spec])
+
+    property_filter_spec = _get_cached_spec(
         client_factory,
-        type_=type_,
-        properties_to_collect=properties_to_collect,
-        all_properties=all_properties)
-    property_filter_spec = build_property_filter_spec(client_factory,
-                                                      [property_spec],
-                                                      [object_spec])
+        ('PropertyFilterSpec', root_folder.value, type_,
+         tuple(properties_to_collect), bool(all_properties)),
+        _build_property_filter_spec)
     options = client_factory.create('ns0:RetrieveOptions')
     options.maxObjects = max_objects
     return vim.RetrievePropertiesEx(vim.service_content.propertyCollector,
@@ -279,6 +374,90 @@ def get_objects(vim, type_, max_objects, properties_to_collect=None,
                                     options=options)
 
 
+def iter_retrieve_result(vim, retrieve_result, invoke=None):
+    """Iterate over the objects of a RetrievePropertiesEx result.
+
+    :param vim: Vim object
+    :param retrieve_result: result of RetrievePropertiesEx API call
+    :param invoke: callable invoking the function of this module with the
+                   given name and arguments, for e.g.,
+                   functools.partial(session.invoke_api, vim_util); if None,
+                   the functions are called directly
+    :returns: RetrieveResultIterator over the ObjectContent data objects in
+              the result
+    """
+    return RetrieveResultIterator(vim, retrieve_result, invoke=invoke)
+
+
+class RetrieveResultIterator(object):
+    """Iterator over the objects of a RetrievePropertiesEx result.
+
+    The next page of the result is retrieved only when the objects of the
+    current page have been consumed. If the iterator is closed or garbage
+    collected before it is exhausted, the retrieval is cancelled, whether
+    or not the iteration has started. The iterator can also be used as a
+    context manager to close it.
+    """
+
+    def __init__(self, vim, retrieve_result, invoke=None):
+        """Initializes the iterator.
+
+        :param vim: Vim object
+        :param retrieve_result: result of RetrievePropertiesEx API call
+        :param invoke: callable invoking the function of this module with
+                       the given name and arguments; if None, the
+                       functions are called directly
+        """
+        if invoke is None:
+            self._continue = functools.partial(continue_retrieval, vim)
+            self._cancel = functools.partial(cancel_retrieval, vim)
+        else:
+            self._continue = functools.partial(invoke, 'continue_retrieval',
+                                               vim)
+            self._cancel = functools.partial(invoke, 'cancel_retrieval', vim)
+        self._retrieve_result = retrieve_result or None
+        self._objects = iter(retrieve_result.objects if retrieve_result
+                             else [])
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while True:
+            for obj_content in self._objects:
+                return obj_content
+            if self._retrieve_result is None:
+                raise StopIteration
+            self._retrieve_result = (
+                self._continue(self._retrieve_result) or None)
+            self._objects = iter(self._retrieve_result.objects
+                                 if self._retrieve_result else [])
+
+    next = __next__
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __del__(self):
+        # Same as the finalization of a generator abandoned by its caller.
+        try:
+            self.close()
+        except Exception:
+            LOG.debug("Error occurred while cancelling the retrieval.",
+                      exc_info=True)
+
+    def close(self):
+        """Cancel the retrieval if the result is not exhausted."""
+        retrieve_result = self._retrieve_result
+        self._retrieve_result = None
+        self._objects = iter([])
+        if retrieve_result is not None:
+            self._cancel(retrieve_result)
+
+
 def get_object_properties(vim, moref, properties_to_collect):
     """Get properties of the given managed object.
 
@@ -316,6 +495,107 @@ def get_object_properties(vim, moref, properties_to_collect):
     return retrieve_result.objects
 
 
+def get_properties_for_managed_objects(vim, type_, morefs,
+                                       properties_to_collect,
+                                       max_objects=None):
+    """Get properties of a collection of managed objects of the same type.
+
+    The properties of all the objects are retrieved using a single property
+    filter spec; the result pages are retrieved until the result is
+    complete.
+
+    :param vim: Vim object
+    :param type_: type of the managed objects
+    :param morefs: managed object references of the objects
+    :param properties_to_collect: names of the managed object properties to be
+                                  collected
+    :param max_objects: maximum number of objects that should be returned in
+                        a single call; defaults to the number of objects
+    :returns: dict mapping managed object reference values to dicts of
+              property names and values
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    if not morefs:
+        return {}
+
+    client_factory = vim.client.factory
+    property_spec = build_property_spec(
+        client_factory,
+        type_=type_,
+        properties_to_collect=properties_to_collect)
+    object_specs = [build_object_spec(client_factory, moref, [])
+                    for moref in morefs]
+    property_filter_spec = build_property_filter_spec(client_factory,
+                                                      [property_spec],
+                                                      object_specs)
+    options = client_factory.create('ns0:RetrieveOptions')
+    options.maxObjects = max_objects or len(morefs)
+    retrieve_result = vim.RetrievePropertiesEx(
+        vim.service_content.propertyCollector,
+        specSet=[property_filter_spec],
+        options=options)
+
+    properties = {}
+    for obj_content in iter_retrieve_result(vim, retrieve_result):
+        props = {}
+        for prop in getattr(obj_content, 'propSet', None) or []:
+            props[prop.name] = prop.val
+        properties[obj_content.obj.value] = props
+    return properties
+
+
+def get_datastore_and_host_properties(vim, ds_ref, ds_properties,
+                                      host_properties, max_objects=None):
+    """Get properties of a datastore and of the hosts mounting it.
+
+    The properties of the datastore and of its hosts are retrieved using a
+    single property filter spec, which traverses the host property of the
+    datastore to the hosts; the result pages are retrieved until the
+    result is complete.
+
+    :param vim: Vim object
+    :param ds_ref: managed object reference of the datastore
+    :param ds_properties: names of the datastore properties to be collected
+    :param host_properties: names of the host properties to be collected
+    :param max_objects: maximum number of objects that should be returned in
+                        a single call; no limit is set by default
+    :returns: dict mapping the managed object reference values of the
+              datastore and its hosts to dicts of property names and values
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    client_factory = vim.client.factory
+    ds_property_spec = build_property_spec(
+        client_factory,
+        type_='Datastore',
+        properties_to_collect=ds_properties)
+    host_property_spec = build_property_spec(
+        client_factory,
+        type_='HostSystem',
+        properties_to_collect=host_properties)
+    ds_to_host = build_traversal_spec(client_factory, 'ds_to_host',
+                                      'Datastore', 'host', False, [])
+    object_spec = build_object_spec(client_factory, ds_ref, [ds_to_host])
+    property_filter_spec = build_property_filter_spec(
+        client_factory, [ds_property_spec, host_property_spec], [object_spec])
+    options = client_factory.create('ns0:RetrieveOptions')
+    if max_objects:
+        options.maxObjects = max_objects
+    retrieve_result = vim.RetrievePropertiesEx(
+        vim.service_content.propertyCollector,
+        specSet=[property_filter_spec],
+        options=options)
+
+    properties = {}
+    for obj_content in iter_retrieve_result(vim, retrieve_result):
+        props = {}
+        for prop in getattr(obj_content, 'propSet', None) or []:
+            props[prop.name] = prop.val
+        properties[obj_content.obj.value] = props
+    return properties
+
+
 def _get_token(retrieve_result):
     """Get token from result to obtain next set of results.
 
@@ -376,6 +656,104 @@ def get_object_property(vim, moref, property_name):
     return prop_val
 
 
+def create_property_collector(vim, collector=None):
+    """Create a new property collector.
+
+    Filters created on a dedicated property collector do not clash with the
+    filters created by other users of the session's default collector.
+
+    :param vim: Vim object
+    :param collector: property collector used to create the new collector;
+                      the default property collector is used if None
+    :returns: managed object reference of the new property collector
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    collector = collector or vim.service_content.propertyCollector
+    return vim.CreatePropertyCollector(collector)
+
+
+def destroy_property_collector(vim, collector):
+    """Destroy the given property collector and all of its filters.
+
+    :param vim: Vim object
+    :param collector: property collector to be destroyed
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    vim.DestroyPropertyCollector(collector)
+
+
+def create_filter(vim, prop_filter_spec, collector=None):
+    """Create a property filter on the given property collector.
+
+    :param vim: Vim object
+    :param prop_filter_spec: property filter spec
+    :param collector: property collector to create the filter on; the
+                      default property collector is used if None
+    :returns: managed object reference of the property filter
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    collector = collector or vim.service_content.propertyCollector
+    return vim.CreateFilter(collector,
+                            spec=prop_filter_spec,
+                            partialUpdates=False)
+
+
+def destroy_filter(vim, prop_filter):
+    """Destroy the given property filter.
+
+    :param vim: Vim object
+    :param prop_filter: property filter to be destroyed
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    vim.DestroyPropertyFilter(prop_filter)
+
+
+def wait_for_updates_ex(vim, version, collector=None, max_wait=85,
+                        max_update_count=-1):
+    """Wait for updates of the filters on the given property collector.
+
+    :param vim: Vim object
+    :param version: data version returned by the previous call; an empty
+                    string requests the initial state of all the filters
+    :param collector: property collector whose filters are checked for
+                      updates; the default property collector is used if None
+    :param max_wait: maximum time in seconds the server waits for updates
+                     before returning an empty result
+    :param max_update_count: maximum number of object updates returned in
+                             one call; no limit is set if less than 1
+    :returns: UpdateSet data object or None if there are no updates before
+              max_wait seconds
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    client_factory = vim.client.factory
+    wait_options = client_factory.create('ns0:WaitOptions')
+    wait_options.maxWaitSeconds = max_wait
+    if max_update_count > 0:
+        wait_options.maxObjectUpdates = max_update_count
+    collector = collector or vim.service_content.propertyCollector
+    return vim.WaitForUpdatesEx(collector,
+                                version=version,
+                                options=wait_options)
+
+
+def cancel_wait_for_updates(vim, collector=None):
+    """Cancel a pending WaitForUpdatesEx call on the given collector.
+
+    :param vim: Vim object
+    :param collector: property collector; the default property collector is
+                      used if None
+    :raises: VimException, VimFaultException, VimAttributeException,
+             VimSessionOverLoadException, VimConnectionException
+    """
+    collector = collector or vim.service_content.propertyCollector
+    vim.CancelWaitForUpdates(collector)
+
+
 def find_extension(vim, key):
     """Looks for an existing extension.
 
@@ -455,15 +833,13 @@ def get_inventory_path(vim, entity_ref, max_objects=100):
     entity_name = None
     propSet = None
     path = ""
-    while retrieve_result:
-        for obj in retrieve_result.objects:
-            if hasattr(obj, 'propSet'):
-                propSet = obj.propSet
-                if len(propSet) >= 1 and not entity_name:
-                    entity_name = propSet[0].val
-                elif len(propSet) >= 1:
-                    path = '%s/%s' % (propSet[0].val, path)
-        retrieve_result = continue_retrieval(vim, retrieve_result)
+    for obj in iter_retrieve_result(vim, retrieve_result):
+        if hasattr(obj, 'propSet'):
+            propSet = obj.propSet
+            if len(propSet) >= 1 and not entity_name:
+                entity_name = propSet[0].val
+            elif len(propSet) >= 1:
+                path = '%s/%s' % (propSet[0].val, path)
     # NOTE(arnaud): slice to exclude the root folder from the result.
     if propSet is not None and len(propSet) > 0:
         path = path[len(propSet[0].val):]
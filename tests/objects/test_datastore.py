@@ -355,7 +355,7 @@ class DatastoreURLTestCase(base.TestCase):
         ds_url = datastore.DatastoreURL.urlparse(url)
         self.assertEqual(path, ds_url.path)
 
-    @mock.patch('six.moves.http_client.HTTPSConnection')
+    @mock.patch('oslo_vmware.http_pool._HTTPSConnection')
     def test_connect(self, mock_conn):
         dc_path = 'datacenter-1'
         ds_name = 'datastore-1'
@@ -365,7 +365,7 @@ class DatastoreURLTestCase(base.TestCase):
         ds_url = datastore.DatastoreURL.urlparse(url)
         cookie = mock.Mock()
         ds_url.connect('PUT', 128, cookie)
-        mock_conn.assert_called_once_with('13.37.73.31')
+        mock_conn.assert_called_once_with('13.37.73.31', context=mock.ANY)
 
     def test_get_transfer_ticket(self):
         dc_path = 'datacenter-1'
@@ -131,7 +131,8 @@ class VMwareAPISessionTest(base.TestCase):
                                         port=VMwareAPISessionTest.PORT,
                                         wsdl_url=api_session._vim_wsdl_loc,
                                         cacert=self.cert_mock,
-                                        insecure=False)
+                                        insecure=False,
+                                        use_fast_path=False)
 
     @mock.patch('oslo_vmware.pbm.Pbm')
     def test_pbm(self, pbm_mock):
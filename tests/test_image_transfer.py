@@ -173,10 +173,9 @@ class FileReadWriteTaskTest(base.TestCase):
             exp_calls.append(mock.call(data_items[i]))
         self.assertEqual(exp_calls, output_file.write.call_args_list)
 
-        self.assertEqual(len(data_items),
-                         input_file.update_progress.call_count)
-        self.assertEqual(len(data_items),
-                         output_file.update_progress.call_count)
+        # The lease progress is updated by the LeaseProgressUpdater.
+        self.assertFalse(input_file.update_progress.called)
+        self.assertFalse(output_file.update_progress.called)
 
     def test_start_with_read_exception(self):
         input_file = mock.Mock()
@@ -232,7 +231,11 @@ class ImageTransferUtilityTest(base.TestCase):
                 image_meta=image_meta)
 
         exp_calls = [mock.call(blocking_queue_size,
-                               max_data_size)] * len(write_file_handles)
+                               max_data_size,
+                               chunk_size=None,
+                               max_bytes=None,
+                               adaptive=False,
+                               digest_task=None)] * len(write_file_handles)
         self.assertEqual(exp_calls,
                          fake_BlockingQueue.call_args_list)
 
@@ -64,7 +64,7 @@ class FileWriteHandleTest(base.TestCase):
 
         self._conn = mock.Mock()
         patcher = mock.patch(
-            'urllib3.connection.HTTPConnection')
+            'oslo_vmware.http_pool._HTTPConnection')
         self.addCleanup(patcher.stop)
         HTTPConnectionMock = patcher.start()
         HTTPConnectionMock.return_value = self._conn
@@ -90,7 +90,7 @@ class VmdkWriteHandleTest(base.TestCase):
         super(VmdkWriteHandleTest, self).setUp()
         self._conn = mock.Mock()
         patcher = mock.patch(
-            'urllib3.connection.HTTPConnection')
+            'oslo_vmware.http_pool._HTTPConnection')
         self.addCleanup(patcher.stop)
         HTTPConnectionMock = patcher.start()
         HTTPConnectionMock.return_value = self._conn
@@ -183,11 +183,11 @@ class VmdkReadHandleTest(base.TestCase):
     def setUp(self):
         super(VmdkReadHandleTest, self).setUp()
 
-        send_patcher = mock.patch('requests.sessions.Session.send')
-        self.addCleanup(send_patcher.stop)
-        send_mock = send_patcher.start()
-        self._response = mock.Mock()
-        send_mock.return_value = self._response
+        patcher = mock.patch('oslo_vmware.http_pool._HTTPConnection')
+        self.addCleanup(patcher.stop)
+        HTTPConnectionMock = patcher.start()
+        self._conn = HTTPConnectionMock.return_value
+        self._response = self._conn.getresponse.return_value
 
     def _create_mock_session(self, disk=True, progress=-1):
         device_url = mock.Mock()
@@ -227,25 +227,25 @@ class VmdkReadHandleTest(base.TestCase):
     def test_read(self):
         chunk_size = rw_handles.READ_CHUNKSIZE
         session = self._create_mock_session()
-        self._response.raw.read.return_value = [1] * chunk_size
+        self._response.read.return_value = [1] * chunk_size
         handle = rw_handles.VmdkReadHandle(session, '10.1.2.3', 443,
                                            'vm-1', '[ds] disk1.vmdk',
                                            chunk_size * 10)
         handle.read(chunk_size)
         self.assertEqual(chunk_size, handle._bytes_read)
-        self._response.raw.read.assert_called_once_with(chunk_size)
+        self._response.read.assert_called_once_with(chunk_size)
 
     def test_update_progress(self):
         chunk_size = rw_handles.READ_CHUNKSIZE
         vmdk_size = chunk_size * 10
         session = self._create_mock_session(True, 10)
-        self._response.raw.read.return_value = [1] * chunk_size
+        self._response.read.return_value = [1] * chunk_size
         handle = rw_handles.VmdkReadHandle(session, '10.1.2.3', 443,
                                            'vm-1', '[ds] disk1.vmdk',
                                            vmdk_size)
         handle.read(chunk_size)
         handle.update_progress()
-        self._response.raw.read.assert_called_once_with(chunk_size)
+        self._response.read.assert_called_once_with(chunk_size)
 
     def test_update_progress_with_error(self):
         session = self._create_mock_session(True, 10)
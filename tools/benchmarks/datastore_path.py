@@ -0,0 +1,72 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the DatastorePath and DatastoreURL operations.
+
+Parses, joins and formats a set of disk paths spread over a few datastores
+the way a driver handling many instances does, and reports the time per
+operation.
+
+Usage:
+    python tools/benchmarks/datastore_path.py [number of paths]
+"""
+
+import sys
+import timeit
+
+from oslo_vmware.objects import datastore
+
+
+def _paths(count):
+    # Grouped by datastore, like the results of a datastore browser search.
+    return ['[datastore%d] instance-%d/disk-%d.vmdk' % (index * 4 // count,
+                                                        index, index % 3)
+            for index in range(count)]
+
+
+def main(argv):
+    count = int(argv[1] if len(argv) > 1 else 10000)
+    paths = _paths(count)
+    parsed = datastore.DatastorePath.parse_many(paths)
+    urls = [str(datastore.DatastoreURL('https', 'esx1', path.rel_path,
+                                       'ha-datacenter', path.datastore))
+            for path in parsed]
+    parse = datastore.DatastorePath.parse
+
+    def formatted():
+        for path in parsed:
+            str(path)
+            str(path)
+
+    cases = [('parse', lambda: [parse(path) for path in paths]),
+             ('parse_many',
+              lambda: datastore.DatastorePath.parse_many(paths)),
+             ('join', lambda: [path.parent.join('disk.vmdk')
+                               for path in parsed]),
+             ('str (twice)', formatted),
+             ('hash', lambda: set(parsed)),
+             ('basename', lambda: [path.basename for path in parsed]),
+             ('url parse',
+              lambda: [datastore.DatastoreURL.urlparse(url)
+                       for url in urls])]
+    for name, func in cases:
+        elapsed = min(timeit.repeat(func, number=1, repeat=5))
+        print('%-15s %8.3f us/path' % (name, elapsed / count * 1e6))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,157 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Throughput benchmark of the FileReadWriteTask transfer pipeline.
+
+Copies data from a local HTTP server standing in for the source host to a
+local HTTP server standing in for the destination datastore, through the
+same reader task, blocking queue and writer task used by image_transfer.
+The copy is made with a source which only supports read(), which takes
+the copying data path, and with the pooled buffer data path using the
+default, a larger and an adaptive chunk size, with a SHA-256 digest
+computed by a DigestTask, and with the copy running in native threads.
+
+Usage:
+    python tools/benchmarks/file_transfer.py [size in MiB]
+"""
+
+import multiprocessing
+import sys
+import time
+
+import eventlet
+import requests
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+from oslo_vmware import image_transfer
+from oslo_vmware import rw_handles
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves GET requests with zeros and discards the PUT request body."""
+
+    protocol_version = 'HTTP/1.1'
+    chunk = b'\0' * (1024 * 1024)
+
+    def do_GET(self):
+        size = int(self.path.strip('/'))
+        self.send_response(200)
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        while size > 0:
+            chunk = self.chunk[:min(size, len(self.chunk))]
+            self.wfile.write(chunk)
+            size -= len(chunk)
+
+    def do_PUT(self):
+        size = int(self.headers['Content-Length'])
+        while size > 0:
+            size -= len(self.rfile.read(min(size, 1024 * 1024)))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+def _serve(port_queue):
+    server = _Server(('127.0.0.1', 0), _Handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+class _ReadOnlyHandle(object):
+    """Source handle hiding readinto() of the wrapped handle."""
+
+    def __init__(self, file_handle):
+        self._file_handle = file_handle
+
+    def read(self, chunk_size):
+        return self._file_handle.read(chunk_size)
+
+    def close(self):
+        self._file_handle.close()
+
+
+def _copy(port, size, use_readinto, digests=None, native=False,
+          **queue_options):
+    source = requests.get('http://127.0.0.1:%d/%d' % (port, size),
+                          stream=True).raw
+    if not use_readinto:
+        source = _ReadOnlyHandle(source)
+    dest = rw_handles.FileWriteHandle('127.0.0.1', port, 'dc', 'ds', None,
+                                      'file', size, scheme='http')
+    digest_task = None
+    if digests:
+        digest_task = image_transfer.DigestTask(digests)
+    if native:
+        queue = image_transfer.NativeBlockingQueue(
+            image_transfer.BLOCKING_QUEUE_SIZE, size,
+            digest_task=digest_task, **queue_options)
+        task_cls = image_transfer.NativeReadWriteTask
+    else:
+        queue = image_transfer.BlockingQueue(
+            image_transfer.BLOCKING_QUEUE_SIZE, size,
+            digest_task=digest_task, **queue_options)
+        task_cls = image_transfer.FileReadWriteTask
+    reader = task_cls(source, queue)
+    writer = task_cls(queue, dest)
+    start = time.time()
+    if digest_task and not native:
+        digest_task.start()
+    reader.start()
+    writer.start()
+    reader.wait()
+    writer.wait()
+    if digest_task:
+        digest_task.finish()
+    dest.close()
+    return time.time() - start
+
+
+def main(argv):
+    size = int(argv[1] if len(argv) > 1 else 512) * 1024 * 1024
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(port_queue,))
+    server.daemon = True
+    server.start()
+    port = port_queue.get()
+    eventlet.monkey_patch()
+
+    modes = [('read', False, {}),
+             ('readinto', True, {}),
+             ('readinto, 1 MiB chunks', True, {'chunk_size': 1024 * 1024}),
+             ('readinto, adaptive', True, {'adaptive': True,
+                                           'max_bytes': 64 * 1024 * 1024}),
+             ('readinto, sha256', True, {'digests': {'sha256': None}}),
+             ('native threads', True, {'native': True}),
+             ('native threads, sha256', True, {'native': True,
+                                               'digests': {'sha256': None}})]
+    for name, use_readinto, queue_options in modes:
+        elapsed = _copy(port, size, use_readinto, **queue_options)
+        print('%-25s %8.1f MiB/s' % (name, size / elapsed / 1024 / 1024))
+    server.terminate()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,134 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Benchmark of the SOAP fast path against the suds marshalling path.
+
+Invokes the methods handled by the fast path through a Service whose
+transport returns canned replies, so that only the client side request
+rendering and reply parsing is measured.
+
+Usage:
+    python tools/benchmarks/soap_fastpath.py <vim WSDL location> [iterations]
+
+The vim WSDL is available at https://<vCenter>/sdk/vimService.wsdl; a local
+copy can be passed as file:///path/to/vimService.wsdl.
+"""
+
+import sys
+import timeit
+
+from suds import transport
+
+from oslo_vmware import service
+from oslo_vmware import soap_fastpath
+from oslo_vmware import vim_util
+
+OBJECT_COUNT = 100
+
+_OBJECT = ('<objects><obj type="VirtualMachine">vm-%(i)d</obj>'
+           '<propSet><name>name</name>'
+           '<val xsi:type="xsd:string">vm-%(i)d</val></propSet></objects>')
+
+_REPLY_BODIES = [
+    ('ContinueRetrievePropertiesEx',
+     '<ContinueRetrievePropertiesExResponse xmlns="urn:vim25"><returnval>%s'
+     '</returnval></ContinueRetrievePropertiesExResponse>' %
+     ''.join([_OBJECT % {'i': i} for i in range(OBJECT_COUNT)])),
+    ('CancelRetrievePropertiesEx',
+     '<CancelRetrievePropertiesExResponse xmlns="urn:vim25"/>'),
+    ('RetrievePropertiesEx',
+     '<RetrievePropertiesExResponse xmlns="urn:vim25"><returnval>'
+     '<token>1</token>%s</returnval></RetrievePropertiesExResponse>' %
+     ''.join([_OBJECT % {'i': i} for i in range(OBJECT_COUNT)])),
+    ('SessionIsActive',
+     '<SessionIsActiveResponse xmlns="urn:vim25"><returnval>true'
+     '</returnval></SessionIsActiveResponse>'),
+    ('HttpNfcLeaseProgress',
+     '<HttpNfcLeaseProgressResponse xmlns="urn:vim25"/>'),
+]
+
+
+class CannedReplyTransport(transport.Transport):
+    """Transport returning a canned reply for each method."""
+
+    def send(self, request):
+        message = request.message
+        for name, body in _REPLY_BODIES:
+            if name.encode('utf-8') in message:
+                reply = (soap_fastpath._ENVELOPE_HEAD + body +
+                         soap_fastpath._ENVELOPE_TAIL).encode('utf-8')
+                return transport.Reply(200, {'content-type': 'text/xml'},
+                                       reply)
+        raise ValueError('Unexpected request: %s' % message)
+
+
+def _create_service(wsdl_loc, use_fast_path):
+    svc = service.Service(wsdl_loc, 'https://localhost/sdk',
+                          use_fast_path=use_fast_path)
+    svc.client.set_options(transport=CannedReplyTransport())
+    return svc
+
+
+def _calls(svc):
+    client_factory = svc.client.factory
+    collector = vim_util.get_moref('propertyCollector', 'PropertyCollector')
+    trav_spec = vim_util.build_recursive_traversal_spec(client_factory)
+    obj_spec = vim_util.build_object_spec(
+        client_factory, vim_util.get_moref('group-d1', 'Folder'), [trav_spec])
+    prop_spec = vim_util.build_property_spec(client_factory)
+    filter_spec = vim_util.build_property_filter_spec(client_factory,
+                                                      [prop_spec],
+                                                      [obj_spec])
+    options = client_factory.create('ns0:RetrieveOptions')
+    options.maxObjects = OBJECT_COUNT
+    lease = vim_util.get_moref('lease-1', 'HttpNfcLease')
+    session_manager = vim_util.get_moref('SessionManager', 'SessionManager')
+    return [
+        ('SessionIsActive',
+         lambda: svc.SessionIsActive(session_manager, sessionID='123',
+                                     userName='admin')),
+        ('HttpNfcLeaseProgress',
+         lambda: svc.HttpNfcLeaseProgress(lease, percent=50)),
+        ('RetrievePropertiesEx',
+         lambda: svc.RetrievePropertiesEx(collector, specSet=[filter_spec],
+                                          options=options)),
+        ('ContinueRetrievePropertiesEx',
+         lambda: svc.ContinueRetrievePropertiesEx(collector, token='1')),
+        ('CancelRetrievePropertiesEx',
+         lambda: svc.CancelRetrievePropertiesEx(collector, token='1')),
+    ]
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    iterations = int(argv[2]) if len(argv) > 2 else 200
+    results = {}
+    for use_fast_path in [False, True]:
+        svc = _create_service(argv[1], use_fast_path)
+        for name, call in _calls(svc):
+            elapsed = timeit.timeit(call, number=iterations)
+            results.setdefault(name, []).append(elapsed * 1e6 / iterations)
+
+    print('%-30s %12s %12s' % ('method', 'suds us/call', 'fast us/call'))
+    for name, (suds_time, fast_time) in sorted(results.items()):
+        print('%-30s %12.1f %12.1f' % (name, suds_time, fast_time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
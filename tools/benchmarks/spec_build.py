@@ -0,0 +1,73 @@
+# Copyright (c) 2014 VMware, Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Micro-benchmark of the per-call spec build overhead of inventory queries.
+
+Compares building the property filter spec of get_objects from scratch with
+using the prebuilt specs cached per client factory.
+
+Usage:
+    python tools/benchmarks/spec_build.py <vim WSDL location> [iterations]
+
+The vim WSDL is available at https://<vCenter>/sdk/vimService.wsdl; a local
+copy can be passed as file:///path/to/vimService.wsdl.
+"""
+
+import sys
+import timeit
+
+from suds import client
+
+from oslo_vmware import vim_util
+
+
+def _build_uncached(client_factory, root_folder):
+    trav_spec = vim_util.build_recursive_traversal_spec(client_factory)
+    obj_spec = vim_util.build_object_spec(client_factory, root_folder,
+                                          [trav_spec])
+    prop_spec = vim_util.build_property_spec(client_factory,
+                                             'VirtualMachine', ['name'])
+    return vim_util.build_property_filter_spec(client_factory, [prop_spec],
+                                               [obj_spec])
+
+
+def _build_cached(client_factory, root_folder):
+    obj_spec = vim_util.get_recursive_object_spec(client_factory,
+                                                  root_folder)
+    prop_spec = vim_util.get_property_spec(client_factory, 'VirtualMachine',
+                                           ['name'])
+    return vim_util.build_property_filter_spec(client_factory, [prop_spec],
+                                               [obj_spec])
+
+
+def main(argv):
+    if len(argv) < 2:
+        print(__doc__)
+        return 1
+    iterations = int(argv[2]) if len(argv) > 2 else 1000
+    client_factory = client.Client(argv[1]).factory
+    root_folder = vim_util.get_moref('group-d1', 'Folder')
+
+    for name, build in [('uncached', _build_uncached),
+                        ('cached', _build_cached)]:
+        elapsed = timeit.timeit(lambda: build(client_factory, root_folder),
+                                number=iterations)
+        print('%-10s %10.1f us/call' % (name, elapsed * 1e6 / iterations))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))